@@ -118,6 +118,30 @@ class Bot(Client):
         except Exception as e:
             logging.error(f"Failed to start cleanup task: {e}")
 
+        # Pick interrupted forwarding jobs back up from their last checkpoint
+        try:
+            from plugins.regix import resume_jobs
+            asyncio.create_task(resume_jobs(self))
+            logging.info("Resuming interrupted forwarding jobs")
+        except Exception as e:
+            logging.error(f"Failed to resume forwarding jobs: {e}")
+
+        # Start scheduled incremental syncs as they fall due
+        try:
+            from plugins.public import run_scheduled_syncs
+            asyncio.create_task(run_scheduled_syncs(self))
+            logging.info("Scheduled sync task started")
+        except Exception as e:
+            logging.error(f"Failed to start scheduled sync task: {e}")
+
+        # Bring enabled FTM Alpha mirrors back; each backfills from where it stopped
+        try:
+            from plugins.ftm_alpha import start_mirrors
+            asyncio.create_task(start_mirrors())
+            logging.info("FTM Alpha mirrors starting")
+        except Exception as e:
+            logging.error(f"Failed to start FTM Alpha mirrors: {e}")
+
     async def grant_sudo_lifetime_subscriptions(self):
         """Grant lifetime Pro subscriptions to all sudo users if not already given"""
         try:
@@ -42,6 +42,37 @@ class Config:
     UPI_ID = environ.get("UPI_ID", "gehlotv697@okaxis")
     CHANNEL_ID=MULTI_FSUB_STR
     MESSAGE_DELAY = float(environ.get("MESSAGE_DELAY", "1.5"))
+    # Bots/userbots a user can attach; a job stripes its sends across all of them
+    MAX_BOTS_PER_USER = int(environ.get("MAX_BOTS_PER_USER", "5"))
+    # Forwarding job scheduler: global running cap, queue size and per-user share
+    MAX_CONCURRENT_JOBS = int(environ.get("MAX_CONCURRENT_JOBS", "50"))
+    MAX_QUEUED_JOBS = int(environ.get("MAX_QUEUED_JOBS", "500"))
+    MAX_JOBS_PER_USER = int(environ.get("MAX_JOBS_PER_USER", "1"))
+    MAX_QUEUED_PER_USER = int(environ.get("MAX_QUEUED_PER_USER", "3"))
+    # Run forwarding jobs in worker processes (worker.py) that claim them from the queue collection;
+    # the bot process then only enqueues
+    USE_WORKERS = environ.get("USE_WORKERS", "False").lower() == "true"
+    WORKER_CONCURRENCY = int(environ.get("WORKER_CONCURRENCY", "10"))
+    WORKER_LEASE = int(environ.get("WORKER_LEASE", "120"))
+    WORKER_MAX_ATTEMPTS = int(environ.get("WORKER_MAX_ATTEMPTS", "3"))
+    # Bounded retries of a failed send: attempts per call, jittered backoff range for network/server
+    # errors, and the longest FloodWait (seconds) a send waits out before giving up on the message
+    RETRY_ATTEMPTS = int(environ.get("RETRY_ATTEMPTS", "4"))
+    RETRY_BASE_DELAY = float(environ.get("RETRY_BASE_DELAY", "1"))
+    RETRY_MAX_DELAY = float(environ.get("RETRY_MAX_DELAY", "30"))
+    MAX_FLOOD_WAIT = int(environ.get("MAX_FLOOD_WAIT", "3600"))
+    # Scheduling weight of each plan tier, and the share of job slots a tier may hold at once
+    TIER_WEIGHTS = {'sudo': 8, 'pro': 4, 'plus': 2, 'free': 1}
+    TIER_SHARE = {'sudo': 1.0, 'pro': 1.0, 'plus': 0.8, 'free': float(environ.get("FREE_JOB_SHARE", "0.5"))}
+    # Started clone clients are pooled across jobs; idle ones are stopped after this many seconds
+    CLIENT_IDLE_TTL = int(environ.get("CLIENT_IDLE_TTL", "600"))
+    MAX_POOLED_CLIENTS = int(environ.get("MAX_POOLED_CLIENTS", "100"))
+    CLIENT_POOL_MEMORY_PERCENT = int(environ.get("CLIENT_POOL_MEMORY_PERCENT", "85"))
+    # Seconds between progress message updates, and the main bot's edit budget (edits/second) across all jobs
+    PROGRESS_INTERVAL = float(environ.get("PROGRESS_INTERVAL", "5"))
+    EDIT_RATE = float(environ.get("EDIT_RATE", "5"))
+    # Seconds FTM Alpha collects new source posts before mirroring them in one call
+    ALPHA_BATCH_WINDOW = float(environ.get("ALPHA_BATCH_WINDOW", "1"))
     # Three-tier pricing structure
     PLAN_PRICING = {
         'plus': {
@@ -86,6 +117,7 @@ class temp(object):
     CANCEL = {}
     forwardings = 0
     BANNED_USERS = []
-    IS_FRWD_CHAT = []
     CURRENT_PROCESSES = {}  # Track ongoing processes per user
+    CONFIG_VERSION = {}  # Bumped on every config write, per user
+    DEBUG_JOBS = set()  # Users whose forwarding jobs log every per-message decision
     
@@ -1,7 +1,8 @@
 from os import environ 
-from config import Config
+from config import Config, temp
 import motor.motor_asyncio
-from pymongo import MongoClient
+from pymongo import MongoClient, ReturnDocument
+from pymongo.errors import DuplicateKeyError
 from bson import ObjectId
 from datetime import datetime, timedelta
 import logging
@@ -10,6 +11,9 @@ from pyrogram.enums import ChatMemberStatus
 # Set up logger
 logger = logging.getLogger(__name__)
 
+# Days a finished process's dead letters stay retryable
+DEAD_LETTER_DAYS = 30
+
 async def mongodb_version():
     x = MongoClient(Config.DATABASE_URI)
     mongodb_version = x.server_info()['version']
@@ -25,6 +29,9 @@ class Database:
         self.nfy = self.db.notify
         self.chl = self.db.channels
         self.queue_col = self.db.queue  # For crash recovery queue
+        self.lock_col = self.db.target_locks  # Target chat -> queue item a worker is writing to it
+        self.dup_col = self.db.duplicates  # Content keys already forwarded, per target chat
+        self.sync_col = self.db.sync_marks  # Last forwarded message id per (user, source, target)
         self.premium_col = self.db.premium_users  # Premium users collection
         self.payment_col = self.db.payment_verifications  # Payment verification collection
         self.usage_col = self.db.usage_tracking  # Monthly usage tracking
@@ -113,7 +120,15 @@ class Database:
         return b_users
 
     async def update_configs(self, id, configs):
-        await self.col.update_one({'id': int(id)}, {'$set': {'configs': configs}})
+        await self.col.update_one({'id': int(id)}, {'$set': {'configs': configs}, '$inc': {'config_version': 1}})
+        # Running jobs compare this against their ForwardPlan to know when to reload;
+        # worker processes copy the stored `config_version` into it instead (see get_config_versions)
+        temp.CONFIG_VERSION[int(id)] = temp.CONFIG_VERSION.get(int(id), 0) + 1
+
+    async def get_config_versions(self, user_ids):
+        """Stored config write counter of each user, for processes that did not make the writes"""
+        users = self.col.find({'id': {'$in': [int(u) for u in user_ids]}}, {'id': 1, 'config_version': 1})
+        return {user['id']: user.get('config_version', 0) async for user in users}
 
     async def update_user_config(self, user_id, key, value):
         """Update a specific configuration key for a user"""
@@ -142,11 +157,14 @@ class Database:
             'size_limit': None,
             'extension': None,
             'keywords': None,
+            'exclude_keywords': None,
+            'regex': None,
             'ftm_mode': False,  # Now called FTM Delta mode
             'ftm_alpha_mode': False,  # New FTM Alpha mode for real-time forwarding
             'alpha_source_chat': None,  # Source channel for Alpha mode
             'alpha_target_chat': None,  # Target channel for Alpha mode
             'protect': None,
+            'drop_captions': False,
             'filters': {
                 'text': True,
                 'photo': True, 
@@ -166,16 +184,28 @@ class Database:
         return default 
 
     async def add_bot(self, datas):
-       if not await self.is_bot_exist(datas['user_id']):
+       # A user may attach several accounts; the same account is only stored once
+       if not await self.bot.find_one({'user_id': datas['user_id'], 'id': datas['id']}):
           await self.bot.insert_one(datas)
 
-    async def remove_bot(self, user_id):
-       await self.bot.delete_many({'user_id': int(user_id)})
+    async def remove_bot(self, user_id, bot_id=None):
+       query = {'user_id': int(user_id)}
+       if bot_id is not None:
+          query['id'] = int(bot_id)
+       await self.bot.delete_many(query)
 
     async def get_bot(self, user_id: int):
+       """Get the user's primary (first added) bot"""
        bot = await self.bot.find_one({'user_id': user_id})
        return bot if bot else None
 
+    async def get_bots(self, user_id: int):
+       """Get every bot/userbot the user has added, primary first"""
+       return await self.bot.find({'user_id': user_id}).to_list(length=None)
+
+    async def get_bot_by_id(self, user_id: int, bot_id: int):
+       return await self.bot.find_one({'user_id': user_id, 'id': int(bot_id)})
+
     async def is_bot_exist(self, user_id):
        bot = await self.bot.find_one({'user_id': user_id})
        return bool(bot)
@@ -231,37 +261,213 @@ class Database:
        return self.nfy.find({})
 
     # Queue management for crash recovery
-    async def add_queue_item(self, user_id, process_data):
-        """Add a forwarding process to the queue"""
+    async def add_queue_item(self, user_id, process_data, status='active', priority=0):
+        """Add a forwarding process to the queue; 'queued' items wait for a worker to claim them"""
         queue_item = {
             'user_id': user_id,
-            'status': 'active',
+            'status': status,
+            'priority': priority,
             'created_at': datetime.utcnow(),
             'process_data': process_data
         }
         result = await self.queue_col.insert_one(queue_item)
         return result.inserted_id
 
-    async def update_queue_status(self, user_id, status):
-        """Update queue status (active, completed, cancelled)"""
+    async def update_queue_status(self, user_id, status, queue_id=None):
+        """Update queue status (active, completed, cancelled, failed)"""
+        query = {'_id': queue_id} if queue_id else {'user_id': user_id, 'status': 'active'}
         return await self.queue_col.update_one(
-            {'user_id': user_id, 'status': 'active'},
+            query,
             {'$set': {'status': status, 'updated_at': datetime.utcnow()}}
         )
 
+    async def save_checkpoint(self, queue_id, checkpoint):
+        """Store how far an active process got so it can resume after a restart"""
+        checkpoint['updated_at'] = datetime.utcnow()
+        return await self.queue_col.update_one(
+            {'_id': queue_id, 'status': 'active'},
+            {'$set': {'checkpoint': checkpoint}}
+        )
+
+    async def save_dead_letters(self, queue_id, dead_letters):
+        """Store the message ids a finished process failed to send, per target chat"""
+        return await self.queue_col.update_one({'_id': queue_id}, {'$set': {'dead_letters': dead_letters}})
+
+    async def get_dead_letters(self, user_id, queue_id):
+        """The user's finished process with its dead letters, or None if none are left"""
+        return await self.queue_col.find_one(
+            {'_id': ObjectId(queue_id), 'user_id': int(user_id), 'dead_letters': {'$exists': True, '$ne': {}}})
+
+    async def take_dead_letters(self, queue_id, target):
+        """Remove and return one target's dead letter ids, so only one retry can pick them up"""
+        field = f'dead_letters.{target}'
+        item = await self.queue_col.find_one_and_update(
+            {'_id': queue_id, field: {'$exists': True}},
+            {'$unset': {field: ''}}
+        )
+        # Nothing left to retry: let remove_completed_queues clean the item up
+        await self.queue_col.update_one({'_id': queue_id, 'dead_letters': {}}, {'$unset': {'dead_letters': ''}})
+        return item['dead_letters'][target] if item else None
+
+    async def restore_dead_letters(self, queue_id, target, ids):
+        """Put back a target's dead letters whose retry could not be started"""
+        return await self.queue_col.update_one({'_id': queue_id}, {'$set': {f'dead_letters.{target}': ids}})
+
     async def get_active_queues(self):
         """Get all active forwarding processes for crash recovery"""
-        return await self.queue_col.find({'status': 'active'}).to_list(length=100)
+        return await self.queue_col.find({'status': 'active'}).to_list(length=None)
+
+    async def fail_unresumable_queues(self):
+        """Mark active items with neither a job id nor a checkpoint as failed; returns how many.
+
+        Those were left behind before jobs kept either (error paths used to
+        leave items active), and running them would re-forward their whole
+        range from the original skip.
+        """
+        result = await self.queue_col.update_many(
+            {'status': 'active', 'process_data.job_id': {'$exists': False}, 'checkpoint': {'$exists': False}},
+            {'$set': {'status': 'failed', 'updated_at': datetime.utcnow()}}
+        )
+        return result.modified_count
+
+    # Worker leases: a worker process owns an active item only while its lease is fresh
+    async def ensure_queue_indexes(self):
+        await self.queue_col.create_index([('status', 1), ('priority', -1), ('created_at', 1)])
+        await self.queue_col.create_index([('worker', 1), ('status', 1)])
+        await self.lock_col.create_index('worker')
+        await self.lock_col.create_index('item')
+
+    async def has_pending_job(self, job_id):
+        """Whether a job with this id is still waiting for or owned by a worker"""
+        return await self.queue_col.find_one(
+            {'process_data.job_id': job_id, 'status': {'$in': ['queued', 'active']}}, {'_id': 1}) is not None
+
+    async def claim_queue_item(self, worker_id, lease_seconds):
+        """Atomically take the next queued item, or an active one whose worker's lease ran out.
+
+        Only one worker writes to a target chat at a time: the claim also
+        takes a lock document for each target of the job, fan-out ones
+        included (`_id` is the target, so two inserts cannot both succeed),
+        and an item with a target that turns out to be locked is handed
+        back as it was.
+        """
+        now = datetime.utcnow()
+        lease_until = now + timedelta(seconds=lease_seconds)
+        # Skip targets that are already locked; the lock below settles races between workers
+        busy = await self.lock_col.distinct('_id', {'until': {'$gte': now}})
+        item = await self.queue_col.find_one_and_update(
+            # Active items without a lease were left by a bot process running jobs itself
+            {'$or': [{'status': 'queued'}, {'status': 'active', 'lease_until': {'$lt': now}},
+                     {'status': 'active', 'lease_until': {'$exists': False}, 'process_data.job_id': {'$exists': True}}],
+             'process_data.to_chat': {'$nin': busy}, 'process_data.fanout': {'$nin': busy}},
+            {'$set': {'status': 'active', 'worker': worker_id, 'lease_until': lease_until},
+             '$inc': {'attempts': 1}},
+            sort=[('priority', -1), ('created_at', 1)],
+            return_document=ReturnDocument.BEFORE
+        )
+        if item is None:
+            return None
+        data = item.get('process_data') or {}
+        try:
+            for target in [data.get('to_chat')] + list(data.get('fanout') or []):
+                # Taken over when the holder's lease ran out, or when it is this item's own lock from an earlier run
+                await self.lock_col.update_one(
+                    {'_id': target, '$or': [{'until': {'$lt': now}}, {'item': item['_id']}]},
+                    {'$set': {'item': item['_id'], 'worker': worker_id, 'until': lease_until}},
+                    upsert=True
+                )
+        except DuplicateKeyError:
+            await self.lock_col.delete_many({'item': item['_id']})
+            await self.queue_col.update_one(
+                {'_id': item['_id'], 'worker': worker_id},
+                {'$set': {'status': item['status'], 'lease_until': item.get('lease_until', now)},
+                 '$unset': {'worker': ''}, '$inc': {'attempts': -1}}
+            )
+            return None
+        item.update({'status': 'active', 'worker': worker_id, 'lease_until': lease_until, 'attempts': item.get('attempts', 0) + 1})
+        return item
+
+    async def renew_leases(self, worker_id, lease_seconds):
+        """Extend every lease the worker holds; returns the user ids whose jobs were asked to cancel"""
+        lease_until = datetime.utcnow() + timedelta(seconds=lease_seconds)
+        await self.queue_col.update_many({'worker': worker_id, 'status': 'active'}, {'$set': {'lease_until': lease_until}})
+        await self.lock_col.update_many({'worker': worker_id}, {'$set': {'until': lease_until}})
+        return await self.queue_col.distinct('user_id', {'worker': worker_id, 'status': 'active', 'cancel': True})
+
+    async def get_queue_item(self, queue_id):
+        return await self.queue_col.find_one({'_id': queue_id})
+
+    async def cancel_requested(self, queue_id):
+        """Whether the bot process asked the worker running this item to stop it"""
+        return await self.queue_col.find_one({'_id': queue_id, 'cancel': True}, {'_id': 1}) is not None
+
+    async def release_queue_item(self, queue_id, requeue=False, delay=0):
+        """Drop the worker's lease; `requeue` lets another worker claim the unfinished item after `delay` seconds"""
+        update = {'$unset': {'worker': '', 'lease_until': ''}}
+        if requeue:
+            # Handing an item back is not a failed attempt
+            update = {'$set': {'lease_until': datetime.utcnow() + timedelta(seconds=delay)},
+                      '$unset': {'worker': ''}, '$inc': {'attempts': -1}}
+        await self.lock_col.delete_many({'item': queue_id})
+        return await self.queue_col.update_one({'_id': queue_id}, update)
+
+    async def request_cancel(self, user_id, running=True):
+        """Cancel the user's queued items and, with `running`, ask workers to stop the active ones; returns how many were queued"""
+        result = await self.queue_col.update_many(
+            {'user_id': user_id, 'status': 'queued'},
+            {'$set': {'status': 'cancelled', 'updated_at': datetime.utcnow()}}
+        )
+        if running:
+            await self.queue_col.update_many(
+                {'user_id': user_id, 'status': 'active'},
+                {'$set': {'cancel': True}}
+            )
+        return result.modified_count
 
     async def remove_completed_queues(self):
         """Clean up completed/cancelled queue items older than 1 day"""
         cutoff = datetime.utcnow() - timedelta(days=1)
         result = await self.queue_col.delete_many({
-            'status': {'$in': ['completed', 'cancelled']},
-            'updated_at': {'$lt': cutoff}
+            'status': {'$in': ['completed', 'cancelled', 'failed']},
+            'updated_at': {'$lt': cutoff},
+            # Items with dead letters back the Retry button of their completion message
+            '$or': [{'dead_letters': {'$exists': False}},
+                    {'updated_at': {'$lt': datetime.utcnow() - timedelta(days=DEAD_LETTER_DAYS)}}]
         })
         return result.deleted_count
 
+    # Incremental sync high-water marks
+    async def set_sync_mark(self, user_id, from_chat, to_chat, last_id, plan_hash):
+        """Record how far a source -> target pair has been forwarded"""
+        return await self.sync_col.update_one(
+            {'user_id': int(user_id), 'from_chat': str(from_chat), 'to_chat': str(to_chat)},
+            {'$set': {'last_id': int(last_id), 'plan_hash': plan_hash, 'updated_at': datetime.utcnow()},
+             '$setOnInsert': {'every_hours': 0, 'next_run': None}},
+            upsert=True
+        )
+
+    async def get_sync_mark(self, user_id, mark_id):
+        return await self.sync_col.find_one({'_id': ObjectId(mark_id), 'user_id': int(user_id)})
+
+    async def get_sync_marks(self, user_id):
+        """Get every source -> target pair the user has forwarded, latest first"""
+        return await self.sync_col.find({'user_id': int(user_id)}).sort('updated_at', -1).to_list(length=50)
+
+    async def set_sync_schedule(self, mark_id, every_hours):
+        """Run the pair's sync every `every_hours` hours; 0 turns scheduling off"""
+        next_run = datetime.utcnow() + timedelta(hours=every_hours) if every_hours else None
+        return await self.sync_col.update_one(
+            {'_id': ObjectId(mark_id)},
+            {'$set': {'every_hours': int(every_hours), 'next_run': next_run}}
+        )
+
+    async def get_due_syncs(self):
+        """Get scheduled syncs whose next run time has passed"""
+        return await self.sync_col.find({'every_hours': {'$gt': 0}, 'next_run': {'$lte': datetime.utcnow()}}).to_list(length=None)
+
+    async def delete_sync_mark(self, mark_id):
+        return await self.sync_col.delete_one({'_id': ObjectId(mark_id)})
+
     # Premium user management
     async def add_premium_user(self, user_id, plan_type="pro", duration_days=30, amount_paid=None):
         """Add a user to premium with three-tier support"""
@@ -375,24 +581,38 @@ class Database:
             }
         return config
     
-    async def set_alpha_config(self, user_id, enabled=None, source_chat=None, target_chat=None, auto_forward=None):
+    async def set_alpha_config(self, user_id, enabled=None, source_chat=None, target_chat=None, auto_forward=None, last_id=None):
         """Set FTM Alpha mode configuration for user"""
         update_data = {}
+        update = {}
         if enabled is not None:
             update_data['enabled'] = enabled
         if source_chat is not None:
             update_data['source_chat'] = source_chat
+            # A new source starts mirroring from its current head
+            update['$unset'] = {'last_id': ''}
         if target_chat is not None:
             update_data['target_chat'] = target_chat
         if auto_forward is not None:
             update_data['auto_forward'] = auto_forward
+        if last_id is not None:
+            update_data['last_id'] = last_id
+        if update_data:
+            update['$set'] = update_data
+        if not update:
+            # Nothing to change; Mongo rejects an empty update
+            return None
         
         return await self.alpha_config_col.update_one(
             {'user_id': int(user_id)},
-            {'$set': update_data},
+            update,
             upsert=True
         )
 
+    async def get_enabled_alpha_configs(self):
+        """All FTM Alpha configurations that are switched on"""
+        return await self.alpha_config_col.find({'enabled': True}).to_list(length=None)
+
     async def get_forwarding_limit(self, user_id):
         """Get user's daily forwarding limit"""
         features = await self.get_user_plan_features(user_id)
@@ -1 +1,230 @@
-# This file has been removed as Alpha mode is no longer supported
\ No newline at end of file
+import asyncio
+import logging
+import itertools
+from pyrogram import filters, raw
+from pyrogram.handlers import MessageHandler
+from pyrogram.errors import RandomIdDuplicate
+from database import db
+from config import Config
+from utils.rate_limiter import get_limiter
+from utils.retry import SEND_RETRY, classify, PERMANENT
+from .test import client_pool, latest_message_id, RANGE_SIZE
+
+logger = logging.getLogger(__name__)
+
+# Most ids one ForwardMessages call accepts
+BATCH_SIZE = 100
+# Seconds before a failed mirror restarts, doubling with every failure in a row up to the cap
+RESTART_DELAY = 5
+MAX_RESTART_DELAY = 300
+
+# Every mirror gets its own handler group: within a group only the first
+# matching handler runs, and two users may mirror the same source
+_groups = itertools.count(100)
+
+class AlphaMirror:
+    """Mirror every new post of one source chat into one target chat.
+
+    A handler on the user's pooled clone client collects posts from the
+    moment the mirror starts. Posts between the saved watermark (`last_id`)
+    and the chat's head are backfilled first while live posts wait; after
+    that everything that arrives within `window` seconds is sent in one
+    call. Only ids above the watermark are sent and the watermark is saved
+    after each batch, so neither the handoff nor a restart skips or repeats
+    a post. A mirror without a watermark yet starts at the first live post
+    instead of walking the source to find its head.
+
+    Calls go through the send retry policy. An error that outlasts it
+    restarts the mirror with backoff, on a fresh client, from the
+    watermark; the backfill then picks up whatever was missed.
+    """
+
+    def __init__(self, user_id, bot_data, source, target, last_id=None, window=1.0):
+        self.user_id = user_id
+        self.bot_data = bot_data
+        self.source = source
+        self.target = target
+        self.last_id = last_id
+        self.window = window
+        self.pending = {}  # id -> message, received live or backfilled
+        self.wakeup = asyncio.Event()
+        self.client = None
+        self.handler = None
+        self.task = None
+        self.failures = 0  # restarts in a row without getting back to live posts
+
+    def start(self):
+        self.task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self.task:
+            self.task.cancel()
+            try:
+                await self.task
+            except (asyncio.CancelledError, Exception):
+                pass
+        await self._detach()
+
+    async def _detach(self, error=None):
+        if self.client:
+            if self.handler:
+                try:
+                    self.client.remove_handler(*self.handler)
+                except Exception:
+                    pass
+            await client_pool.release(self.client, error)
+            self.client = self.handler = None
+
+    async def _on_message(self, client, message):
+        if self.last_id is None:
+            # First start for this source: mirror what is posted from now on
+            self.last_id = message.id - 1
+        if message.id <= self.last_id:
+            return
+        self.pending[message.id] = message
+        self.wakeup.set()
+
+    async def _run(self):
+        while True:
+            try:
+                await self._mirror()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                self.failures += 1
+                delay = min(MAX_RESTART_DELAY, RESTART_DELAY * 2 ** (self.failures - 1))
+                logger.error(f"Alpha mirror of user {self.user_id} ({self.source} -> {self.target}) failed, "
+                             f"restarting from {self.last_id} in {delay} s: {e}", exc_info=True)
+                await self._detach(e)
+                # Unsent posts are fetched again by the backfill
+                self.pending.clear()
+                await asyncio.sleep(delay)
+
+    async def _mirror(self):
+        self.client = await client_pool.acquire(self.bot_data)
+        # Subscribe before reading the head, so every post above it reaches the handler
+        self.handler = self.client.add_handler(
+            MessageHandler(self._on_message, filters.chat(self.source)), next(_groups))
+        if self.last_id is not None:
+            head = await SEND_RETRY.call(latest_message_id, self.client, self.source, self.last_id)
+            if head > self.last_id:
+                logger.info(f"Alpha {self.user_id}: backfilling {self.source} from {self.last_id + 1} to {head}")
+                await self._backfill(head)
+        self.failures = 0
+        while True:
+            await self.wakeup.wait()
+            await asyncio.sleep(self.window)
+            self.wakeup.clear()
+            await self._flush()
+
+    async def _backfill(self, head):
+        start = self.last_id + 1
+        while start <= head:
+            end = min(head, start + RANGE_SIZE - 1)
+            for message in await SEND_RETRY.call(self.client.get_messages, self.source, list(range(start, end + 1))):
+                if not message.empty:
+                    self.pending.setdefault(message.id, message)
+            # Live posts above this range stay queued until their turn
+            await self._flush(upto=end)
+            start = end + 1
+
+    async def _flush(self, upto=None):
+        ids = sorted(i for i in self.pending if upto is None or i <= upto)
+        messages = [self.pending.pop(i) for i in ids]
+        messages = [m for m in messages if m.id > self.last_id]
+        while messages:
+            chunk = self._chunk(messages)
+            messages = messages[len(chunk):]
+            await self._send([m.id for m in chunk if not m.service and not m.empty])
+            self.last_id = chunk[-1].id
+            await db.set_alpha_config(self.user_id, last_id=self.last_id)
+
+    @staticmethod
+    def _chunk(messages):
+        """Up to BATCH_SIZE leading messages, never splitting an album across calls"""
+        if len(messages) <= BATCH_SIZE:
+            return messages
+        cut = BATCH_SIZE
+        group = messages[cut].media_group_id
+        while group and cut > 1 and messages[cut - 1].media_group_id == group:
+            cut -= 1
+        return messages[:cut]
+
+    async def _send(self, ids):
+        if not ids:
+            return
+        client = self.client
+        bucket = get_limiter(client.me.id, self.target, client.me.is_bot, 'channel')
+        async def on_flood(seconds):
+            bucket.flood(seconds)
+        # Kept across retries: a repeat of a call that went through is refused with RANDOM_ID_DUPLICATE
+        random_ids = [client.rnd_id() for _ in ids]
+        async def forward():
+            await bucket.acquire()
+            return await client.invoke(
+                raw.functions.messages.ForwardMessages(
+                    from_peer=await client.resolve_peer(self.source),
+                    to_peer=await client.resolve_peer(self.target),
+                    id=ids,
+                    random_id=random_ids,
+                    drop_author=True
+                )
+            )
+        try:
+            await SEND_RETRY.call(forward, on_flood=on_flood)
+            bucket.success()
+            return
+        except RandomIdDuplicate:
+            # An earlier attempt of this batch was posted
+            return
+        except Exception as e:
+            if classify(e) != PERMANENT:
+                # Network trouble or a flood too long to wait: restart from the watermark
+                raise
+            # One bad id fails the whole call; copy the batch one by one instead
+            logger.warning(f"Alpha {self.user_id}: mirroring {len(ids)} posts failed, copying individually: {e}")
+        async def copy(msg_id):
+            await bucket.acquire()
+            return await client.copy_message(chat_id=self.target, from_chat_id=self.source, message_id=msg_id)
+        for msg_id in ids:
+            try:
+                await SEND_RETRY.call(copy, msg_id, on_flood=on_flood)
+                bucket.success()
+            except Exception as e:
+                logger.warning(f"Alpha {self.user_id}: post {msg_id} could not be mirrored: {e}")
+
+MIRRORS = {}
+
+async def start_mirror(user_id):
+    """(Re)start the user's mirror from their saved Alpha config; None if it is off or incomplete"""
+    await stop_mirror(user_id)
+    config = await db.get_alpha_config(user_id)
+    if not config.get('enabled') or not config.get('source_chat') or not config.get('target_chat'):
+        return None
+    if not await db.can_use_ftm_alpha_mode(user_id):
+        return None
+    bot_data = await db.get_bot(user_id)
+    if not bot_data:
+        return None
+    mirror = MIRRORS[user_id] = AlphaMirror(
+        user_id, bot_data, config['source_chat'], config['target_chat'],
+        config.get('last_id'), Config.ALPHA_BATCH_WINDOW)
+    mirror.start()
+    logger.info(f"Alpha mirror started for user {user_id}: {config['source_chat']} -> {config['target_chat']}")
+    return mirror
+
+async def stop_mirror(user_id):
+    mirror = MIRRORS.pop(user_id, None)
+    if mirror:
+        await mirror.stop()
+
+async def start_mirrors():
+    """Start every enabled mirror; called once the bot is up"""
+    started = 0
+    for config in await db.get_enabled_alpha_configs():
+        try:
+            if await start_mirror(config['user_id']):
+                started += 1
+        except Exception as e:
+            logger.error(f"Failed to start Alpha mirror for user {config['user_id']}: {e}")
+    logger.info(f"Started {started} FTM Alpha mirrors")
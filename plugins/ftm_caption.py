@@ -0,0 +1,118 @@
+import re
+import html
+import string
+from .ftm_utils import FTM_SOURCE, FTM_TARGET
+
+# Placeholders a custom caption may use, with what they stand for
+PLACEHOLDERS = {
+    'caption': 'Original caption',
+    'filename': 'File name',
+    'size': 'File size',
+    'mime': 'MIME type',
+    'date': 'Post date',
+    'source_link': 'Source message link',
+}
+
+# Telegram's limits for a media caption
+CAPTION_LIMIT = 1024
+ENTITY_LIMIT = 100
+
+_TAG = re.compile(r'<[^>]+>')
+_OPEN_TAG = re.compile(r'<(?!/)[^>]+>')
+
+def utf16_len(text):
+    """Length as Telegram counts it (UTF-16 code units)"""
+    return len(text.encode('utf-16-le')) // 2
+
+def measure(markup):
+    """(visible length, entity count) of HTML markup"""
+    return utf16_len(html.unescape(_TAG.sub('', markup))), len(_OPEN_TAG.findall(markup))
+
+def format_size(size):
+    for unit in ("B", "KB", "MB", "GB"):
+        if size < 1024:
+            return f"{size:.2f} {unit}" if unit != "B" else f"{size} {unit}"
+        size /= 1024
+    return f"{size:.2f} TB"
+
+def _media(message):
+    return getattr(message, message.media.value, None) if message.media else None
+
+# How each placeholder other than {caption} is filled; all of them are short
+_FIELDS = {
+    'filename': lambda message, link: html.escape(getattr(_media(message), 'file_name', None) or ''),
+    'size': lambda message, link: format_size(getattr(_media(message), 'file_size', None) or 0),
+    'mime': lambda message, link: getattr(_media(message), 'mime_type', None) or '',
+    'date': lambda message, link: message.date.strftime('%d %b %Y') if message.date else '',
+    'source_link': lambda message, link: link or '',
+}
+
+# Room an FTM footer (source and target line) takes in a caption
+FTM_RESERVE = measure(FTM_SOURCE + FTM_TARGET)
+
+class CaptionTemplate:
+    """A user's custom caption, compiled once per job.
+
+    The template is split into literal markup and placeholders up front and
+    the length and entity count of its own markup are measured then, so
+    `render()` only fills the placeholders that occur and keeps within
+    Telegram's caption limits by arithmetic instead of re-parsing. When the
+    result would be too long the original caption is what gets shortened.
+    """
+
+    def __init__(self, template):
+        self.template = template
+        self.parts = []  # (literal, placeholder or None)
+        try:
+            for literal, field, spec, conv in string.Formatter().parse(template):
+                if field is not None and field not in PLACEHOLDERS:
+                    # Names we do not know are kept as written
+                    literal += '{' + field + (f'!{conv}' if conv else '') + (f':{spec}' if spec else '') + '}'
+                    field = None
+                self.parts.append((literal, field))
+        except ValueError:
+            # Stray braces: treat the whole template as text
+            self.parts = [(template, None)]
+        self.fields = {field for _, field in self.parts if field}
+        self.literal = ''.join(literal for literal, _ in self.parts)
+        self.length, self.entities = measure(self.literal)
+
+    def render(self, message, source_link=None, ftm=False):
+        if not self.fields:
+            return self.literal
+        length, entities = self.length, self.entities
+        if ftm:
+            length += FTM_RESERVE[0]
+            entities += FTM_RESERVE[1]
+        values = {}
+        for field in self.fields:
+            if field != 'caption':
+                values[field] = value = _FIELDS[field](message, source_link)
+                length += utf16_len(html.unescape(value))
+        if 'caption' in self.fields:
+            values['caption'] = self._caption(message, CAPTION_LIMIT - length, ENTITY_LIMIT - entities)
+        return ''.join(literal + (values[field] if field else '') for literal, field in self.parts)
+
+    @staticmethod
+    def _caption(message, room, entity_room):
+        caption = message.caption
+        if not caption:
+            return ''
+        if utf16_len(caption) <= room:
+            # Keep the original formatting unless it would push past the entity limit
+            if len(message.caption_entities or []) <= entity_room:
+                return caption.html
+            return html.escape(caption)
+        if room <= 1:
+            return ''
+        cut = caption[:room - 1]
+        while utf16_len(cut) > room - 1:
+            cut = cut[:-1]
+        return html.escape(cut) + '…'
+
+# The caption of a message as it is, shortened only when an FTM footer needs the room
+ORIGINAL_CAPTION = CaptionTemplate('{caption}')
+
+def compile_caption(caption):
+    """CaptionTemplate for a user's caption setting, or None when none is set"""
+    return CaptionTemplate(caption) if caption is not None else None
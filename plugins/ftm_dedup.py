@@ -0,0 +1,136 @@
+import re
+import asyncio
+import hashlib
+import logging
+from datetime import datetime
+import motor.motor_asyncio
+from pymongo import UpdateOne
+from database import db
+from utils.bloom import BloomFilter
+
+logger = logging.getLogger(__name__)
+
+# Smallest Bloom filter built for a target; bigger archives get twice their current size
+MIN_BLOOM_CAPACITY = 50000
+
+_SPACES = re.compile(r'\s+')
+
+def message_key(message):
+    """Identity of a message's content: file_unique_id for media, a hash of the normalized text otherwise"""
+    if message.media:
+        media = getattr(message, message.media.value, None)
+        unique_id = getattr(media, 'file_unique_id', None)
+        return f"f:{unique_id}" if unique_id else None
+    if message.text:
+        text = _SPACES.sub(' ', message.text).strip().lower()
+        if text:
+            return "t:" + hashlib.sha1(text.encode()).hexdigest()
+    return None
+
+class DuplicateIndex:
+    """Content keys already forwarded into one target chat.
+
+    Mongo holds the authoritative set (unique on target + key); an in-memory
+    Bloom filter answers the common "never seen" case without a round-trip.
+    Keys are reserved in memory when a message is accepted and written to
+    Mongo with `record()` once it has been sent.
+
+    The filter only knows the keys this process loaded or wrote. Other
+    processes (worker mode) add keys too, so `load()`, which runs whenever
+    a job opens the target, rebuilds it when Mongo holds more keys than it
+    has seen. While a job runs nobody else writes its targets: workers lock
+    every target of a job, fan-out ones included, when they claim it.
+    """
+
+    def __init__(self, collection, target):
+        self.col = collection
+        self.target = str(target)
+        self.bloom = None
+        self.known = 0  # keys in Mongo as far as this process knows
+        self.pending = set()
+        self.lock = asyncio.Lock()
+
+    async def load(self):
+        async with self.lock:
+            query = {'target': self.target}
+            count = await self.col.count_documents(query)
+            if self.bloom is not None and not self.bloom.saturated() and count <= self.known:
+                return self
+            bloom = BloomFilter(max(MIN_BLOOM_CAPACITY, count * 2))
+            async for doc in self.col.find(query, {'key': 1, '_id': 0}).batch_size(5000):
+                bloom.add(doc['key'])
+            self.bloom = bloom
+            self.known = count
+            logger.info(f"Loaded {count} duplicate keys for target {self.target}")
+        return self
+
+    async def seen(self, key):
+        if key in self.pending:
+            return True
+        if key not in self.bloom:
+            return False
+        return await self.col.find_one({'target': self.target, 'key': key}, {'_id': 1}) is not None
+
+    def reserve(self, key):
+        self.pending.add(key)
+        self.bloom.add(key)
+
+    def abandon(self):
+        """Forget reservations whose sends never ran (job stopped or failed)"""
+        self.pending.clear()
+
+    def recorder(self, keys, ids=None, failed=()):
+        """Coroutine function `record(sent)` that stores `keys` if the send holding them went through.
+
+        `ids` are the message ids the keys belong to, in order. The send
+        functions catch their own failures and list the ids in `failed` (the
+        job's dead letters), so keys of those ids are left out even when the
+        unit as a whole ran.
+        """
+        pairs = [(key, i) for key, i in zip(keys, ids if ids is not None else [None] * len(keys)) if key]
+        keys = [key for key, _ in pairs]
+        async def record(sent):
+            if not keys:
+                return
+            lost = set(failed) if sent else None
+            delivered = [key for key, i in pairs if i not in lost] if sent else []
+            if not delivered:
+                self.pending.difference_update(keys)
+                return
+            now = datetime.utcnow()
+            try:
+                result = await self.col.bulk_write([
+                    UpdateOne({'target': self.target, 'key': key}, {'$setOnInsert': {'at': now}}, upsert=True)
+                    for key in delivered
+                ], ordered=False)
+                self.known += result.upserted_count
+            except Exception as e:
+                logger.warning(f"Failed to record {len(keys)} duplicate keys for {self.target}: {e}")
+            finally:
+                self.pending.difference_update(keys)
+        return record
+
+_clients = {}
+_indexed = set()
+_indexes = {}
+
+async def _collection(db_uri):
+    if db_uri:
+        client = _clients.get(db_uri)
+        if client is None:
+            client = _clients[db_uri] = motor.motor_asyncio.AsyncIOMotorClient(db_uri)
+        col = client.get_default_database('forward-bot').duplicates
+    else:
+        col = db.dup_col
+    if db_uri not in _indexed:
+        await col.create_index([('target', 1), ('key', 1)], unique=True)
+        _indexed.add(db_uri)
+    return col
+
+async def get_duplicate_index(target, db_uri=None):
+    """Shared, loaded DuplicateIndex for `target`, stored in the user's own database when `db_uri` is set"""
+    cache_key = (db_uri, str(target))
+    index = _indexes.get(cache_key)
+    if index is None:
+        index = _indexes[cache_key] = DuplicateIndex(await _collection(db_uri), target)
+    return await index.load()
@@ -0,0 +1,276 @@
+import re
+import logging
+from collections import deque
+try:
+    from re import _parser as sre_parse
+except ImportError:  # Python < 3.11
+    import sre_parse
+try:
+    # Same syntax as re, but a search can be given a timeout
+    import regex as regex_engine
+except ImportError:
+    regex_engine = None
+
+logger = logging.getLogger(__name__)
+
+# One bit per message type toggle in configs['filters']
+TEXT = 1 << 0
+PHOTO = 1 << 1
+VIDEO = 1 << 2
+DOCUMENT = 1 << 3
+AUDIO = 1 << 4
+VOICE = 1 << 5
+ANIMATION = 1 << 6
+STICKER = 1 << 7
+POLL = 1 << 8
+IMAGE_TEXT = 1 << 9
+
+TYPE_BITS = {
+    'text': TEXT,
+    'photo': PHOTO,
+    'video': VIDEO,
+    'document': DOCUMENT,
+    'audio': AUDIO,
+    'voice': VOICE,
+    'animation': ANIMATION,
+    'sticker': STICKER,
+    'poll': POLL,
+    'image_text': IMAGE_TEXT
+}
+
+# Below this many keywords a plain substring scan is cheaper than walking the automaton
+AUTOMATON_MIN_KEYWORDS = 8
+
+# A user regex runs on every message a job scans: bound the pattern and the text it sees
+MAX_REGEX_LENGTH = 200
+MAX_REGEX_TEXT = 4096
+# Seconds one search may take (with the regex module) before the filter is given up on
+REGEX_TIMEOUT = 0.05
+
+_REPEATS = {sre_parse.MAX_REPEAT, sre_parse.MIN_REPEAT}
+if hasattr(sre_parse, 'POSSESSIVE_REPEAT'):
+    _REPEATS.add(sre_parse.POSSESSIVE_REPEAT)
+
+def _subpatterns(value):
+    if isinstance(value, sre_parse.SubPattern):
+        yield value
+    elif isinstance(value, (list, tuple)):
+        for item in value:
+            yield from _subpatterns(item)
+
+ALTERNATIVES = "alternatives inside a repeated group like (a|aa)*"
+
+def _folded_alternatives(pattern):
+    """A group of single-character alternatives like (\\w|\\d), which the parser folds into a set"""
+    items = list(pattern)
+    if len(items) != 1 or items[0][0] != sre_parse.SUBPATTERN:
+        return False
+    inner = list(items[0][1][-1])
+    return len(inner) == 1 and inner[0][0] == sre_parse.IN and len(inner[0][1]) > 1
+
+def _backtracks(pattern, repeated=False):
+    """What in the parsed pattern can backtrack exponentially: a repeat inside a
+    repeat, like (a+)+, or alternatives inside a repeat, like (a|aa)*; None if nothing"""
+    for op, av in pattern:
+        if op in _REPEATS:
+            low, high, sub = av
+            if repeated and low != high:
+                return "nested quantifiers like (a+)+"
+            if high > 1 and _folded_alternatives(sub):
+                return ALTERNATIVES
+            problem = _backtracks(sub, repeated or high > 1)
+        elif repeated and op == sre_parse.BRANCH:
+            return ALTERNATIVES
+        else:
+            problem = next(filter(None, (_backtracks(sub, repeated) for sub in _subpatterns(av))), None)
+        if problem:
+            return problem
+    return None
+
+def regex_problem(regex):
+    """Why `regex` cannot be used as a filter, or None if it can.
+
+    Nested quantifiers and repeated alternatives are refused: they can
+    backtrack exponentially on a caption that almost matches, and a search
+    blocks the event loop every job runs on. When the regex module is
+    installed, searches are also cut off after REGEX_TIMEOUT seconds.
+    """
+    if len(regex) > MAX_REGEX_LENGTH:
+        return f"longer than {MAX_REGEX_LENGTH} characters"
+    try:
+        parsed = sre_parse.parse(regex, re.IGNORECASE)
+    except re.error as e:
+        return str(e)
+    problem = _backtracks(parsed)
+    return f"{problem} are not allowed" if problem else None
+
+class KeywordMatcher:
+    """Answer "does this text contain any of the keywords?" in a single pass.
+
+    Keywords are matched case-insensitively; callers pass lowercased text.
+    Large keyword lists are compiled into an Aho-Corasick automaton so the
+    cost depends on the text length only, not on the number of keywords.
+    """
+
+    def __init__(self, keywords):
+        self.keywords = tuple(sorted({str(k).lower().strip() for k in keywords or [] if str(k).strip()}))
+        self.goto = None
+        if len(self.keywords) >= AUTOMATON_MIN_KEYWORDS:
+            self._build()
+
+    def __bool__(self):
+        return bool(self.keywords)
+
+    def _build(self):
+        goto, fail, out = [{}], [0], [False]
+        for word in self.keywords:
+            state = 0
+            for ch in word:
+                nxt = goto[state].get(ch)
+                if nxt is None:
+                    nxt = len(goto)
+                    goto[state][ch] = nxt
+                    goto.append({})
+                    fail.append(0)
+                    out.append(False)
+                state = nxt
+            out[state] = True
+
+        # Breadth-first so every failure link points at an already finished state
+        queue = deque(goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for ch, nxt in goto[state].items():
+                queue.append(nxt)
+                f = fail[state]
+                while f and ch not in goto[f]:
+                    f = fail[f]
+                fail[nxt] = goto[f].get(ch, 0)
+                out[nxt] = out[nxt] or out[fail[nxt]]
+        self.goto, self.fail, self.out = goto, fail, out
+
+    def search(self, text):
+        if not self.keywords or not text:
+            return False
+        if self.goto is None:
+            return any(keyword in text for keyword in self.keywords)
+        goto, fail, out = self.goto, self.fail, self.out
+        state = 0
+        for ch in text:
+            while state and ch not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(ch, 0)
+            if out[state]:
+                return True
+        return False
+
+NEVER_MATCHES = re.compile(r'(?!)')
+
+class MessageFilter:
+    """A user's filter settings compiled into a single per-message predicate.
+
+    `check(message)` returns None when the message should be forwarded, or a
+    short reason ('type', 'size', 'extension', 'keyword', 'exclude', 'regex')
+    naming the first rule that rejected it.
+    """
+
+    def __init__(self, configs):
+        filters = configs.get('filters') or {}
+        self.allowed = 0
+        for name, bit in TYPE_BITS.items():
+            if filters.get(name, False):
+                self.allowed |= bit
+
+        self.size_limit = configs.get('file_size') or 0
+        self.size_more = configs.get('size_limit')
+        self.extensions = frozenset(
+            str(ext).lower().strip().strip('.') for ext in configs.get('extension') or [] if str(ext).strip()
+        )
+        self.keywords = KeywordMatcher(configs.get('keywords'))
+        self.excluded = KeywordMatcher(configs.get('exclude_keywords'))
+        self.pattern = None
+        regex = configs.get('regex')
+        if regex:
+            # Saved before the checks existed, or written around the settings menu
+            problem = regex_problem(regex)
+            if problem:
+                logger.warning(f"Ignoring filter regex {regex!r}: {problem}")
+            elif regex_engine:
+                self.pattern = regex_engine.compile(regex, regex_engine.IGNORECASE)
+            else:
+                self.pattern = re.compile(regex, re.IGNORECASE)
+        self.needs_text = bool(self.keywords or self.excluded or self.pattern)
+
+    @staticmethod
+    def message_bits(message):
+        bits = 0
+        if message.text:
+            bits |= TEXT
+        if message.photo:
+            bits |= PHOTO
+            if (message.caption and message.caption.strip()) or (message.text and message.text.strip()):
+                bits |= IMAGE_TEXT
+        if message.video:
+            bits |= VIDEO
+        if message.document:
+            bits |= DOCUMENT
+        if message.audio:
+            bits |= AUDIO
+        if message.voice:
+            bits |= VOICE
+        if message.animation:
+            bits |= ANIMATION
+        if message.sticker:
+            bits |= STICKER
+        if message.poll:
+            bits |= POLL
+        return bits
+
+    def check(self, message):
+        # No type toggled on at all means every type is allowed (backward compatibility)
+        if self.allowed and not self.message_bits(message) & self.allowed:
+            return 'type'
+
+        if self.size_limit > 0 and message.media:
+            media = getattr(message, message.media.value, None)
+            file_size = getattr(media, 'file_size', None)
+            if file_size is not None:
+                size_mb = file_size / (1024 * 1024)
+                if self.size_more is True and size_mb <= self.size_limit:
+                    return 'size'
+                if self.size_more is False and size_mb >= self.size_limit:
+                    return 'size'
+
+        if self.extensions and message.document:
+            file_name = getattr(message.document, 'file_name', None)
+            if file_name and file_name.split('.')[-1].lower() in self.extensions:
+                return 'extension'
+
+        if self.needs_text:
+            text = message.text or message.caption or getattr(message.document, 'file_name', None) or ""
+            lowered = text.lower()
+            if self.keywords and not self.keywords.search(lowered):
+                return 'keyword'
+            if self.excluded and self.excluded.search(lowered):
+                return 'exclude'
+            if self.pattern and not self._search(text[:MAX_REGEX_TEXT]):
+                return 'regex'
+        return None
+
+    def _search(self, text):
+        if regex_engine is None:
+            return self.pattern.search(text)
+        try:
+            return self.pattern.search(text, timeout=REGEX_TIMEOUT)
+        except TimeoutError:
+            # Runaway pattern: from now on nothing matches it, instead of stalling on every message
+            logger.warning(f"Filter regex {self.pattern.pattern!r} timed out, rejecting everything it filters")
+            self.pattern = NEVER_MATCHES
+            return None
+
+    def allows(self, message):
+        return self.check(message) is None
+
+def compile_filter(configs):
+    """Compile a user's configs into a MessageFilter"""
+    return MessageFilter(configs)
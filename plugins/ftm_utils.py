@@ -21,9 +21,15 @@ def create_target_link(chat_id, message_id):
         # Private chat or bot
         return f"https://t.me/{chat_id}/{message_id}"
 
-def add_ftm_caption(original_caption, source_link):
+# FTM footer appended to captions; the target line is only known after sending
+FTM_SOURCE = "\n\n🔥 <b>FTM MODE</b> 🔥\n📤 <b>Source:</b> <a href='{source_link}'>Original Message</a>"
+FTM_TARGET = "\n📥 <b>Target:</b> <a href='{target_link}'>Forwarded Message</a>"
+
+def add_ftm_caption(original_caption, source_link, target_link=None):
     """Add FTM mode information to caption"""
-    ftm_info = f"\n\n🔥 <b>FTM MODE</b> 🔥\n📤 <b>Source:</b> <a href='{source_link}'>Original Message</a>"
+    ftm_info = FTM_SOURCE.format(source_link=source_link)
+    if target_link:
+        ftm_info += FTM_TARGET.format(target_link=target_link)
     
     if original_caption:
         # Use original caption as is without any encoding/decoding
@@ -1,5 +1,6 @@
 import re
 import asyncio 
+import logging
 from .utils import STS
 from .fsub import send_force_subscribe_message
 from database import db
@@ -10,10 +11,15 @@ from pyrogram.errors import FloodWait
 from pyrogram.errors.exceptions.not_acceptable_406 import ChannelPrivate as PrivateChat
 from pyrogram.errors.exceptions.bad_request_400 import ChannelInvalid, ChatAdminRequired, UsernameInvalid, UsernameNotModified, ChannelPrivate
 from pyrogram.types import InlineKeyboardButton, InlineKeyboardMarkup, CallbackQuery, KeyboardButton, ReplyKeyboardMarkup, ReplyKeyboardRemove
+from utils.scheduler import scheduler
+
+logger = logging.getLogger(__name__)
 
  
 #===================Run Function===================#
 
+ALL_CHANNELS = "📡 All channels"
+
 @Client.on_message(filters.private & filters.command(["fwd", "forward"]))
 async def run(bot, message):
     buttons = []
@@ -31,16 +37,24 @@ async def run(bot, message):
     channels = await db.get_user_channels(user_id)
     if not channels:
        return await message.reply_text(Translation.NO_CHANNELS_MSG)
+    fanout = []
     if len(channels) > 1:
        for channel in channels:
           buttons.append([KeyboardButton(f"{channel['title']}")])
           btn_data[channel['title']] = channel['chat_id']
+       # One job that fetches the source once and sends it into every channel
+       buttons.append([KeyboardButton(ALL_CHANNELS)])
        buttons.append([KeyboardButton("cancel")]) 
        _toid = await bot.ask(message.chat.id, Translation.TO_MSG.format(_bot['name'], _bot['username']), reply_markup=ReplyKeyboardMarkup(buttons, one_time_keyboard=True, resize_keyboard=True))
        if _toid.text.startswith(('/', 'cancel')):
           return await message.reply_text(Translation.CANCEL, reply_markup=ReplyKeyboardRemove())
        to_title = _toid.text
-       toid = btn_data.get(to_title)
+       if to_title == ALL_CHANNELS:
+          toid = channels[0]['chat_id']
+          fanout = [channel['chat_id'] for channel in channels[1:]]
+          to_title = ", ".join(channel['title'] for channel in channels)
+       else:
+          toid = btn_data.get(to_title)
        if not toid:
           return await message.reply_text(Translation.WRONG_CHANNEL_MSG, reply_markup=ReplyKeyboardRemove())
     else:
@@ -85,6 +99,8 @@ async def run(bot, message):
     buttons = [[
         InlineKeyboardButton('Yes', callback_data=f"start_public_{forward_id}"),
         InlineKeyboardButton('No', callback_data="close_btn")
+    ],[
+        InlineKeyboardButton('🔍 Dry run', callback_data=f"dryrun_public_{forward_id}")
     ]]
     reply_markup = InlineKeyboardMarkup(buttons)
     await message.reply_text(
@@ -92,4 +108,121 @@ async def run(bot, message):
         disable_web_page_preview=True,
         reply_markup=reply_markup
     )
-    STS(forward_id).store(chat_id, toid, int(skipno.text), int(last_msg_id))
+    STS(forward_id).store(chat_id, toid, int(skipno.text), int(last_msg_id), fanout=fanout)
+
+#===================Incremental Sync===================#
+
+SYNC_INTERVALS = [6, 12, 24]
+
+@Client.on_message(filters.private & filters.command(["sync", "incremental"]))
+async def sync_list(bot, message):
+    user_id = message.from_user.id
+    force_sub_msg = await send_force_subscribe_message(message, bot)
+    if force_sub_msg:
+        return
+    marks = await db.get_sync_marks(user_id)
+    if not marks:
+        return await message.reply_text("<b>Nothing to sync yet.</b>\n\n<b>Forward a source chat to a target once with /fwd; after that /sync forwards only what is new.</b>")
+    buttons = [[InlineKeyboardButton(f"{mark['from_chat']} ➜ {mark['to_chat']}", callback_data=f"sync#{mark['_id']}")] for mark in marks]
+    await message.reply_text("<b><u>INCREMENTAL SYNC</u></b>\n\n<b>Choose a source ➜ target pair to continue from where it last stopped.</b>",
+                             reply_markup=InlineKeyboardMarkup(buttons))
+
+def sync_markup(mark):
+    every = mark.get('every_hours') or 0
+    interval_buttons = [InlineKeyboardButton(('✅ ' if every == hours else '') + f"{hours}h", callback_data=f"syncevery#{mark['_id']}#{hours}")
+                        for hours in SYNC_INTERVALS]
+    interval_buttons.append(InlineKeyboardButton(('✅ ' if not every else '') + "Off", callback_data=f"syncevery#{mark['_id']}#0"))
+    return InlineKeyboardMarkup([
+        [InlineKeyboardButton('▶️ Sync now', callback_data=f"syncrun#{mark['_id']}")],
+        interval_buttons,
+        [InlineKeyboardButton('🗑 Forget this pair', callback_data=f"syncdel#{mark['_id']}")]
+    ])
+
+def sync_text(mark, config_hash):
+    every = mark.get('every_hours') or 0
+    text = (f"<b><u>INCREMENTAL SYNC</u></b>\n\n"
+            f"<b>Source:</b> <code>{mark['from_chat']}</code>\n"
+            f"<b>Target:</b> <code>{mark['to_chat']}</code>\n"
+            f"<b>Forwarded up to message:</b> <code>{mark['last_id']}</code>\n"
+            f"<b>Schedule:</b> {f'every {every} hours' if every else 'off'}")
+    if mark.get('plan_hash') != config_hash:
+        text += "\n\n<b>⚠️ Your settings changed since the last run. Messages skipped by the old filters are not forwarded again.</b>"
+    return text
+
+@Client.on_callback_query(filters.regex(r'^sync(run|every|del)?#'))
+async def sync_callback(bot, query):
+    user_id = query.from_user.id
+    action, mark_id, *args = query.data.split('#')
+    mark = await db.get_sync_mark(user_id, mark_id)
+    if not mark:
+        return await query.answer("This sync no longer exists", show_alert=True)
+    if action == "syncdel":
+        await db.delete_sync_mark(mark_id)
+        return await query.message.edit_text("<b>Sync pair removed.</b>")
+    if action == "syncevery":
+        hours = int(args[0])
+        if hours and not Config.is_sudo_user(user_id) and not await db.is_premium_user(user_id):
+            return await query.answer("Scheduled sync is a premium feature. Use /premium to upgrade.", show_alert=True)
+        await db.set_sync_schedule(mark_id, hours)
+        mark = await db.get_sync_mark(user_id, mark_id)
+    plan = await STS(f"{user_id}-s{mark_id}").get_plan(user_id)
+    if action == "syncrun":
+        if not plan.bot:
+            return await query.answer("You didn't add any bot. Please add a bot using /settings", show_alert=True)
+        forward_id = prepare_sync(user_id, mark)
+        return await query.message.edit_text(
+            sync_text(mark, plan.config_hash) + "\n\n<b>Start forwarding the new messages?</b>",
+            reply_markup=InlineKeyboardMarkup([[
+                InlineKeyboardButton('Yes', callback_data=f"start_public_{forward_id}"),
+                InlineKeyboardButton('No', callback_data="close_btn")
+            ]]))
+    await query.message.edit_text(sync_text(mark, plan.config_hash), reply_markup=sync_markup(mark))
+
+def sync_job_id(user_id, mark):
+    return f"{user_id}-s{mark['_id']}"
+
+def prepare_sync(user_id, mark):
+    """Store an incremental job for the pair and return its forward id"""
+    forward_id = sync_job_id(user_id, mark)
+    from_chat = mark['from_chat']
+    if from_chat.lstrip('-').isdigit():
+        from_chat = int(from_chat)
+    to_chat = int(mark['to_chat']) if mark['to_chat'].lstrip('-').isdigit() else mark['to_chat']
+    STS(forward_id).store(from_chat, to_chat, mark['last_id'] + 1, mark['last_id'], mode='incremental')
+    return forward_id
+
+async def run_scheduled_syncs(bot):
+    """Start due scheduled syncs; checked once a minute for the life of the bot"""
+    from .regix import submit_job
+    while True:
+        await asyncio.sleep(60)
+        try:
+            due = await db.get_due_syncs()
+        except Exception as e:
+            logger.error(f"Failed to load scheduled syncs: {e}")
+            continue
+        for mark in due:
+            user_id = mark['user_id']
+            try:
+                if not Config.is_sudo_user(user_id) and not await db.is_premium_user(user_id):
+                    await db.set_sync_schedule(mark['_id'], 0)
+                    continue
+                # A busy user's run stays due and is tried again next minute; with workers the
+                # jobs run elsewhere, so only this pair's own pending job counts
+                if Config.USE_WORKERS:
+                    busy = await db.has_pending_job(sync_job_id(user_id, mark))
+                else:
+                    busy = scheduler.has_jobs(user_id)
+                if busy:
+                    continue
+                forward_id = prepare_sync(user_id, mark)
+                sts = STS(forward_id)
+                plan = await sts.get_plan(user_id)
+                if not plan.bot:
+                    await db.set_sync_schedule(mark['_id'], mark['every_hours'])
+                    continue
+                m = await bot.send_message(user_id, f"<code>⏰ Scheduled sync of {mark['from_chat']} ➜ {mark['to_chat']} starting...</code>")
+                asyncio.create_task(submit_job(bot, user_id, forward_id, sts, sts.get(full=True), m, plan))
+                await db.set_sync_schedule(mark['_id'], mark['every_hours'])
+            except Exception as e:
+                logger.error(f"Failed to start scheduled sync {mark['_id']} for user {user_id}: {e}")
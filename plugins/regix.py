@@ -8,16 +8,23 @@ import html
 from .utils import STS
 from database import db
 from utils.notifications import NotificationManager 
-from .test import CLIENT , start_clone_bot, get_configs
+from utils.job_logger import JobLogger
+from utils.rate_limiter import get_limiter, TokenBucket
+from utils.throttle import Throttle
+from utils.scheduler import scheduler, SchedulerFull, job_tier
+from utils.cancel import JobCancelled, CancelToken, open_token, close_token, job_token, cancel_jobs
+from utils.retry import SEND_RETRY, classify, PERMANENT, TRANSIENT
+from .test import client_pool, Prefetcher, IdFetcher, latest_message_id
+from .ftm_dedup import message_key, get_duplicate_index
 from config import Config, temp
 from translation import Translation
-from pyrogram import Client, filters 
+from pyrogram import Client, filters, raw, enums 
 #from pyropatch.utils import unpack_new_file_id
-from pyrogram.errors import FloodWait, MessageNotModified, RPCError
-from pyrogram.types import InlineKeyboardButton, InlineKeyboardMarkup, CallbackQuery, Message 
+from pyrogram.errors import FloodWait, MessageNotModified, RandomIdDuplicate
+from pyrogram.types import InlineKeyboardButton, InlineKeyboardMarkup, CallbackQuery, Message
 from .ftm_utils import create_source_link, create_target_link, add_ftm_caption, create_ftm_button, combine_buttons
+from .ftm_caption import ORIGINAL_CAPTION
 
-CLIENT = CLIENT()
 logger = logging.getLogger(__name__)
 logger.setLevel(logging.INFO)
 TEXT = Translation.TEXT
@@ -27,19 +34,19 @@ TEXT = Translation.TEXT
 @Client.on_callback_query(filters.regex(r'^start_public'))
 async def pub_(bot, message):
     user = message.from_user.id
-    temp.CANCEL[user] = False
     frwd_id = message.data.split("_")[2]
-    if temp.lock.get(user) and str(temp.lock.get(user))=="True":
+    # Forwarding jobs are queued by the scheduler; the lock only guards other tasks (unequify)
+    if temp.lock.get(user) and str(temp.lock.get(user))=="True" and not scheduler.has_jobs(user):
       return await message.answer("please wait until previous task complete", show_alert=True)
     sts = STS(frwd_id)
     if not sts.verify():
       await message.answer("your are clicking on my old button", show_alert=True)
       return await message.message.delete()
     i = sts.get(full=True)
-    if i.TO in temp.IS_FRWD_CHAT:
-      return await message.answer("In Target chat a task is progressing. please wait until task complete", show_alert=True)
-    m = await msg_edit(message.message, "<code>verifying your data's, please wait.</code>")
-    _bot, caption, forward_tag, data, protect, button = await sts.get_data(user)
+    m = await msg_edit(message.message, "<code>verifying your data's, please wait.</code>", force=True)
+    # Resolve settings and entitlements once; the loop only re-reads them on change
+    plan = await sts.get_plan(user)
+    _bot = plan.bot
     if not _bot:
       return await msg_edit(m, "<code>You didn't added any bot. Please add a bot using /settings !</code>", wait=True)
     
@@ -50,7 +57,7 @@ async def pub_(bot, message):
             from datetime import datetime, timedelta
             expires_at = datetime.utcnow() + timedelta(days=3650)
             await db.add_premium_user(user, plan_type="sudo_unlimited", expires_at=expires_at)
-            print(f"Auto-granted premium to sudo user: {user}")
+            logger.info(f"Auto-granted premium to sudo user: {user}")
     else:
         # Check usage limits for non-sudo users
         can_process, reason = await db.can_user_process(user)
@@ -78,21 +85,265 @@ async def pub_(bot, message):
 <b>Your current usage:</b> 1/1 processes used this month
 <b>Next reset:</b> 1st of next month"""
                 return await msg_edit(m, limit_msg, wait=True)
-    
+
+    await submit_job(bot, user, frwd_id, sts, i, m, plan)
+
+def job_data(sts, plan):
+    """What a queue item needs to run or resume the job"""
+    return {
+      'job_id': sts.id,
+      'from_chat': sts.get('FROM'),
+      'to_chat': sts.get('TO'),
+      'total': sts.get('total'),
+      'skip': sts.get('skip'),
+      'mode': sts.get('mode'),
+      'fanout': sts.get('FANOUT') or [],
+      'ids': sts.get('IDS'),
+      'bot_details': plan.bot
+    }
+
+async def submit_job(bot, user, frwd_id, sts, i, m, plan):
+    """Run the job in this process, or queue it for the worker processes when they are enabled.
+
+    Returns False when the job was refused (queue full, or already pending).
+    """
+    if not Config.USE_WORKERS:
+      return await schedule_job(bot, user, frwd_id, sts, i, m, plan)
+    if await db.has_pending_job(frwd_id):
+      await msg_edit(m, "<b>This task is already running or waiting in the queue.</b>", wait=True)
+      return False
+    data = job_data(sts, plan)
+    data['status_msg'] = {'chat_id': m.chat.id, 'message_id': m.id}
+    await db.add_queue_item(user, data, status='queued', priority=Config.TIER_WEIGHTS.get(job_tier(user, plan.plan_type), 1))
+    await msg_edit(m, "<b>⏳ Task queued</b>\n\n<i>It starts automatically when a worker is free.</i>",
+                   InlineKeyboardMarkup([[InlineKeyboardButton('• ᴄᴀɴᴄᴇʟ', 'cancel_queued')]]), wait=True)
+    return True
+
+async def schedule_job(bot, user, frwd_id, sts, i, m, plan, queue_id=None, fresh=False):
+    # Wait behind the global cap, the user's fair share and any job writing to the same target
+    try:
+      ticket = scheduler.submit(frwd_id, user, [i.TO] + list(sts.get('FANOUT') or []), job_tier(user, plan.plan_type))
+    except SchedulerFull as e:
+      await msg_edit(m, f"<b>{e}</b>", wait=True)
+      return False
+    try:
+      if not await wait_turn(ticket, m):
+        if queue_id:
+          await db.update_queue_status(user, 'cancelled', queue_id)
+        await msg_edit(m, "<b>Queued task cancelled</b>", wait=True)
+        return True
+      temp.CANCEL[user] = False
+      open_token(frwd_id, user)
+      await run_job(bot, user, frwd_id, sts, i, m, plan, queue_id, ticket, fresh)
+      return True
+    finally:
+      close_token(frwd_id)
+      scheduler.release(ticket)
+
+def restore_job(item):
+    """STS for a queue item, continuing after its checkpoint if it has one"""
+    data = item.get('process_data') or {}
+    frwd_id = data.get('job_id') or str(item['_id'])
+    checkpoint = item.get('checkpoint') or {}
+    skip = int(data.get('skip') or 0)
+    if 'last_id' in checkpoint:
+      skip = max(skip, checkpoint['last_id'] + 1)
+    ids = data.get('ids')
+    sts = STS(frwd_id).store(data['from_chat'], data['to_chat'], skip, max(ids) if ids else int(data['total']), data.get('mode') or 'full', data.get('fanout'), ids)
+    for key, value in (checkpoint.get('counters') or {}).items():
+      sts.data[frwd_id][key] = value
+    dead = checkpoint.get('dead') or {}
+    for job in [sts] + sts.fanout():
+      job.data[job.id].update({'DEAD': list(dead.get(str(job.get('TO')), [])), 'failed': len(dead.get(str(job.get('TO')), []))})
+    return sts
+
+async def resume_jobs(bot):
+    """Restart every job that was still active when the bot went down, from its checkpoint"""
+    failed = await db.fail_unresumable_queues()
+    if failed:
+      logger.warning(f"Marked {failed} old active queue items without a job id or checkpoint as failed")
+    if Config.USE_WORKERS:
+      # Workers take over active items once their lease runs out
+      return
+    for item in await db.get_active_queues():
+      user = item['user_id']
+      frwd_id = (item.get('process_data') or {}).get('job_id') or str(item['_id'])
+      try:
+        sts = restore_job(item)
+        plan = await sts.get_plan(user)
+        if not plan.bot:
+          await db.update_queue_status(user, 'failed', item['_id'])
+          continue
+        m = await bot.send_message(user, "<code>♻️ Resuming your forwarding task after a restart...</code>")
+      except Exception as e:
+        logger.error(f"Could not resume job {frwd_id} of user {user}: {e}")
+        await db.update_queue_status(user, 'failed', item['_id'])
+        continue
+      logger.info(f"Resuming job {frwd_id} of user {user} from message {sts.get('skip')}")
+      asyncio.create_task(schedule_job(bot, user, frwd_id, sts, sts.get(full=True), m, plan, item['_id']))
+
+async def run_claimed(bot, item):
+    """Run a queue item a worker process has claimed, from its checkpoint if it has one"""
+    user = item['user_id']
+    status_msg = (item.get('process_data') or {}).get('status_msg')
+    fresh = item.get('attempts', 1) <= 1 and not item.get('checkpoint')
+    try:
+      # Settings are saved by the bot process; start from the stored version so the plan is not reloaded at once
+      temp.CONFIG_VERSION.update(await db.get_config_versions([user]))
+      sts = restore_job(item)
+      plan = await sts.get_plan(user)
+    except Exception as e:
+      logger.error(f"Could not start queued job {item['_id']} of user {user}: {e}")
+      return await db.update_queue_status(user, 'failed', item['_id'])
+    if not plan.bot:
+      return await db.update_queue_status(user, 'failed', item['_id'])
+    m = None
+    if fresh and status_msg:
+      # Keep reporting on the message the user started the job from
+      try:
+        m = await bot.get_messages(status_msg['chat_id'], status_msg['message_id'])
+      except Exception:
+        m = None
+    if not m or m.empty:
+      m = await bot.send_message(user, "<code>♻️ Resuming your forwarding task...</code>")
+    await schedule_job(bot, user, sts.id, sts, sts.get(full=True), m, plan, item['_id'], fresh)
+
+async def yield_turn(ticket, routes, m, sts, user):
+    """Hand a free job's slot to a waiting paid job and wait to be scheduled again"""
+    for route in routes:
+      await route.sender.drain()
+    scheduler.suspend(ticket)
+    logger.info(f"Job {ticket.job_id} paused for higher priority jobs")
+    await report(m, sts, 'Paused for priority jobs')
+    # A cancel while paused ends the wait at once
+    if not await cancel_token(sts).wait(scheduler.wait(ticket)):
+      # Dropped from the queue while paused
+      cancel_jobs(user)
+      raise JobCancelled()
+    await report(m, sts, 10)
+
+async def wait_turn(ticket, m):
+    """Show the queue position until the scheduler starts the job; False if it was dropped"""
+    while True:
+      position = scheduler.position(ticket)
+      if position:
+        stats = scheduler.stats()
+        await msg_edit(m, f"<b>⏳ Task queued</b>\n\n<b>Position:</b> <code>{position}</code>\n<b>Running tasks:</b> <code>{stats['running']}/{stats['capacity']}</code>\n\n<i>It starts automatically when a slot is free.</i>",
+                       InlineKeyboardMarkup([[InlineKeyboardButton('• ᴄᴀɴᴄᴇʟ', 'cancel_queued')]]))
+      try:
+        return await scheduler.wait(ticket, timeout=30)
+      except asyncio.TimeoutError:
+        continue
+
+# Job id -> CancelToken of its running dry run; kept apart from real jobs so cancelling one leaves the other alone
+DRY_RUNS = {}
+
+@Client.on_callback_query(filters.regex(r'^dryrun_public'))
+async def dry_run(bot, message):
+    """Walk the source like a real job would, send nothing and report what the job would do"""
+    user = message.from_user.id
+    frwd_id = message.data.split("_")[2]
+    sts = STS(frwd_id)
+    if not sts.verify():
+      await message.answer("your are clicking on my old button", show_alert=True)
+      return await message.message.delete()
+    i = sts.get(full=True)
+    m = await msg_edit(message.message, "<code>Scanning the source chat, nothing will be sent...</code>", force=True)
+    plan = await sts.get_plan(user)
+    if not plan.bot:
+      return await msg_edit(m, "<code>You didn't added any bot. Please add a bot using /settings !</code>", wait=True)
+    try:
+      client = await client_pool.acquire(plan.bot)
+    except Exception as e:
+      return await msg_edit(m, f"**Error starting bot:** `{e}`", wait=True)
+    token = DRY_RUNS[frwd_id] = CancelToken(user)
+    cancel = InlineKeyboardMarkup([[InlineKeyboardButton('• ᴄᴀɴᴄᴇʟ', f'cancel_dryrun#{frwd_id}')]])
+    scan = {'fetched': 0, 'deleted': 0, 'filtered': 0, 'duplicate': 0, 'send': 0, 'bytes': 0, 'calls': 0.0}
+    types = {}
+    started = time.time()
+    error = None
+    try:
+      from_chat = i.FROM
+      if isinstance(from_chat, str) and from_chat.lstrip('-').isdigit():
+        from_chat = int(from_chat)
+      to_chat = i.TO
+      if isinstance(to_chat, str) and to_chat.lstrip('-').isdigit():
+        to_chat = int(to_chat)
+      dedup = None
+      if plan.configs.get('duplicate', True):
+        try:
+          dedup = await get_duplicate_index(i.TO, plan.configs.get('db_uri'))
+        except Exception as e:
+          logger.warning(f"Dry run {frwd_id}: duplicate index unavailable: {e}")
+      seen = set()
+      next_id = int(i.skip or 0)
+      async with Prefetcher(client, chat_id=from_chat, limit=int(i.limit), offset=int(i.skip or 0), token=token) as fetcher:
+        async for msg in fetcher:
+          token.check()
+          # Ids skipped by sparse history paging were deleted
+          scan['deleted'] += max(0, msg.id - next_id)
+          scan['fetched'] += max(0, msg.id - next_id) + 1
+          next_id = msg.id + 1
+          # Throttled like any progress edit; most of these calls return at once
+          await msg_edit(m, f"<b>🔍 Scanning...</b>\n\n<b>Fetched:</b> <code>{scan['fetched']}/{i.total}</code>", cancel)
+          if msg.empty or msg.service:
+            scan['deleted'] += 1
+            continue
+          if filter_reason(msg, plan):
+            scan['filtered'] += 1
+            continue
+          key = message_key(msg) if dedup else None
+          if key:
+            if key in seen or await is_duplicate_message(key, dedup):
+              scan['duplicate'] += 1
+              continue
+            seen.add(key)
+          kind = msg.media.value if msg.media else 'text'
+          types[kind] = types.get(kind, 0) + 1
+          scan['bytes'] += getattr(getattr(msg, kind, None), 'file_size', None) or 0
+          scan['send'] += 1
+          # Batchable messages share one call per hundred, everything else is a call of its own
+          scan['calls'] += 0.01 if batch_mode(msg, plan) else 1
+      bucket = get_limiter(client.me.id, i.TO, plan.is_bot, await chat_kind(client, to_chat))
+      eta = bucket.eta(math.ceil(scan['calls']))
+    except JobCancelled:
+      return await msg_edit(m, "<b>❌ Dry run cancelled</b>", wait=True)
+    except Exception as e:
+      logger.error(f"Dry run {frwd_id} of user {user} failed: {e}")
+      error = e
+      return await msg_edit(m, f'<b>ERROR:</b>\n<code>{e}</code>', wait=True)
+    finally:
+      if DRY_RUNS.get(frwd_id) is token:
+        del DRY_RUNS[frwd_id]
+      await client_pool.release(client, error)
+    breakdown = "\n".join(f"• {kind.title()}: <code>{count}</code>" for kind, count in sorted(types.items(), key=lambda t: -t[1])) or "• <code>nothing</code>"
+    text = (f"<b><u>🔍 DRY RUN RESULT</u></b>\n\n"
+            f"<b>Scanned:</b> <code>{scan['fetched']}</code> in <code>{TimeFormatter(milliseconds=(time.time() - started) * 1000) or '0 s'}</code>\n"
+            f"<b>Would forward:</b> <code>{scan['send']}</code> ({get_size(scan['bytes'])})\n"
+            f"{breakdown}\n\n"
+            f"<b>Filtered:</b> <code>{scan['filtered']}</code>\n"
+            f"<b>Duplicate:</b> <code>{scan['duplicate']}</code>\n"
+            f"<b>Deleted:</b> <code>{scan['deleted']}</code>\n\n"
+            f"<b>Estimated time:</b> <code>{TimeFormatter(milliseconds=eta * 1000) or '0 s'}</code>\n"
+            f"<i>At the current send rate into the target ({bucket.rate:.2f} calls/s).</i>")
+    await msg_edit(m, text, InlineKeyboardMarkup([[
+        InlineKeyboardButton('Start', callback_data=f"start_public_{frwd_id}"),
+        InlineKeyboardButton('Close', callback_data="close_btn")
+    ]]), wait=True)
+
+async def run_job(bot, user, frwd_id, sts, i, m, plan, queue_id=None, ticket=None, fresh=False):
+    _bot = plan.bot
+    # A worker's freshly claimed item is a new job that already has its queue entry
+    resumed = queue_id is not None and not fresh
     # Initialize notification manager and notify process start
     notify = NotificationManager(bot)
     await notify.notify_process_start(user, "Forward", sts.get('FROM'), sts.get('TO'))
     
     # Add to queue for crash recovery
-    queue_id = await db.add_queue_item(user, {
-        'from_chat': sts.get('FROM'),
-        'to_chat': sts.get('TO'),
-        'total': sts.get('total'),
-        'skip': sts.get('skip'),
-        'bot_details': _bot
-    })
+    if queue_id is None:
+      queue_id = await db.add_queue_item(user, job_data(sts, plan))
     try:
-      client = await start_clone_bot(CLIENT.client(_bot))
+      client = await client_pool.acquire(_bot)
     except Exception as e:
       error_msg = f"**Error starting bot:** `{str(e)}`"
       # Send error notification for all users (not just admin)
@@ -100,7 +351,8 @@ async def pub_(bot, message):
           notify = NotificationManager(bot)
           await notify.notify_error(user, "Bot Start Failed", str(e))
       except Exception as notify_err:
-          print(f"Failed to send error notification: {notify_err}")
+          logger.error(f"Failed to send error notification: {notify_err}")
+      await db.update_queue_status(user, 'failed', queue_id)
       return await m.edit(error_msg)
     # Status will be updated by validation steps below
     try:
@@ -116,9 +368,10 @@ async def pub_(bot, message):
            notify = NotificationManager(bot)
            await notify.notify_error(user, "Source Chat Access Failed", f"Cannot access source chat: {str(e)}")
        except Exception as notify_err:
-           print(f"Failed to send error notification: {notify_err}")
-       await msg_edit(m, error_msg, retry_btn(frwd_id), True)
-       return await stop(client, user)
+           logger.error(f"Failed to send error notification: {notify_err}")
+       await db.update_queue_status(user, 'failed', queue_id)
+       await msg_edit(m, error_msg, retry_btn(frwd_id), True, token=job_token(frwd_id))
+       return await stop(client, user, e)
     try:
        # Validate target channel ID format
        to_chat = i.TO
@@ -126,6 +379,8 @@ async def pub_(bot, message):
            to_chat = int(to_chat)
        k = await client.send_message(to_chat, "Testing")
        await k.delete()
+       # Seed the target's send budget from the known limits for this kind of chat
+       get_limiter(client.me.id, i.TO, plan.is_bot, await chat_kind(client, to_chat))
     except Exception as e:
        error_msg = f"**Please Make Your [UserBot / Bot](t.me/{_bot['username']}) Admin In Target Channel With Full Permissions**"
        # Send error notification for all users
@@ -133,139 +388,142 @@ async def pub_(bot, message):
            notify = NotificationManager(bot)
            await notify.notify_error(user, "Target Chat Admin Required", f"Bot needs admin permissions in target chat: {str(e)}")
        except Exception as notify_err:
-           print(f"Failed to send error notification: {notify_err}")
-       await msg_edit(m, error_msg, retry_btn(frwd_id), True)
-       return await stop(client, user)
+           logger.error(f"Failed to send error notification: {notify_err}")
+       await db.update_queue_status(user, 'failed', queue_id)
+       await msg_edit(m, error_msg, retry_btn(frwd_id), True, token=job_token(frwd_id))
+       return await stop(client, user, e)
+    # Fan-out targets the bot cannot post in are left out instead of failing the job
+    fanout = []
+    for child in sts.fanout():
+       try:
+          k = await client.send_message(child.get('TO'), "Testing")
+          await k.delete()
+          get_limiter(client.me.id, child.get('TO'), plan.is_bot, await chat_kind(client, child.get('TO')))
+          fanout.append(child)
+       except Exception as e:
+          logger.warning(f"Job {frwd_id}: skipping fan-out target {child.get('TO')}: {e}")
+          await send(client, user, f"<b>⚠️ Skipping target</b> <code>{child.get('TO')}</code><b>: make your bot admin there to include it.</b>")
+    if sts.get('mode') == 'incremental':
+       # Forward up to whatever is newest in the source right now
+       try:
+          latest = await latest_message_id(client, from_chat, sts.get('limit'))
+       except Exception as e:
+          logger.warning(f"Could not find the newest message in {from_chat}: {e}")
+          latest = sts.get('limit')
+       if latest < sts.get('skip'):
+          await db.update_queue_status(user, 'completed', queue_id)
+          await msg_edit(m, "<b>✅ Already in sync</b>\n\n<b>Nothing new in the source chat since the last run.</b>", wait=True)
+          return await client_pool.release(client)
+       for job in [sts] + fanout:
+          job.data[job.id].update({'limit': latest, 'total': latest})
     temp.forwardings += 1
     await db.add_frwd(user)
     
     # Increment usage count for non-premium users (premium users have unlimited)
-    if not Config.is_sudo_user(user) and not await db.is_premium_user(user):
+    if not resumed and sts.get('mode') != 'retry' and not Config.is_sudo_user(user) and not await db.is_premium_user(user):
         await db.increment_usage(user)
     
     await send(client, user, "<b>𝙵𝙾𝚁𝚆𝙰𝚁𝙳𝙸𝙽𝙶 𝚂𝚃𝙰𝚁𝚃𝙴𝙳 𝙱𝚈 <a href=https://t.me/ftmdeveloper>𝙵𝚃𝙼 𝙳𝙴𝚅𝙴𝙻𝙾𝙿𝙴𝚁</a></b>")
     sts.add(time=True)
-    sleep = Config.MESSAGE_DELAY  # Configurable delay from config.py
     await msg_edit(m, "<code>Processing...</code>") 
-    temp.IS_FRWD_CHAT.append(i.TO)
     temp.lock[user] = locked = True
+    log = JobLogger(frwd_id, user)
+    token = job_token(frwd_id)
     if locked:
         try:
-          MSG = []
+          next_id = int(sts.get('skip') or 0)
           pling=0
           await edit(m, 'Progressing', 10, sts)
-          print(f"Starting Forwarding Process... From :{sts.get('FROM')} To: {sts.get('TO')} Totel: {sts.get('limit')} stats : {sts.get('skip')})")
+          log.info('start', from_chat=sts.get('FROM'), to_chat=sts.get('TO'), limit=sts.get('limit'), skip=sts.get('skip'))
           # Use validated channel ID for iteration
           from_chat_validated = sts.get('FROM')
           if isinstance(from_chat_validated, str) and from_chat_validated.lstrip('-').isdigit():
               from_chat_validated = int(from_chat_validated)
           
-          async for message in client.iter_messages(
-            chat_id=from_chat_validated, 
-            limit=int(sts.get('limit')), 
-            offset=int(sts.get('skip')) if sts.get('skip') else 0
-            ):
-                if await is_cancelled(client, user, m, sts):
+          # One route per target: fetching and filtering below happen once for all of them
+          routes = []
+          for job in [sts] + fanout:
+             routes.append(await open_route(user, client, plan, from_chat_validated, job, log))
+          if fanout:
+             log.info('fanout', targets=len(routes))
+          # Fetch in a background task so the next batches are ready while this one is sent
+          ids = sts.get('IDS')
+          if ids:
+            # Retrying a finished job's failures: only those ids are fetched
+            fetcher = IdFetcher(client, from_chat_validated, ids, offset=next_id, cache=sts.cache(), token=token)
+          else:
+            fetcher = Prefetcher(
+              client,
+              chat_id=from_chat_validated, 
+              limit=int(sts.get('limit')), 
+              offset=int(sts.get('skip')) if sts.get('skip') else 0,
+              cache=sts.cache(),
+              token=token
+              )
+          try:
+           # Free jobs refresh their status half as often, leaving the edit budget to paid ones
+           interval = Config.PROGRESS_INTERVAL * (2 if ticket and ticket.tier == 'free' else 1)
+           async with fetcher, ProgressReporter(m, sts, interval):
+            async for message in fetcher:
+                if await is_cancelled(client, user, m, sts, queue_id):
                    return
-                # Update progress more frequently (every 10 messages for better responsiveness)
-                if pling %10 == 0: 
-                   await edit(m, 'Progressing', 10, sts)
                 pling += 1
-                sts.add('fetched')
+                # Ids skipped by sparse history paging were deleted; count them as such
+                gap = message.id - next_id
+                if gap > 0 and not ids:
+                   tally(routes, 'fetched', gap)
+                   tally(routes, 'deleted', gap)
+                next_id = message.id + 1
+                tally(routes, 'fetched')
+                if pling % 200 == 0:
+                   log.flush(fetched=sts.get('fetched'), forwarded=sts.get('total_files'))
+                   # Everything below the oldest unsent message of any target is done; a restart resumes after it
+                   await save_checkpoint(queue_id, min(route.settled(message.id - 1) for route in routes), sts, dead_letters(routes))
+                   if Config.USE_WORKERS and queue_id and await cancel_requested(queue_id):
+                      cancel_jobs(user)
+                      return await end_cancelled(client, user, m, sts, queue_id)
+                   if ticket and scheduler.should_yield(ticket):
+                      await yield_turn(ticket, routes, m, sts, user)
+                      if await is_cancelled(client, user, m, sts, queue_id):
+                         return
                 if message == "DUPLICATE":
-                   sts.add('duplicate')
+                   tally(routes, 'duplicate')
                    continue 
                 elif message == "FILTERED":
-                   sts.add('filtered')
+                   tally(routes, 'filtered')
                    continue 
                 if message.empty or message.service:
-                   sts.add('deleted')
+                   log.count('empty')
+                   tally(routes, 'deleted')
                    continue
 
+                if plan.is_stale():
+                   plan = await sts.get_plan(user, _bot)
+
                 # Apply filters
-                filter_result = await should_forward_message(message, user)
-                print(f"Message {message.id}: Filter result: {filter_result}")
-                if message.photo and message.caption:
-                    print(f"Message {message.id}: Has photo + caption (image+text)")
-                elif message.photo:
-                    print(f"Message {message.id}: Has photo only")
-                elif message.text:
-                    print(f"Message {message.id}: Has text only")
-
-                if not filter_result:
-                   print(f"Message {message.id}: FILTERED OUT")
-                   sts.add('filtered')
+                reason = filter_reason(message, plan)
+                if reason:
+                   log.count(f'filtered_{reason}', message.id)
+                   tally(routes, 'filtered')
                    continue
-                else:
-                   print(f"Message {message.id}: PASSED FILTER - will be forwarded")
 
-                # Check for duplicates
-                if await is_duplicate_message(message, user):
-                   sts.add('duplicate')
-                   continue
-                
-                # Check if message has media (photo, video, document, audio, voice, animation, sticker)
-                has_media = bool(message.photo or message.video or message.document or 
-                               message.audio or message.voice or message.animation or 
-                               message.sticker)
-                
-                # Force media messages to be copied individually (without tags)
-                # Only use batch forwarding for text-only messages when forward_tag is enabled
-                if forward_tag and not has_media:
-                   MSG.append(message.id)
-                   notcompleted = len(MSG)
-                   completed = sts.get('total') - sts.get('fetched')
-                   if ( notcompleted >= 100 
-                        or completed <= 100): 
-                      # Get FTM mode status - only allow for Pro plan users
-                      configs = await get_configs(user)
-                      user_can_use_ftm = await db.can_use_ftm_mode(user)
-                      ftm_mode = configs.get('ftm_mode', False) and user_can_use_ftm
-                      # Forward returns True/False, count is handled internally
-                      await forward(client, MSG, m, sts, protect, ftm_mode, _bot['is_bot'])
-                      await asyncio.sleep(Config.MESSAGE_DELAY)
-                      MSG = []
-                else:
-                   # Simply copy message without reading any content to avoid UTF-16-LE errors
-                   try:
-                       # Get FTM mode status - only allow for Pro plan users
-                       configs = await get_configs(user)
-                       user_can_use_ftm = await db.can_use_ftm_mode(user)
-                       ftm_mode = configs.get('ftm_mode', False) and user_can_use_ftm
-                       
-                       # Just copy the message directly without reading content
-                       if ftm_mode:
-                           # FTM mode - copy with source link
-                           source_link = create_source_link(sts.get('FROM'), message.id)
-                           ftm_button = create_ftm_button(source_link)
-                           
-                           await client.copy_message(
-                               chat_id=sts.get('TO'),
-                               from_chat_id=sts.get('FROM'),
-                               message_id=message.id,
-                               reply_markup=ftm_button,
-                               protect_content=protect
-                           )
-                       elif caption is not None or button:
-                           # Has custom caption or button
-                           details = {"msg_id": message.id, "media": media(message), "caption": caption, 'button': button, "protect": protect, "ftm_mode": False, "is_bot": _bot['is_bot']}
-                           await copy(client, details, m, sts)
-                       else:
-                           # Simple copy without any modifications
-                           await client.copy_message(
-                               chat_id=sts.get('TO'),
-                               from_chat_id=sts.get('FROM'),
-                               message_id=message.id,
-                               protect_content=protect
-                           )
-                       
-                       sts.add('total_files')
-                       await asyncio.sleep(sleep)
-                   except Exception as copy_err:
-                       # Skip messages that fail to copy
-                       print(f"Message {message.id}: Failed to copy - {copy_err}")
-                       sts.add('deleted')
-                       continue 
+                key = message_key(message) if any(route.dedup for route in routes) else None
+                for route in routes:
+                   await route.add(message, key, m, plan, log)
+            for route in routes:
+                await route.flush(m, plan, log)
+            for route in routes:
+                await route.sender.drain()
+            await retry_dead_letters(client, from_chat_validated, routes, m, plan, log)
+          finally:
+            for route in routes:
+                await route.close()
+            sts.drop_cache()
+        except JobCancelled:
+            # Sends, lanes and the prefetcher were stopped on the way out
+            log.flush()
+            log.info('cancelled', fetched=sts.get('fetched'), forwarded=sts.get('total_files'))
+            return await end_cancelled(client, user, m, sts, queue_id)
         except Exception as e:
             error_msg = f'<b>ERROR:</b>\n<code>{e}</code>'
             # Send error notification for all users (not restricted to admins)
@@ -273,12 +531,16 @@ async def pub_(bot, message):
                 notify = NotificationManager(bot)
                 await notify.notify_error(user, "Forwarding Process Failed", str(e))
             except Exception as notify_err:
-                print(f"Failed to send error notification: {notify_err}")
+                logger.error(f"Failed to send error notification: {notify_err}")
             
-            await msg_edit(m, error_msg, wait=True)
-            temp.IS_FRWD_CHAT.remove(sts.TO)
-            return await stop(client, user)
-        temp.IS_FRWD_CHAT.remove(sts.TO)
+            log.flush()
+            log.error('failed', error=e)
+            await db.update_queue_status(user, 'failed', queue_id)
+            await msg_edit(m, error_msg, wait=True, token=token)
+            return await stop(client, user, e)
+        log.flush()
+        log.info('completed', fetched=sts.get('fetched'), forwarded=sts.get('total_files'), filtered=sts.get('filtered'), duplicate=sts.get('duplicate'), deleted=sts.get('deleted'),
+                 retries=sum(job.get('retries') for job in [sts] + fanout), wasted=sum(job.get('wasted') for job in [sts] + fanout))
         await send(client, user, "<b>🎉 𝙵𝙾𝚁𝚆𝙰𝚁𝙳𝙸𝙽𝙶 𝙲𝙾𝙼𝙿𝙻𝙴𝚃𝙴𝙳 𝙱𝚈 🥀 <a href=https://t.me/ftmdeveloperz>𝙵𝚃𝙼 𝙳𝙴𝚅𝙴𝙻𝙾𝙿𝙴𝚁</a>🥀</b>")
         await edit(m, 'Completed', "completed", sts, force=True)
         
@@ -288,62 +550,74 @@ async def pub_(bot, message):
             'forwarded': sts.get('forwarded'), 
             'filtered': sts.get('filtered'),
             'duplicate': sts.get('duplicate'),
-            'deleted': sts.get('deleted')
+            'deleted': sts.get('deleted'),
+            'failed': sts.get('failed')
         }
         await notify.notify_process_completed(user, "Forward", sts.get('FROM'), sts.get('TO'), stats)
         
         # Mark queue as completed
-        await db.update_queue_status(user, 'completed')
+        await db.update_queue_status(user, 'completed', queue_id)
+        dead = dead_letters(routes)
+        if dead:
+           # Kept with the job so the user can re-send just these later
+           await db.save_dead_letters(queue_id, dead)
+           failed = sum(len(ids) for ids in dead.values())
+           await send(bot, user, f"<b>⚠️ {failed} messages could not be sent.</b>\n\n<i>They are not deleted at the source; retry only these without scanning the whole range again.</i>",
+                      InlineKeyboardMarkup([[InlineKeyboardButton(f'♻️ Retry {failed} failed', f'retry_failed#{queue_id}')]]))
+        # The next /sync of each pair starts right after what was covered here
+        if sts.get('mode') != 'retry':
+           for job in [sts] + fanout:
+              await db.set_sync_mark(user, sts.get('FROM'), job.get('TO'), sts.get('limit'), plan.config_hash)
         await stop(client, user)
 
-async def copy(bot, msg, m, sts):
+async def copy(bot, msg, m, sts, plan):
    try:
-     if 'button' in msg and msg['button']:
+     if plan.button:
         # Check if FTM mode is enabled
-        if msg.get('ftm_mode', False):
+        if plan.ftm_mode:
            source_link = create_source_link(sts.get('FROM'), msg['msg_id'])
            ftm_button = create_ftm_button(source_link)
            
            # Combine FTM button with existing button
-           combined_button = combine_buttons(ftm_button, msg['button'])
+           combined_button = combine_buttons(ftm_button, plan.button)
            
            # Add FTM info to caption
            caption_with_ftm = add_ftm_caption(msg['caption'], source_link)
            
-           sent_msg = await bot.send_message(
+           sent_msg = await with_retry(bot, m, sts, bot.send_message,
                sts.get('TO'), 
                caption_with_ftm, 
                reply_markup=combined_button, 
-               protect_content=msg['protect']
+               protect_content=plan.protect
            )
            
            # Update with target link if using userbot
-           if sent_msg and not msg.get('is_bot', True):
+           if sent_msg and not plan.is_bot:
               target_link = create_target_link(sts.get('TO'), sent_msg.id)
               updated_caption = add_ftm_caption(msg['caption'], source_link, target_link)
               try:
                  await sent_msg.edit_text(updated_caption, reply_markup=combined_button)
               except Exception as edit_e:
-                 print(f"Failed to edit message with target link: {edit_e}")
+                 logger.warning(f"Failed to edit message with target link: {edit_e}")
+        elif msg['media']:
+           await with_retry(bot, m, sts, bot.copy_message,
+               chat_id=sts.get('TO'),
+               from_chat_id=sts.get('FROM'),
+               message_id=msg['msg_id'],
+               caption=msg['caption'],
+               reply_markup=plan.button,
+               protect_content=plan.protect
+           )
         else:
-           await bot.send_message(sts.get('TO'), msg['caption'], reply_markup=msg['button'], protect_content=msg['protect'])
+           await with_retry(bot, m, sts, bot.send_message, sts.get('TO'), msg['caption'], reply_markup=plan.button, protect_content=plan.protect)
      else:
         media_file_id = msg['media']
         if media_file_id:
-           # Get original caption and user's custom caption setting
-           original_caption = msg['caption']
-           user_custom_caption = msg.get('custom_caption', None)  # Only modify if explicitly set
-           
-           # Determine final caption to use
-           if user_custom_caption is not None:
-               # User has set a custom caption, apply it
-               caption = custom_caption(msg, user_custom_caption)
-           else:
-               # No custom caption set, use original caption unchanged
-               caption = original_caption
+           # Already rendered from the job's caption template
+           caption = msg['caption']
            
            # Check if FTM mode is enabled
-           if msg.get('ftm_mode', False):
+           if plan.ftm_mode:
               source_link = create_source_link(sts.get('FROM'), msg['msg_id'])
               ftm_button = create_ftm_button(source_link)
               
@@ -351,70 +625,56 @@ async def copy(bot, msg, m, sts):
               caption_with_ftm = add_ftm_caption(caption, source_link)
               
               # Use copy_message with FTM features - works for both bots and userbots
-              sent_msg = await bot.copy_message(
+              sent_msg = await with_retry(bot, m, sts, bot.copy_message,
                   chat_id=sts.get('TO'),
                   from_chat_id=sts.get('FROM'),
                   message_id=msg['msg_id'],
                   caption=caption_with_ftm,
                   reply_markup=ftm_button,
-                  protect_content=msg['protect']
+                  protect_content=plan.protect
               )
               
               # Update with target link if using userbot (userbots have more capabilities)
-              if sent_msg and not msg.get('is_bot', True):
+              if sent_msg and not plan.is_bot:
                  target_link = create_target_link(sts.get('TO'), sent_msg.id)
-                 updated_caption = add_ftm_caption(caption, source_link)
+                 updated_caption = add_ftm_caption(caption, source_link, target_link)
                  try:
                     await sent_msg.edit_caption(updated_caption, reply_markup=ftm_button)
                  except Exception as edit_e:
-                    print(f"Failed to edit caption with target link: {edit_e}")
+                    logger.warning(f"Failed to edit caption with target link: {edit_e}")
            else:
               # Normal copy without FTM - compatible with both bots and userbots
               try:
-                  await bot.copy_message(
+                  await with_retry(bot, m, sts, bot.copy_message,
                       chat_id=sts.get('TO'),
                       from_chat_id=sts.get('FROM'),
                       message_id=msg['msg_id'],
                       caption=caption,
-                      protect_content=msg['protect']
+                      protect_content=plan.protect
                   )
                   
+              except JobCancelled:
+                  raise
               except Exception as copy_error:
-                  # Detect if message was forwarded with forward tag instead of copied
-                  # This happens when the message couldn't be copied and was forwarded instead
-                  try:
-                      # Try to forward the message instead (this creates forward tag)
-                      await bot.forward_messages(
-                          chat_id=sts.get('TO'),
-                          from_chat_id=sts.get('FROM'),
-                          message_ids=msg['msg_id']
-                      )
-                      
-                      # Log the forwarding issue
-                      notify = NotificationManager(bot)
-                      await notify.notify_forwarding_issue(
-                          user_id=sts.get('user_id', 'unknown'),
-                          issue_type="Forward tag detected",
-                          details=f"Message {msg['msg_id']} from {sts.get('FROM')} was forwarded instead of copied due to: {str(copy_error)}"
-                      )
-                  except Exception as forward_error:
-                      print(f"Both copy and forward failed. Copy error: {copy_error}, Forward error: {forward_error}")
-                      # Increment error counter for failed message
-                      sts.add(deleted=True)
-                  # Fallback: try using forward_messages (plural) method
-                  try:
-                      await bot.forward_messages(
-                          chat_id=sts.get('TO'),
-                          from_chat_id=sts.get('FROM'),
-                          message_ids=[msg['msg_id']],
-                          protect_content=msg['protect']
-                      )
-                      print(f"Successfully forwarded message {msg['msg_id']} using forward_messages fallback")
-                  except Exception as forward_error:
-                      print(f"Forward messages also failed: {forward_error}")
-                      # Don't raise error - mark as failed but continue
-                      sts.add('deleted')  # Count as failed forward
-                      return False  # Return False to indicate failure
+                  # Only a copy Telegram refused is known not to have arrived; anything
+                  # else may have, and sending it another way could post it twice
+                  if classify(copy_error) != PERMANENT:
+                      raise
+                  # Forward the message instead, once (this creates a forward tag)
+                  await with_retry(bot, m, sts, bot.forward_messages,
+                      chat_id=sts.get('TO'),
+                      from_chat_id=sts.get('FROM'),
+                      message_ids=msg['msg_id'],
+                      protect_content=plan.protect
+                  )
+                  
+                  # Log the forwarding issue
+                  notify = NotificationManager(bot)
+                  await notify.notify_forwarding_issue(
+                      user_id=sts.get('user_id', 'unknown'),
+                      issue_type="Forward tag detected",
+                      details=f"Message {msg['msg_id']} from {sts.get('FROM')} was forwarded instead of copied due to: {str(copy_error)}"
+                  )
         else:
            # Use message text as is without any encoding
            text_content = msg['caption']
@@ -422,86 +682,72 @@ async def copy(bot, msg, m, sts):
               text_content = "📝 Message content unavailable"
            
            # Check if FTM mode is enabled for text messages
-           if msg.get('ftm_mode', False):
+           if plan.ftm_mode:
               source_link = create_source_link(sts.get('FROM'), msg['msg_id'])
               ftm_button = create_ftm_button(source_link)
               
               # Add FTM info to text content
               text_with_ftm = add_ftm_caption(text_content, source_link)
               
-              sent_msg = await bot.send_message(
+              sent_msg = await with_retry(bot, m, sts, bot.send_message,
                   sts.get('TO'), 
                   text_with_ftm, 
                   reply_markup=ftm_button,
-                  protect_content=msg['protect']
+                  protect_content=plan.protect
               )
               
               # Update with target link if using userbot
-              if sent_msg and not msg.get('is_bot', True):
+              if sent_msg and not plan.is_bot:
                  target_link = create_target_link(sts.get('TO'), sent_msg.id)
                  updated_text = add_ftm_caption(text_content, source_link, target_link)
                  try:
                     await sent_msg.edit_text(updated_text, reply_markup=ftm_button)
                  except Exception as edit_e:
-                    print(f"Failed to edit text with target link: {edit_e}")
+                    logger.warning(f"Failed to edit text with target link: {edit_e}")
            else:
               # Normal text message - compatible with both bots and userbots
               try:
-                  # Double check text content is not empty before sending
-                  if text_content and text_content.strip():
-                      await bot.send_message(sts.get('TO'), text_content, protect_content=msg['protect'])
-                  else:
-                      # If text is still empty, try copying the original message
-                      await bot.copy_message(
-                          chat_id=sts.get('TO'),
-                          from_chat_id=sts.get('FROM'),
-                          message_id=msg['msg_id'],
-                          protect_content=msg['protect']
-                      )
+                  await with_retry(bot, m, sts, bot.send_message, sts.get('TO'), text_content, protect_content=plan.protect)
+              except JobCancelled:
+                  raise
               except Exception as send_error:
-                  print(f"Send message failed: {send_error}")
+                  if classify(send_error) != PERMANENT:
+                      raise
+                  logger.warning(f"Send message failed: {send_error}")
                   # Fallback: try copy_message for text (works better for some bots)
-                  try:
-                      await bot.copy_message(
-                          chat_id=sts.get('TO'),
-                          from_chat_id=sts.get('FROM'),
-                          message_id=msg['msg_id'],
-                          protect_content=msg['protect']
-                      )
-                  except Exception as copy_error:
-                      print(f"Copy message fallback also failed: {copy_error}")
-                      # Message failed to send - mark as deleted/failed, not successful
-                      print(f"Message {msg['msg_id']}: FAILED to forward - marking as deleted")
-                      sts.add('deleted')
-                      return False  # Return False to indicate failure
+                  await with_retry(bot, m, sts, bot.copy_message,
+                      chat_id=sts.get('TO'),
+                      from_chat_id=sts.get('FROM'),
+                      message_id=msg['msg_id'],
+                      protect_content=plan.protect
+                  )
      
      # Only count as successful if we reach this point (no exceptions)
+     limiter(bot, sts).success()
      sts.add('total_files')
      return True  # Return True to indicate success
-   except FloodWait as e:
-     await edit(m, 'Progressing', e.value, sts, force=True)
-     await asyncio.sleep(e.value)
-     await edit(m, 'Progressing', 10, sts, force=True)
-     await copy(bot, msg, m, sts)
+   except JobCancelled:
+     raise
    except (UnicodeDecodeError, UnicodeEncodeError) as enc_error:
-     print(f"Encoding error during copy: {enc_error}")
-     sts.add('deleted')
+     logger.warning(f"Encoding error during copy: {enc_error}")
+     dead_letter(sts, msg['msg_id'])
      return False
    except Exception as e:
-     print(f"ERROR copying message {msg.get('msg_id')}: {e}")
-     import traceback
-     traceback.print_exc()
-     sts.add('deleted')
+     # Out of retries, or refused by Telegram: mark as failed but continue
+     logger.warning(f"Message {msg.get('msg_id')}: FAILED to forward - {type(e).__name__}: {e}")
+     dead_letter(sts, msg['msg_id'])
      return False
 
-async def forward(bot, msg, m, sts, protect, ftm_mode=False, is_bot=True):
+async def forward(bot, msg, m, sts, plan):
    try:
-     if ftm_mode:
-        # For FTM mode, copy messages individually to add buttons/captions
-        for msg_id in msg:
+     if plan.ftm_mode:
+        # For FTM mode, copy messages individually to add buttons/captions;
+        # the originals were already fetched by the job's prefetcher
+        originals = await sts.cache().fetch(bot, sts.get('FROM'), msg)
+        # The Sender already took the token for the unit's first call
+        first = True
+        for msg_id, original_msg in zip(msg, originals):
            try:
-              # Get the original message to process with FTM
-              original_msg = await bot.get_messages(sts.get('FROM'), msg_id)
               if original_msg and not original_msg.empty and not original_msg.service:
                  source_link = create_source_link(sts.get('FROM'), msg_id)
                  ftm_button = create_ftm_button(source_link)
@@ -511,17 +757,20 @@ async def forward(bot, msg, m, sts, protect, ftm_mode=False, is_bot=True):
                  caption = add_ftm_caption(caption, source_link)
 
                  # Send the message first
-                 sent_msg = await bot.copy_message(
+                 if not first:
+                    await limiter(bot, sts).acquire()
+                 first = False
+                 sent_msg = await with_retry(bot, m, sts, bot.copy_message,
                     chat_id=sts.get('TO'),
                     from_chat_id=sts.get('FROM'),
                     message_id=msg_id,
                     caption=caption,
                     reply_markup=ftm_button,
-                    protect_content=protect
+                    protect_content=plan.protect
                  )
 
                  # Only update with target link if using userbot
-                 if sent_msg and not is_bot:
+                 if sent_msg and not plan.is_bot:
                     target_link = create_target_link(sts.get('TO'), sent_msg.id)
                     updated_caption = add_ftm_caption(original_msg.caption if original_msg.caption else "", source_link, target_link)
                     try:
@@ -530,18 +779,21 @@ async def forward(bot, msg, m, sts, protect, ftm_mode=False, is_bot=True):
                           reply_markup=ftm_button
                        )
                     except Exception as edit_e:
-                       print(f"Failed to edit caption with target link: {edit_e}")
-
-              await asyncio.sleep(1.5)  # Optimized delay between messages
+                       logger.warning(f"Failed to edit caption with target link: {edit_e}")
+                 limiter(bot, sts).success()
+           except JobCancelled:
+              raise
            except Exception as e:
-              print(f"FTM forward individual error: {e}")
+              logger.warning(f"FTM forward individual error: {e}")
+              dead_letter(sts, msg_id)
      else:
         # Normal forwarding without FTM
-        await bot.forward_messages(
+        await with_retry(bot, m, sts, bot.forward_messages,
               chat_id=sts.get('TO'),
               from_chat_id=sts.get('FROM'), 
-              protect_content=protect,
+              protect_content=plan.protect,
               message_ids=msg)
+        limiter(bot, sts).success()
         
         # Only count successful forwards (one for each message in the batch)
         if isinstance(msg, list):
@@ -550,11 +802,464 @@ async def forward(bot, msg, m, sts, protect, ftm_mode=False, is_bot=True):
         else:
             sts.add('total_files')
 
-   except FloodWait as e:
-     await edit(m, 'Progressing', e.value, sts, force=True)
-     await asyncio.sleep(e.value)
-     await edit(m, 'Progressing', 10, sts, force=True)
-     await forward(bot, msg, m, sts, protect, ftm_mode, is_bot)
+   except JobCancelled:
+     raise
+   except Exception as e:
+     logger.warning(f"Forwarding {len(msg) if isinstance(msg, list) else 1} messages failed: {type(e).__name__}: {e}")
+     dead_letter(sts, msg)
+
+def limiter(bot, sts):
+   """The adaptive send budget for this client into the job's target chat"""
+   return get_limiter(bot.me.id, sts.get('TO'))
+
+def cancel_token(sts):
+   """Cancellation token of the job; fan-out targets share their parent's"""
+   return job_token(sts.get('PARENT') or sts.id)
+
+async def with_retry(bot, m, sts, func, *args, **kwargs):
+   """Make one Telegram call of the job under the send retry policy.
+
+   FloodWaits slow down the target's limiter and show on the status
+   message while they are waited out; retries and failed calls are counted
+   in the job's `retries` and `wasted` counters.
+   """
+   flooded = False
+   async def on_flood(seconds):
+      nonlocal flooded
+      flooded = True
+      limiter(bot, sts).flood(seconds)
+      await report(m, sts, seconds)
+   token = cancel_token(sts)
+   try:
+      return await SEND_RETRY.call(func, *args, token=token, stats=sts, on_flood=on_flood, **kwargs)
+   finally:
+      if flooded and not token.cancelled:
+         await report(m, sts, 10)
+
+async def chat_kind(client, chat_id):
+   """Classify chat_id as 'channel' or 'group' for picking its starting send rate"""
+   try:
+      chat = await client.get_chat(chat_id)
+   except Exception:
+      return 'channel'
+   return 'channel' if chat.type == enums.ChatType.CHANNEL else 'group'
+
+def batch_mode(message, plan):
+   """Return how message can join a batched call ('forward' or 'copy'), or None"""
+   has_media = bool(message.photo or message.video or message.document or 
+                  message.audio or message.voice or message.animation or 
+                  message.sticker)
+   # Media is never forwarded with a tag; only text-only messages keep it
+   if plan.forward_tag and not has_media:
+      return 'forward'
+   if not plan.ftm_mode and plan.caption is None and not plan.button:
+      return 'copy'
+   return None
+
+async def send_batch(bot, mode, msg, m, sts, plan, log):
+   if mode == 'forward':
+      await forward(bot, msg, m, sts, plan)
+   else:
+      await copy_batch(bot, msg, m, sts, plan)
+   log.count(f'batch_{mode}')
+
+async def send_one(bot, message, m, sts, plan, log):
+   """Copy a message that needs a caption, button or FTM rewrite on its own"""
+   try:
+       if plan.ftm_mode:
+           # FTM mode - copy with source link
+           source_link = create_source_link(sts.get('FROM'), message.id)
+           ftm_button = create_ftm_button(source_link)
+           
+           await with_retry(bot, m, sts, bot.copy_message,
+               chat_id=sts.get('TO'),
+               from_chat_id=sts.get('FROM'),
+               message_id=message.id,
+               caption=render_caption(message, plan, source_link) if message.media else None,
+               reply_markup=ftm_button,
+               protect_content=plan.protect
+           )
+           limiter(bot, sts).success()
+           sts.add('total_files')
+       else:
+           # Has custom caption or button; copy() does its own counting
+           if message.media:
+              caption = render_caption(message, plan)
+           else:
+              caption = message.text.html if message.text else ""
+           details = {"msg_id": message.id, "media": media(message), "caption": caption}
+           await copy(bot, details, m, sts, plan)
+       
+       log.count('copied', message.id)
+   except JobCancelled:
+       raise
+   except Exception as copy_err:
+       # Skip messages that fail to copy
+       log.count('copy_failed', message.id, copy_err)
+       dead_letter(sts, message.id)
+
+def album_caption(message, plan):
+   """Caption for a non-first album item passed to copy_media_group"""
+   if plan.drop_captions or not message.caption:
+      # copy_media_group keeps the original caption for an empty one; a blank is stripped to nothing
+      return " "
+   return message.caption.html
+
+def album_complete(album, sts):
+   """Whether `album` holds its whole source media group, judged from the messages the job fetched.
+
+   Every id the job read is in its cache unless it was deleted, so a
+   neighbour of the same group that is cached but not in the album was
+   left out; a neighbour outside what the job read cannot be ruled out.
+   """
+   cache, group = sts.cache(), album[0].media_group_id
+   ids = {message.id for message in album}
+   read = set(sts.get('IDS')) if sts.get('IDS') else range(int(sts.get('skip') or 0), int(sts.get('limit')) + 1)
+   for i in range(album[0].id - 1, album[-1].id + 2):
+      if i in ids:
+         continue
+      if i not in read:
+         return False
+      neighbour = cache.get(i)
+      if neighbour is not None and neighbour.media_group_id == group:
+         return False
+   return True
+
+async def send_album(bot, album, m, sts, plan, log):
+   """Copy an album as a single media group; custom and FTM captions go on its first item.
+
+   copy_media_group fetches the group again with `bot` itself, so the file
+   references are valid for whichever lane sends it. It copies the whole
+   source group, so an album missing some of its items (filtered out, or
+   cut by where the job started) is copied one by one instead.
+   """
+   if len(album) < 2 or not all(message.photo or message.video or message.document or message.audio for message in album):
+      return await send_separately(bot, album, m, sts, plan, log)
+   captions = [album_caption(message, plan) for message in album]
+   if plan.template or plan.ftm_mode:
+      captions[0] = render_caption(album[0], plan, create_source_link(sts.get('FROM'), album[0].id)) or " "
+   if not album_complete(album, sts):
+      return await send_separately(bot, album, m, sts, plan, log)
+   try:
+      await with_retry(bot, m, sts, bot.copy_media_group, sts.get('TO'), sts.get('FROM'), album[0].id, captions=captions, protect_content=plan.protect)
+      limiter(bot, sts).success()
+      sts.add('total_files', len(album))
+      log.count('album')
+   except JobCancelled:
+      raise
+   except Exception as e:
+      if classify(e) == TRANSIENT:
+         # The group may have been posted; copying it again could duplicate it
+         logger.warning(f"Album of {len(album)} messages failed after retries: {e}")
+         log.count('album_failed', album[0].id, e)
+         return dead_letter(sts, [message.id for message in album])
+      logger.warning(f"Album of {len(album)} messages failed, copying individually: {e}")
+      await limiter(bot, sts).acquire()
+      await send_separately(bot, album, m, sts, plan, log)
+
+async def send_separately(bot, album, m, sts, plan, log):
+   for n, message in enumerate(album):
+      if n:
+         await limiter(bot, sts).acquire()
+      await send_one(bot, message, m, sts, plan, log)
+
+class Sender:
+   """Stripe a job's send units over its clients while keeping target order.
+
+   Every unit waits for its own client's rate budget concurrently with the
+   others and only then for its turn, so units reach the target in submit
+   order while no client sits idle behind another one's limiter. The send
+   functions themselves no longer acquire for their first call. Every wait
+   runs under the job's cancel token, so a cancel ends them all at once.
+   """
+
+   def __init__(self, clients, sts, done=-1):
+      self.clients = clients
+      self.sts = sts
+      self.token = cancel_token(sts)
+      self.done = done  # `mark` of the last unit that has been sent
+      self.submitted = 0
+      self.turn = 0
+      self.cond = asyncio.Condition()
+      self.slots = asyncio.Semaphore(len(clients) * 2)
+      self.tasks = set()
+      self.error = None
+
+   async def submit(self, func, *args, mark=None, then=None):
+      """Queue `func(client, *args)` as the next send unit.
+
+      `mark` is the unit's last message id; `then(sent)` is awaited after it ran.
+      """
+      if self.error:
+         raise self.error
+      await self.token.wait(self.slots.acquire())
+      seq = self.submitted
+      self.submitted += 1
+      client = self.clients[seq % len(self.clients)]
+      task = asyncio.create_task(self._run(seq, client, func, args, mark, then))
+      self.tasks.add(task)
+      task.add_done_callback(self.tasks.discard)
+
+   async def _run(self, seq, client, func, args, mark, then):
+      try:
+         try:
+            await self.token.wait(limiter(client, self.sts).acquire())
+            await self.token.wait(self._turn(seq))
+         except JobCancelled as e:
+            self.error = self.error or e
+            return
+         sent = False
+         try:
+            await self.token.wait(func(client, *args))
+            sent = True
+         except Exception as e:
+            self.error = self.error or e
+         finally:
+            if mark is not None:
+               self.done = mark
+            async with self.cond:
+               self.turn += 1
+               self.cond.notify_all()
+         if then:
+            await then(sent)
+      finally:
+         self.slots.release()
+
+   async def _turn(self, seq):
+      async with self.cond:
+         await self.cond.wait_for(lambda: self.turn == seq)
+
+   def settled(self, upto):
+      """Highest message id at or below `upto` with nothing still in flight before it"""
+      return min(upto, self.done) if self.tasks else upto
+
+   async def drain(self):
+      while self.tasks:
+         await self.token.wait(asyncio.gather(*list(self.tasks)))
+      if self.error:
+         raise self.error
+
+   async def close(self):
+      for task in list(self.tasks):
+         task.cancel()
+      await asyncio.gather(*list(self.tasks), return_exceptions=True)
+
+class Route:
+   """One target of a job: its counters (`sts`), duplicate index, Sender and pending batches.
+
+   The job fetches and filters each message once and hands it to every
+   route, which batches and sends it into its own target.
+   """
+
+   def __init__(self, sts, sender, lanes=(), dedup=None):
+      self.sts = sts
+      self.sender = sender
+      self.lanes = list(lanes)
+      self.dedup = dedup
+      self.msg, self.keys = [], []
+      self.album, self.album_keys = [], []
+      self.batch = None
+      self.run_start = 0
+      self.last_group = None
+
+   async def add(self, message, key, m, plan, log):
+      sts, sender, dedup = self.sts, self.sender, self.dedup
+      # Check for duplicates; keys are stored once their send has gone through
+      key = key if dedup else None
+      if key:
+         if await is_duplicate_message(key, dedup):
+            log.count('duplicate', message.id)
+            sts.add('duplicate')
+            return
+         dedup.reserve(key)
+
+      # Runs of messages that need no per-message rewrite go out in one call and
+      # albums that do go out as one media group; anything else flushes what is
+      # pending first so target order is kept
+      mode = batch_mode(message, plan)
+      group = message.media_group_id
+      album = group if mode is None and not plan.button else None
+      if self.album and (album != self.album[0].media_group_id or len(self.album) >= 10):
+         await sender.submit(send_album, self.album, m, sts, plan, log, mark=self.album[-1].id, then=self.recorder(self.album_keys, [a.id for a in self.album]))
+         self.album, self.album_keys = [], []
+      if self.msg and mode != self.batch:
+         await sender.submit(send_batch, self.batch, self.msg, m, sts, plan, log, mark=self.msg[-1], then=self.recorder(self.keys, self.msg))
+         self.msg, self.keys, self.run_start = [], [], 0
+      if album:
+         self.album.append(message)
+         self.album_keys.append(key)
+      elif mode:
+         self.batch = mode
+         if not group or group != self.last_group:
+            self.run_start = len(self.msg)
+         self.msg.append(message.id)
+         self.keys.append(key)
+         if len(self.msg) >= 100:
+            # Batched calls keep albums intact; hold a trailing one back for the next call
+            cut = self.run_start if group and self.run_start else len(self.msg)
+            await sender.submit(send_batch, self.batch, self.msg[:cut], m, sts, plan, log, mark=self.msg[cut - 1], then=self.recorder(self.keys[:cut], self.msg[:cut]))
+            self.msg, self.keys, self.run_start = self.msg[cut:], self.keys[cut:], 0
+      else:
+         await sender.submit(send_one, message, m, sts, plan, log, mark=message.id, then=self.recorder([key], [message.id]))
+      self.last_group = group
+
+   async def flush(self, m, plan, log):
+      if self.album:
+         await self.sender.submit(send_album, self.album, m, self.sts, plan, log, mark=self.album[-1].id, then=self.recorder(self.album_keys, [a.id for a in self.album]))
+      if self.msg:
+         await self.sender.submit(send_batch, self.batch, self.msg, m, self.sts, plan, log, mark=self.msg[-1], then=self.recorder(self.keys, self.msg))
+      self.msg, self.keys, self.album, self.album_keys = [], [], [], []
+
+   def recorder(self, keys, ids):
+      """`then` hook storing the keys of the ids that reached the target (not dead-lettered)"""
+      return self.dedup and self.dedup.recorder(keys, ids, self.sts.get('DEAD'))
+
+   def settled(self, upto):
+      """Highest message id at or below `upto` this target has fully sent"""
+      pending = self.msg[:1] + [a.id for a in self.album[:1]]
+      return self.sender.settled(min(pending) - 1 if pending else upto)
+
+   async def close(self):
+      await self.sender.close()
+      await stop_lanes(self.lanes)
+      if self.dedup:
+         self.dedup.abandon()
+
+async def open_route(user, client, plan, from_chat, sts, log):
+   """Duplicate index, extra bot lanes and Sender for one target of the job"""
+   dedup = None
+   if plan.configs.get('duplicate', True):
+      try:
+         dedup = await get_duplicate_index(sts.get('TO'), plan.configs.get('db_uri'))
+      except Exception as e:
+         log.warning('dedup_unavailable', target=sts.get('TO'), error=e)
+   to_chat = sts.get('TO')
+   if isinstance(to_chat, str) and to_chat.lstrip('-').isdigit():
+      to_chat = int(to_chat)
+   # Any other bots the user attached become extra send lanes for this target
+   lanes = await start_lanes(user, plan.bot, from_chat, to_chat, sts)
+   if lanes:
+      log.info('lanes', target=sts.get('TO'), count=len(lanes) + 1)
+   sender = Sender([client] + lanes, sts, done=int(sts.get('skip') or 0) - 1)
+   return Route(sts, sender, lanes, dedup)
+
+def tally(routes, key, value=1):
+   """Count a fetch-stage outcome on every target of the job"""
+   for route in routes:
+      route.sts.add(key, value)
+
+def dead_letter(sts, ids):
+   """Record message ids that failed to send into the job's target (still there at the source)"""
+   ids = ids if isinstance(ids, list) else [ids]
+   sts.get('DEAD').extend(ids)
+   sts.add('failed', len(ids))
+
+def dead_letters(routes):
+   """Failed message ids of every target of the job that has any, keyed by target chat"""
+   return {str(route.sts.get('TO')): sorted(set(route.sts.get('DEAD'))) for route in routes if route.sts.get('DEAD')}
+
+async def retry_dead_letters(client, from_chat, routes, m, plan, log):
+   """Send each target's failed messages once more, batched, before the job ends.
+
+   By now the run's FloodWaits are behind the target's limiter, which paces
+   this pass. What fails again stays in the dead-letter list.
+   """
+   for route in routes:
+      sts = route.sts
+      ids = sorted(set(sts.get('DEAD')))
+      if not ids:
+         continue
+      log.info('dead_letter_retry', target=sts.get('TO'), count=len(ids))
+      sts.data[sts.id]['DEAD'] = []
+      sts.add('failed', -len(ids))
+      for start in range(0, len(ids), 200):
+         chunk = ids[start:start + 200]
+         for message in await cancel_token(sts).wait(sts.cache().fetch(client, from_chat, chunk)):
+            if message is None or message.service:
+               # Deleted at the source since the first attempt
+               sts.add('deleted')
+               continue
+            # Failed keys were never recorded, so this only skips what another job sent meanwhile
+            await route.add(message, message_key(message) if route.dedup else None, m, plan, log)
+      await route.flush(m, plan, log)
+      await route.sender.drain()
+
+async def start_lanes(user, primary, from_chat, to_chat, sts):
+   """Start the user's other bots that can read the source and post in the target"""
+   lanes = []
+   for _bot in await db.get_bots(user):
+      if _bot['id'] == primary['id']:
+         continue
+      try:
+         lane = await client_pool.acquire(_bot)
+      except Exception as e:
+         logger.warning(f"Skipping bot {_bot['id']} for user {user}: cannot start - {e}")
+         continue
+      try:
+         await lane.get_messages(from_chat, sts.get("limit"))
+         k = await lane.send_message(to_chat, "Testing")
+         await k.delete()
+         get_limiter(lane.me.id, sts.get('TO'), _bot.get('is_bot', True), await chat_kind(lane, to_chat))
+         lanes.append(lane)
+      except Exception as e:
+         logger.warning(f"Skipping bot {_bot['id']} for user {user}: no access to source/target - {e}")
+         await client_pool.release(lane, e)
+   return lanes
+
+async def stop_lanes(lanes):
+   for lane in lanes:
+      await client_pool.release(lane)
+
+async def copy_batch(bot, msg, m, sts, plan):
+   """Copy a run of messages without the forward header in a single API call"""
+   # The same random ids on every attempt: Telegram refuses a repeat of a call that
+   # already went through with RANDOM_ID_DUPLICATE, so a retry after a timeout
+   # cannot post the run twice; that answer means the run is posted
+   random_ids = [bot.rnd_id() for _ in msg]
+   async def forward_run():
+     return await bot.invoke(
+        raw.functions.messages.ForwardMessages(
+           from_peer=await bot.resolve_peer(sts.get('FROM')),
+           to_peer=await bot.resolve_peer(sts.get('TO')),
+           id=msg,
+           random_id=random_ids,
+           drop_author=True,
+           drop_media_captions=plan.drop_captions,
+           noforwards=bool(plan.protect)
+        )
+     )
+   try:
+     try:
+        await with_retry(bot, m, sts, forward_run)
+     except RandomIdDuplicate:
+        pass
+     limiter(bot, sts).success()
+     sts.add('total_files', len(msg))
+   except JobCancelled:
+     raise
+   except Exception as e:
+     if classify(e) != PERMANENT:
+        logger.warning(f"Batched copy of {len(msg)} messages failed after retries: {e}")
+        return dead_letter(sts, msg)
+     # One bad id fails the whole call; fall back to copying the run one by one
+     logger.warning(f"Batched copy of {len(msg)} messages failed, copying individually: {e}")
+     for msg_id in msg:
+        try:
+           await limiter(bot, sts).acquire()
+           await with_retry(bot, m, sts, bot.copy_message,
+              chat_id=sts.get('TO'),
+              from_chat_id=sts.get('FROM'),
+              message_id=msg_id,
+              caption="" if plan.drop_captions else None,
+              protect_content=plan.protect
+           )
+           limiter(bot, sts).success()
+           sts.add('total_files')
+        except JobCancelled:
+           raise
+        except Exception as copy_err:
+           logger.warning(f"Message {msg_id}: Failed to copy - {copy_err}")
+           dead_letter(sts, msg_id)
 
 PROGRESS = """
 📈 Percetage: {0} %
@@ -570,36 +1275,46 @@ PROGRESS = """
 ⏳️ ETA: {5}
 """
 
-# Global variable to track last edit time
-last_edit_time = {}
+# Per-message throttle state; bounded, so finished jobs' messages age out
+msg_throttle = Throttle(3.0)
+progress_throttle = Throttle(2.0)
+# Every edit the main bot makes, across all jobs, draws from this one budget
+edit_budget = TokenBucket(Config.EDIT_RATE, burst=max(1, int(Config.EDIT_RATE * 2)), max_rate=Config.EDIT_RATE)
 
-async def msg_edit(msg, text, button=None, wait=None, force=False):
+async def msg_edit(msg, text, button=None, wait=None, force=False, token=None):
     # Time-based throttling - only edit if at least 3 seconds have passed
     msg_id = getattr(msg, 'id', str(msg))
-    current_time = time.time()
-    
-    if not force and msg_id in last_edit_time:
-        time_diff = current_time - last_edit_time[msg_id]
-        if time_diff < 3.0:  # Minimum 3 seconds between edits
+    if not force and not msg_throttle.ready(msg_id):
+        return None
+    # Routine edits are dropped when the budget is spent; forced or waited ones queue for it
+    # (a job's edits pass its cancel `token`, so a cancel ends their waits and drops the edit)
+    if force or wait:
+        try:
+            await (token.wait(edit_budget.acquire()) if token else edit_budget.acquire())
+        except JobCancelled:
             return None
+    elif not edit_budget.try_acquire():
+        return None
     
     try:
         result = await msg.edit(text, reply_markup=button)
-        last_edit_time[msg_id] = current_time
+        msg_throttle.mark(msg_id)
+        edit_budget.success()
         return result
     except MessageNotModified:
         pass 
     except FloodWait as e:
+        edit_budget.flood(e.value)
         if wait:
            # Exponential backoff for FloodWait errors
            sleep_time = min(e.value, 60)  # Cap at 60 seconds
-           await asyncio.sleep(sleep_time)
-           return await msg_edit(msg, text, button, wait, force=True)
-
-# Time tracking for edit function
-edit_last_time = {}
+           try:
+              await (token.sleep(sleep_time) if token else asyncio.sleep(sleep_time))
+           except JobCancelled:
+              return None
+           return await msg_edit(msg, text, button, wait, force=True, token=token)
 
-async def edit(msg, title, status, sts, force=False):
+async def edit(msg, title, status, sts, force=False, token=None):
    i = sts.get(full=True)
    status = 'Forwarding' if status == 10 else f"Sleeping {status} s" if str(status).isnumeric() else status
    percentage = "{:.0f}".format(float(i.fetched)*100/float(i.total))
@@ -623,6 +1338,12 @@ async def edit(msg, title, status, sts, force=False):
    # Fixed text format with correct field mapping 
    # TEXT template: total, fetched, successfully_fwd, duplicate, deleted/filtered, skipped, status, progress%, eta, progress_bar
    text = TEXT.format(i.total, i.fetched, i.total_files, i.duplicate, filtered_deleted, i.skip, status, percentage, estimated_total_time, progress)
+   if i.failed:
+      text += f"\n<b>⚠️ Failed to send:</b> <code>{i.failed}</code>"
+   for child in sts.fanout():
+      text += f"\n<b>➜ {child.get('TO')}:</b> <code>{child.get('total_files')}</code> forwarded, <code>{child.get('duplicate')}</code> duplicate"
+      if child.get('failed'):
+         text += f", <code>{child.get('failed')}</code> failed"
    if status in ["cancelled", "completed"]:
       button.append(
          [InlineKeyboardButton('Support', url='https://t.me/ftmbotzsupportz'),
@@ -632,219 +1353,132 @@ async def edit(msg, title, status, sts, force=False):
       button.append([InlineKeyboardButton('• ᴄᴀɴᴄᴇʟ', 'terminate_frwd')])
    # Time-based throttling for edit function
    msg_id = getattr(msg, 'id', str(msg))
-   current_time = time.time()
-   
-   if not force and msg_id in edit_last_time:
-       time_diff = current_time - edit_last_time[msg_id]
-       if time_diff < 2.0:  # Minimum 2 seconds between progress updates
-           return
+   if not force and not progress_throttle.ready(msg_id):
+       return
    
-   await msg_edit(msg, text, InlineKeyboardMarkup(button), force=force)
-   edit_last_time[msg_id] = current_time
+   await msg_edit(msg, text, InlineKeyboardMarkup(button), force=force, token=token)
+   progress_throttle.mark(msg_id)
+
+REPORTERS = {}
+
+class ProgressReporter:
+   """Keep a job's status message current from its STS counters.
+
+   Ticks every `interval` seconds in its own task, so the forwarding loop
+   only bumps counters; flood sleeps are shown through `report()`.
+   """
 
-async def is_cancelled(client, user, msg, sts):
+   def __init__(self, msg, sts, interval):
+      self.msg = msg
+      self.sts = sts
+      self.interval = interval
+      self.status = 10
+      self.task = None
+
+   async def __aenter__(self):
+      REPORTERS[self.sts.id] = self
+      self.task = asyncio.create_task(self._run())
+      return self
+
+   async def __aexit__(self, *exc):
+      stop_reporting(self.sts)
+      self.task.cancel()
+      try:
+         await self.task
+      except asyncio.CancelledError:
+         pass
+
+   async def _run(self):
+      while True:
+         await asyncio.sleep(self.interval)
+         # A final status (cancelled/completed) may have been written meanwhile
+         if REPORTERS.get(self.sts.id) is not self:
+            return
+         try:
+            await edit(self.msg, 'Progressing', self.status, self.sts)
+         except Exception as e:
+            logger.warning(f"Progress update failed for job {self.sts.id}: {e}")
+
+def stop_reporting(sts):
+   REPORTERS.pop(sts.id, None)
+
+async def report(msg, sts, status):
+   """Show `status` (seconds of flood sleep, or 10 while forwarding) on the job's message now"""
+   if sts.get('PARENT'):
+      # Fan-out targets report through the job that owns the message
+      sts = STS(sts.get('PARENT'))
+   reporter = REPORTERS.get(sts.id)
+   if reporter:
+      reporter.status = status
+   await edit(msg, 'Progressing', status, sts, force=True, token=cancel_token(sts))
+
+async def is_cancelled(client, user, msg, sts, queue_id=None):
    if temp.CANCEL.get(user)==True:
-      temp.IS_FRWD_CHAT.remove(sts.TO)
-      await edit(msg, "Cancelled", "completed", sts, force=True)
-      await send(client, user, "<b>❌ Forwarding Process Cancelled</b>")
-      # Mark queue as cancelled
-      await db.update_queue_status(user, 'cancelled')
-      await stop(client, user)
+      await end_cancelled(client, user, msg, sts, queue_id)
       return True 
    return False 
 
-async def should_forward_message(message, user_id):
-    """Check if message should be forwarded based on user filters"""
+async def end_cancelled(client, user, msg, sts, queue_id=None):
+   stop_reporting(sts)
+   await edit(msg, "Cancelled", "completed", sts, force=True)
+   await send(client, user, "<b>❌ Forwarding Process Cancelled</b>")
+   # Mark queue as cancelled
+   await db.update_queue_status(user, 'cancelled', queue_id)
+   await stop(client, user)
+
+async def save_checkpoint(queue_id, last_id, sts, dead=None):
+   counters = {key: sts.get(key) for key in ('total_files', 'filtered', 'deleted', 'duplicate', 'retries', 'wasted')}
+   try:
+      await db.save_checkpoint(queue_id, {'last_id': last_id, 'counters': counters, 'dead': dead or {}})
+   except Exception as e:
+      logger.warning(f"Failed to save checkpoint for job {sts.id}: {e}")
+
+async def cancel_requested(queue_id):
+   """Cancel flag the bot process set on a worker's queue item, read at checkpoints between heartbeats"""
+   try:
+      return await db.cancel_requested(queue_id)
+   except Exception as e:
+      logger.warning(f"Failed to read the cancel flag of job {queue_id}: {e}")
+      return False
+
+def filter_reason(message, plan):
+    """Return why the job's compiled filters reject message, or None to forward it"""
     try:
-        configs = await get_configs(user_id)
-        filters = configs.get('filters', {})
-
-        print(f"=== FILTER CHECK for Message {message.id} ===")
-        print(f"User configs keys: {list(configs.keys())}")
-        print(f"User filters: {filters}")
-        print(f"Keywords config: {configs.get('keywords', [])}")
-        print(f"Image+text filter: {filters.get('image_text', False)}")
-        print(f"Message type: text={bool(message.text)}, photo={bool(message.photo)}, video={bool(message.video)}")
-        print(f"Message caption: {bool(message.caption)}")
-        
-        if message.caption:
-            try:
-                caption_preview = message.caption[:50]
-                print(f"Caption content: '{caption_preview}...'")
-            except:
-                print(f"Caption content: [ENCODING ERROR]")
+        return plan.filter.check(message)
+    except Exception as e:
+        logger.exception(f"Error checking filters for message {message.id}: {e}")
+        return None  # Default to allow forwarding if there's an error
 
-        # Check message type filters
-        print(f"Checking message type filters...")
-        
-        # Check if any filters are actually enabled (not default True values)
-        # If no filters are explicitly set to True, allow all messages (backward compatibility)
-        any_filter_enabled = any(filters.get(filter_type, False) for filter_type in 
-                               ['text', 'photo', 'video', 'document', 'audio', 'voice', 'animation', 'sticker', 'poll', 'image_text'])
-        
-        if not any_filter_enabled:
-            print(f"Message {message.id}: No specific filters enabled - allowing all message types")
-            message_allowed = True
-        else:
-            # At least one filter is enabled, so check individual message type filters
-            message_allowed = False
-            
-            # Check image+text filter first (special case - requires both image AND text/caption)
-            if filters.get('image_text', False):
-                has_image = bool(message.photo)
-                has_text_or_caption = bool(message.caption and message.caption.strip()) or bool(message.text and message.text.strip())
-                if has_image and has_text_or_caption:
-                    print(f"Message {message.id}: PASSED image+text filter (has both image and text/caption)")
-                    message_allowed = True
-            
-            # Check individual message type filters (using if instead of elif so multiple can match)
-            if message.text and filters.get('text', False):
-                print(f"Message {message.id}: Text message - filter ENABLED")
-                message_allowed = True
-            if message.photo and filters.get('photo', False):
-                print(f"Message {message.id}: Photo message - filter ENABLED")
-                message_allowed = True
-            if message.video and filters.get('video', False):
-                print(f"Message {message.id}: Video message - filter ENABLED")
-                message_allowed = True
-            if message.document and filters.get('document', False):
-                print(f"Message {message.id}: Document message - filter ENABLED")
-                message_allowed = True
-            if message.audio and filters.get('audio', False):
-                print(f"Message {message.id}: Audio message - filter ENABLED")
-                message_allowed = True
-            if message.voice and filters.get('voice', False):
-                print(f"Message {message.id}: Voice message - filter ENABLED")
-                message_allowed = True
-            if message.animation and filters.get('animation', False):
-                print(f"Message {message.id}: Animation message - filter ENABLED")
-                message_allowed = True
-            if message.sticker and filters.get('sticker', False):
-                print(f"Message {message.id}: Sticker message - filter ENABLED")
-                message_allowed = True
-            if message.poll and filters.get('poll', False):
-                print(f"Message {message.id}: Poll message - filter ENABLED")
-                message_allowed = True
-                
-            if not message_allowed:
-                print(f"Message {message.id}: REJECTED - message type not enabled in filters")
-                return False
-
-        # Check file size limit
-        file_size_limit = configs.get('file_size', 0)
-        size_limit_type = configs.get('size_limit')
-
-        print(f"Checking file size limit: {file_size_limit} MB, type: {size_limit_type}")
-        if file_size_limit > 0 and message.media:
-            media = getattr(message, message.media.value, None)
-            if media and hasattr(media, 'file_size'):
-                file_size_mb = media.file_size / (1024 * 1024)  # Convert to MB
-                print(f"File size: {file_size_mb:.2f} MB")
-
-                if size_limit_type is True:  # More than
-                    if file_size_mb <= file_size_limit:
-                        print(f"Message {message.id}: REJECTED - file size {file_size_mb:.2f} MB <= {file_size_limit} MB")
-                        return False
-                elif size_limit_type is False:  # Less than
-                    if file_size_mb >= file_size_limit:
-                        print(f"Message {message.id}: REJECTED - file size {file_size_mb:.2f} MB >= {file_size_limit} MB")
-                        return False
-
-        # Check extension filters
-        extensions = configs.get('extension')
-        print(f"Extension filters: {extensions}")
-        if extensions and message.document:
-            file_name = getattr(message.document, 'file_name', '')
-            if file_name:
-                file_ext = file_name.split('.')[-1].lower()
-                print(f"File extension: {file_ext}")
-                if file_ext in [ext.lower().strip('.') for ext in extensions]:
-                    print(f"Message {message.id}: REJECTED - extension {file_ext} is filtered")
-                    return False
-
-        # Check keyword filters
-        keywords = configs.get('keywords', [])
-        print(f"Keyword filters: {keywords}")
-        if keywords and len(keywords) > 0:
-            message_text = ""
-            if message.text:
-                message_text = message.text.lower()
-            elif message.caption:
-                message_text = message.caption.lower()
-            elif message.document and hasattr(message.document, 'file_name'):
-                message_text = message.document.file_name.lower()
-
-            print(f"Message text for keyword check: '{message_text[:100]}...'")
-            if message_text:
-                # If keywords are set, message must contain at least one keyword
-                keyword_found = any(keyword.lower().strip() in message_text for keyword in keywords if keyword.strip())
-                print(f"Keyword found: {keyword_found}")
-                if not keyword_found:
-                    print(f"Message {message.id}: REJECTED - no keywords found")
-                    return False
-            else:
-                print(f"Message {message.id}: REJECTED - no text content for keyword matching")
-                return False
-
-        print(f"Message {message.id}: PASSED all filters")
-        return True
-    
+async def is_duplicate_message(key, dedup):
+    """Check whether the target already received content with this key"""
+    try:
+        return await dedup.seen(key)
     except Exception as e:
-        print(f"Error in should_forward_message: {e}")
-        import traceback
-        traceback.print_exc()
-        return True  # Default to allow forwarding if there's an error
-
-async def is_duplicate_message(message, user_id):
-    """Check if message is duplicate based on user settings"""
-    configs = await get_configs(user_id)
-
-    if not configs.get('duplicate', True):
-        return False  # Duplicate checking is disabled
-
-    # Simple duplicate check based on file_id for media messages
-    if message.media:
-        media = getattr(message, message.media.value, None)
-        if media and hasattr(media, 'file_unique_id'):
-            # Here you could implement database storage of seen file IDs
-            # For now, we'll return False to not block any messages
-            # You can enhance this with proper duplicate tracking
-            pass
-
-    return False
-
-async def stop(client, user):
-   try:
-     await client.stop()
-   except:
-     pass 
+        logger.warning(f"Duplicate lookup failed for {key}: {e}")
+        return False  # Default to allow forwarding if the index is unreachable
+
+async def stop(client, user, error=None):
+   # The client goes back to the pool warm for the next job, unless `error` shows it is broken
+   await client_pool.release(client, error)
    await db.rmve_frwd(user)
    temp.forwardings -= 1
    temp.lock[user] = False 
 
-async def send(bot, user, text):
+async def send(bot, user, text, button=None):
    try:
-      await bot.send_message(user, text=text)
+      await bot.send_message(user, text=text, reply_markup=button)
    except:
       pass 
 
-def custom_caption(message, caption):
-    if message.caption:
-       # Use original caption as is without html escaping
-       old_caption = message.caption
-
-       if caption:
-          # Use custom caption as is
-          new_caption = caption.replace('{caption}', old_caption) if caption else old_caption
-       else:
-          new_caption = old_caption 
+def render_caption(message, plan, source_link=None):
+    """Caption for a copied media message: the job's compiled template (or the original caption) plus the FTM footer"""
+    if plan.template is None and plan.drop_captions:
+       caption = ""
     else:
-       if caption:
-          # Use custom caption as is when there's no original caption
-          new_caption = caption
-       else:
-          new_caption = ""
-    return new_caption
+       caption = (plan.template or ORIGINAL_CAPTION).render(message, source_link, ftm=plan.ftm_mode)
+    if plan.ftm_mode:
+       caption = add_ftm_caption(caption, source_link)
+    return caption
 
 def get_size(size):
   units = ["Bytes", "KB", "MB", "GB", "TB", "PB", "EB"]
@@ -881,9 +1515,82 @@ def retry_btn(id):
 async def terminate_frwding(bot, m):
     user_id = m.from_user.id 
     temp.lock[user_id] = False
-    temp.CANCEL[user_id] = True 
+    cancel_jobs(user_id)
+    if Config.USE_WORKERS:
+        await db.request_cancel(user_id)
     await m.answer("Forwarding cancelled !", show_alert=True)
 
+@Client.on_callback_query(filters.regex(r'^cancel_dryrun#'))
+async def cancel_dry_run(bot, m):
+    token = DRY_RUNS.get(m.data.split('#', 1)[1])
+    if not token or token.user_id != m.from_user.id:
+      return await m.answer("This dry run is not running anymore", show_alert=True)
+    token.cancel()
+    await m.answer("Dry run cancelled", show_alert=False)
+
+@Client.on_callback_query(filters.regex(r'^retry_failed#'))
+async def retry_failed(bot, query):
+    """Re-send only the messages a finished job failed to send, one job per target"""
+    user = query.from_user.id
+    if not await db.get_bot(user):
+        return await query.answer("You didn't add any bot. Please add a bot using /settings", show_alert=True)
+    try:
+        item = await db.get_dead_letters(user, query.data.split('#', 1)[1])
+    except Exception:
+        item = None
+    if not item:
+        return await query.answer("Nothing left to retry for this task.", show_alert=True)
+    await query.answer()
+    await query.message.edit_reply_markup(None)
+    data = item.get('process_data') or {}
+    kept = False
+    for n, target in enumerate(item['dead_letters']):
+        # Taken one target at a time, so the ids of targets not started yet stay in the database
+        ids = await db.take_dead_letters(item['_id'], target)
+        if not ids:
+            continue
+        started = False
+        try:
+            frwd_id = f"{user}-r{item['_id']}-{n}"
+            to_chat = int(target) if target.lstrip('-').isdigit() else target
+            sts = STS(frwd_id).store(data['from_chat'], to_chat, 0, max(ids), mode='retry', ids=ids)
+            plan = await sts.get_plan(user)
+            m = await bot.send_message(user, f"<code>♻️ Retrying {len(ids)} failed messages into {target}...</code>")
+            started = await submit_job(bot, user, frwd_id, sts, sts.get(full=True), m, plan)
+        except Exception as e:
+            logger.error(f"Failed to start the retry of {len(ids)} messages into {target} for user {user}: {e}")
+        if not started:
+            await db.restore_dead_letters(item['_id'], target, ids)
+            kept = True
+    if kept:
+        await send(bot, user, "<b>⚠️ Some failed messages could not be retried right now.</b>",
+                   InlineKeyboardMarkup([[InlineKeyboardButton('♻️ Retry again', f"retry_failed#{item['_id']}")]]))
+
+@Client.on_callback_query(filters.regex(r'^cancel_queued$'))
+async def cancel_queued(bot, m):
+    cancelled = scheduler.cancel_queued(m.from_user.id)
+    if Config.USE_WORKERS:
+        cancelled += await db.request_cancel(m.from_user.id, running=False)
+    if cancelled:
+        await m.answer("Queued task cancelled !", show_alert=True)
+    else:
+        await m.answer("Nothing is waiting in the queue.", show_alert=True)
+
+@Client.on_message(filters.private & filters.command(['jobdebug']))
+async def toggle_job_debug(bot, message):
+    if not Config.is_sudo_user(message.from_user.id):
+        return
+    try:
+        user_id = int(message.command[1]) if len(message.command) > 1 else message.from_user.id
+    except ValueError:
+        return await message.reply("<b>Usage:</b> <code>/jobdebug [user_id]</code>")
+    if user_id in temp.DEBUG_JOBS:
+        temp.DEBUG_JOBS.discard(user_id)
+        await message.reply(f"<b>Per-message job logging disabled for</b> <code>{user_id}</code>")
+    else:
+        temp.DEBUG_JOBS.add(user_id)
+        await message.reply(f"<b>Per-message job logging enabled for</b> <code>{user_id}</code>")
+
 @Client.on_callback_query(filters.regex(r'^fwrdstatus'))
 async def status_msg(bot, msg):
     _, status, est_time, percentage, frwd_id = msg.data.split("#")
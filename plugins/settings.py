@@ -6,6 +6,9 @@ from translation import Translation
 from plugins.fsub import force_subscribe_required
 from pyrogram import Client, filters
 from plugins.test import get_configs, update_configs, CLIENT, parse_buttons
+from plugins.ftm_alpha import start_mirror, stop_mirror
+from plugins.ftm_caption import PLACEHOLDERS
+from plugins.ftm_filters import regex_problem
 from pyrogram.types import InlineKeyboardButton, InlineKeyboardMarkup
 
 # CLIENT instance will be created when needed
@@ -63,11 +66,11 @@ async def settings_callback(bot: Client, query):
 
   elif type=="bots":
      buttons = []
-     _bot = await db.get_bot(user_id)
-     if _bot is not None:
+     _bots = await db.get_bots(user_id)
+     for _bot in _bots:
         buttons.append([InlineKeyboardButton(_bot['name'],
-                         callback_data=f"settings#editbot")])
-     else:
+                         callback_data=f"settings#editbot_{_bot['id']}")])
+     if len(_bots) < Config.MAX_BOTS_PER_USER:
         buttons.append([InlineKeyboardButton('✚ Add bot ✚',
                       callback_data="settings#addbot")])
         buttons.append([InlineKeyboardButton('✚ Add User bot (Session) ✚',
@@ -77,7 +80,7 @@ async def settings_callback(bot: Client, query):
      buttons.append([InlineKeyboardButton('↩ Back',
                       callback_data="settings#main")])
      await query.message.edit_text(
-       "<b><u>My Bots</b></u>\n\n<b>You can manage your bots in here</b>",
+       "<b><u>My Bots</b></u>\n\n<b>You can manage your bots in here</b>\n\n<b>Forwarding jobs are spread across every bot you add here.</b>",
        reply_markup=InlineKeyboardMarkup(buttons))
 
   elif type=="addbot":
@@ -186,25 +189,27 @@ async def settings_callback(bot: Client, query):
          if text:
              await text.edit_text('Process has been automatically cancelled', reply_markup=InlineKeyboardMarkup(buttons))
 
-  elif type=="editbot":
-     bot = await db.get_bot(user_id)
+  elif type.startswith("editbot"):
+     bot_id = type.split('_')[1] if '_' in type else None
+     bot = await db.get_bot_by_id(user_id, bot_id) if bot_id else await db.get_bot(user_id)
      if bot is None:
         await query.message.edit_text(
            "<b>No bot found. Please add a bot first.</b>",
            reply_markup=InlineKeyboardMarkup([[InlineKeyboardButton('↩ Back', callback_data="settings#bots")]]))
         return
      TEXT = Translation.BOT_DETAILS if bot['is_bot'] else Translation.USER_DETAILS
-     buttons = [[InlineKeyboardButton('❌ Remove ❌', callback_data=f"settings#removebot")
+     buttons = [[InlineKeyboardButton('❌ Remove ❌', callback_data=f"settings#removebot_{bot['id']}")
                ],
                [InlineKeyboardButton('↩ Back', callback_data="settings#bots")]]
      await query.message.edit_text(
         TEXT.format(bot['name'], bot['id'], bot['username']),
         reply_markup=InlineKeyboardMarkup(buttons))
 
-  elif type=="removebot":
+  elif type.startswith("removebot"):
      # Get bot details before removal for notification
-     bot_details = await db.get_bot(user_id)
-     await db.remove_bot(user_id)
+     bot_id = type.split('_')[1] if '_' in type else None
+     bot_details = await db.get_bot_by_id(user_id, bot_id) if bot_id else await db.get_bot(user_id)
+     await db.remove_bot(user_id, bot_id)
 
      # Send notification for bot removal
      try:
@@ -268,7 +273,7 @@ async def settings_callback(bot: Client, query):
      buttons.append([InlineKeyboardButton('↩ Back',
                       callback_data="settings#main")])
      await query.message.edit_text(
-        "<b><u>CUSTOM CAPTION</b></u>\n\n<b>You can set a custom caption to videos and documents. Normaly use its default caption</b>\n\n<b><u>AVAILABLE FILLINGS:</b></u>\n- <code>{filename}</code> : Filename\n- <code>{size}</code> : File size\n- <code>{caption}</code> : default caption",
+        "<b><u>CUSTOM CAPTION</b></u>\n\n<b>You can set a custom caption to videos and documents. Normaly use its default caption</b>\n\n<b><u>AVAILABLE FILLINGS:</b></u>\n" + caption_fillings(),
         reply_markup=InlineKeyboardMarkup(buttons))
 
   elif type=="seecaption":
@@ -292,7 +297,7 @@ async def settings_callback(bot: Client, query):
      await query.message.delete()
      text = None
      try:
-         text = await bot.send_message(user_id, "Send your custom caption\n\n<b>Available variables:</b>\n- <code>{filename}</code> - File name\n- <code>{size}</code> - File size\n- <code>{caption}</code> - Original caption\n\n/cancel - <code>cancel this process</code>")
+         text = await bot.send_message(user_id, "Send your custom caption\n\n<b>Available variables:</b>\n" + caption_fillings() + "\n\n/cancel - <code>cancel this process</code>")
 
          client_instance = CLIENT()
          caption_msg = await client_instance._wait_for_message(bot, user_id, timeout=300)
@@ -313,11 +318,11 @@ async def settings_callback(bot: Client, query):
          # Validate caption format
          try:
             # Test if caption format is valid with sample data
-            test_caption = caption_text.format(filename='test.txt', size='1.5 MB', caption='test caption')
+            test_caption = caption_text.format(**{name: 'test' for name in PLACEHOLDERS})
          except KeyError as e:
             await caption_msg.delete()
             return await text.edit_text(
-               f"<b>❌ Invalid variable {e} used in your caption.</b>\n\n<b>Available variables:</b>\n- <code>{{filename}}</code>\n- <code>{{size}}</code>\n- <code>{{caption}}</code>",
+               f"<b>❌ Invalid variable {e} used in your caption.</b>\n\n<b>Available variables:</b>\n" + caption_fillings(),
                reply_markup=InlineKeyboardMarkup(buttons))
          except Exception as e:
             await caption_msg.delete()
@@ -486,7 +491,7 @@ async def settings_callback(bot: Client, query):
         await update_configs(user_id, key, False)
      else:
         await update_configs(user_id, key, True)
-     if key in ['poll', 'protect']:
+     if key in ['poll', 'protect', 'drop_captions']:
         return await query.edit_message_reply_markup(
            reply_markup=await next_filters_buttons(user_id))
      await query.edit_message_reply_markup(
@@ -653,6 +658,99 @@ async def settings_callback(bot: Client, query):
     await query.message.edit_text(text="**successfully deleted**",
                                    reply_markup=InlineKeyboardMarkup(buttons))
 
+  elif type == "add_exclude_keyword":
+    await query.message.delete()
+    text = None
+    try:
+        text = await bot.send_message(user_id, text="**Send keywords to exclude (space separated)**\n\n<b>Example:</b> cam trailer sample\n\n<b>Note:</b> Messages containing any of these words will not be forwarded\n\n/cancel - cancel this process")
+        ask = await bot.listen(chat_id=user_id, timeout=300)
+        if ask.text == '/cancel':
+           await ask.delete()
+           return await text.edit_text(
+                      "<b>Process canceled</b>",
+                      reply_markup=InlineKeyboardMarkup(buttons))
+
+        new_keywords = [word.strip() for word in (ask.text or "").split() if word.strip()]
+        if not new_keywords:
+            await ask.delete()
+            return await text.edit_text(
+                "<b>No keywords found! Try: cam trailer</b>",
+                reply_markup=InlineKeyboardMarkup(buttons))
+
+        current_keywords = (await get_configs(user_id))['exclude_keywords']
+        if current_keywords and isinstance(current_keywords, list):
+            for word in new_keywords:
+                if word.lower() not in [k.lower() for k in current_keywords]:  # Avoid duplicates
+                    current_keywords.append(word)
+            final_keywords = current_keywords
+        else:
+            final_keywords = new_keywords
+
+        await update_configs(user_id, 'exclude_keywords', final_keywords)
+        await ask.delete()
+        await text.edit_text(
+            f"**✅ Added {len(new_keywords)} excluded keyword(s)**\n\n<b>Total:</b> {len(final_keywords)}\n<b>Keywords:</b> {', '.join(final_keywords[:10])}{'...' if len(final_keywords) > 10 else ''}",
+            reply_markup=InlineKeyboardMarkup(buttons))
+    except asyncio.exceptions.TimeoutError:
+        if text:
+            await text.edit_text('Process cancelled automatically', reply_markup=InlineKeyboardMarkup(buttons))
+
+  elif type == "get_exclude_keyword":
+    keywords = (await get_configs(user_id))['exclude_keywords']
+    btn = extract_btn(keywords)
+    btn.append([InlineKeyboardButton('✚ ADD ✚', 'settings#add_exclude_keyword')])
+    btn.append([InlineKeyboardButton('Remove all', 'settings#rmve_all_exclude_keyword')])
+    btn.append([InlineKeyboardButton('↩ Back', 'settings#main')])
+    await query.message.edit_text(
+        text='<b><u>EXCLUDED KEYWORDS</u></b>\n\n**Messages with these keywords will not forward**',
+        reply_markup=InlineKeyboardMarkup(btn))
+
+  elif type == "rmve_all_exclude_keyword":
+    await update_configs(user_id, 'exclude_keywords', None)
+    await query.message.edit_text(text="**successfully deleted**",
+                                   reply_markup=InlineKeyboardMarkup(buttons))
+
+  elif type == "regex":
+    regex = (await get_configs(user_id))['regex']
+    btn = [[InlineKeyboardButton('✚ Set regex ✚', 'settings#add_regex')]]
+    if regex:
+       btn.append([InlineKeyboardButton('Remove regex', 'settings#rmve_regex')])
+    btn.append([InlineKeyboardButton('↩ Back', 'settings#main')])
+    await query.message.edit_text(
+        text=f"<b><u>REGEX FILTER</u></b>\n\n**Only messages matching this pattern will forward**\n\n<b>Current:</b> <code>{regex or 'None'}</code>",
+        reply_markup=InlineKeyboardMarkup(btn))
+
+  elif type == "add_regex":
+    await query.message.delete()
+    text = None
+    try:
+        text = await bot.send_message(user_id, text="**Send a regular expression**\n\n<b>Example:</b> <code>(720|1080)p</code>\n\n<b>Note:</b> Matching is case-insensitive\n\n/cancel - cancel this process")
+        ask = await bot.listen(chat_id=user_id, timeout=300)
+        if ask.text == '/cancel':
+           await ask.delete()
+           return await text.edit_text(
+                      "<b>Process canceled</b>",
+                      reply_markup=InlineKeyboardMarkup(buttons))
+        problem = regex_problem(ask.text or "")
+        if problem:
+            await ask.delete()
+            return await text.edit_text(
+                f"<b>Invalid regex:</b> <code>{problem}</code>",
+                reply_markup=InlineKeyboardMarkup(buttons))
+        await update_configs(user_id, 'regex', ask.text)
+        await ask.delete()
+        await text.edit_text(
+            f"**✅ Regex filter set**\n\n<code>{ask.text}</code>",
+            reply_markup=InlineKeyboardMarkup(buttons))
+    except asyncio.exceptions.TimeoutError:
+        if text:
+            await text.edit_text('Process cancelled automatically', reply_markup=InlineKeyboardMarkup(buttons))
+
+  elif type == "rmve_regex":
+    await update_configs(user_id, 'regex', None)
+    await query.message.edit_text(text="**successfully deleted**",
+                                   reply_markup=InlineKeyboardMarkup(buttons))
+
   elif type=="ftmmode":
      # New FTM main menu with Delta and Alpha options
      user_can_use_ftm = await db.can_use_ftm_mode(user_id)
@@ -664,6 +762,11 @@ async def settings_callback(bot: Client, query):
      else:
          buttons.append([InlineKeyboardButton('🔥 FTM Delta Mode (Pro Only)', callback_data='settings#ftm_delta')])
 
+     if await db.can_use_ftm_alpha_mode(user_id):
+         buttons.append([InlineKeyboardButton('⚡ FTM Alpha Mode', callback_data='settings#ftm_alpha')])
+     else:
+         buttons.append([InlineKeyboardButton('⚡ FTM Alpha Mode (Pro Only)', callback_data='settings#ftm_alpha')])
+
      buttons.append([InlineKeyboardButton('↩ Back', callback_data="settings#main")])
 
      await query.message.edit_text(
@@ -817,6 +920,10 @@ async def settings_callback(bot: Client, query):
          return await query.answer("❌ Please configure source and target channels first!", show_alert=True)
 
      await db.set_alpha_config(user_id, enabled=new_status)
+     if new_status:
+         await start_mirror(user_id)
+     else:
+         await stop_mirror(user_id)
      await query.answer(f"✅ FTM Alpha Mode {'enabled' if new_status else 'disabled'}!", show_alert=True)
 
      # Refresh the Alpha mode settings - create new query data and call handler again
@@ -829,8 +936,7 @@ async def settings_callback(bot: Client, query):
      if not user_can_use_alpha:
          return await query.answer("❌ FTM Alpha Mode requires Pro plan!", show_alert=True)
 
-     await query.answer("📤 Send the source channel username or invite link (e.g., @channel or https://t.me/channel)", show_alert=True)
-     # Note: This would need additional input handling in a real implementation
+     await set_alpha_chat(bot, query, 'source')
 
   elif type=="set_alpha_target":
      # Set Alpha mode target channel
@@ -838,13 +944,43 @@ async def settings_callback(bot: Client, query):
      if not user_can_use_alpha:
          return await query.answer("❌ FTM Alpha Mode requires Pro plan!", show_alert=True)
 
-     await query.answer("📥 Send the target channel username or invite link (e.g., @channel or https://t.me/channel)", show_alert=True)
-     # Note: This would need additional input handling in a real implementation
+     await set_alpha_chat(bot, query, 'target')
 
   elif type.startswith("alert"):
     alert = type.split('_')[1]
     await query.answer(alert, show_alert=True)
 
+async def set_alpha_chat(bot, query, which):
+  """Ask for a forward from the Alpha source or target chat and save it, restarting a running mirror"""
+  user_id = query.from_user.id
+  buttons = [[InlineKeyboardButton('↩ Back', callback_data="settings#ftm_alpha")]]
+  await query.message.delete()
+  text = None
+  try:
+      text = await bot.send_message(user_id, f"<b>❪ SET ALPHA {which.upper()} CHAT ❫\n\nForward a message from your {which} channel\n/cancel - cancel this process</b>")
+      reply = await bot.listen(chat_id=user_id, timeout=300)
+      if reply.text == "/cancel":
+         await reply.delete()
+         return await text.edit_text("<b>process canceled</b>", reply_markup=InlineKeyboardMarkup(buttons))
+      if not reply.forward_from_chat:
+         await reply.delete()
+         return await text.edit_text("**This is not a forward message from a channel**", reply_markup=InlineKeyboardMarkup(buttons))
+      chat = reply.forward_from_chat
+      await reply.delete()
+      if which == 'source':
+         await db.set_alpha_config(user_id, source_chat=chat.id)
+      else:
+         await db.set_alpha_config(user_id, target_chat=chat.id)
+      # Picks up the new chat; does nothing while Alpha mode is off
+      await start_mirror(user_id)
+      await text.edit_text(f"<b>Alpha {which} set to {chat.title}</b>", reply_markup=InlineKeyboardMarkup(buttons))
+  except asyncio.exceptions.TimeoutError:
+      if text:
+          await text.edit_text('Process has been automatically cancelled', reply_markup=InlineKeyboardMarkup(buttons))
+
+def caption_fillings():
+  return "\n".join(f"- <code>{{{name}}}</code> : {meaning}" for name, meaning in PLACEHOLDERS.items())
+
 def main_buttons():
   buttons = [[
        InlineKeyboardButton('🤖 Bᴏᴛs',
@@ -1013,6 +1149,11 @@ async def next_filters_buttons(user_id):
        InlineKeyboardButton('✅' if filter['protect'] else '❌',
                     callback_data=f'settings#updatefilter-protect-{filter["protect"]}')
        ],[
+       InlineKeyboardButton('✂️ Drop captions',
+                    callback_data=f'settings#updatefilter-drop_captions-{filter["drop_captions"]}'),
+       InlineKeyboardButton('✅' if filter['drop_captions'] else '❌',
+                    callback_data=f'settings#updatefilter-drop_captions-{filter["drop_captions"]}')
+       ],[
        InlineKeyboardButton('🛑 size limit',
                     callback_data='settings#file_size')
        ],[
@@ -1022,6 +1163,11 @@ async def next_filters_buttons(user_id):
        InlineKeyboardButton('♦️ keywords ♦️',
                     callback_data='settings#get_keyword')
        ],[
+       InlineKeyboardButton('🚫 Exclude keywords',
+                    callback_data='settings#get_exclude_keyword'),
+       InlineKeyboardButton('🔣 Regex',
+                    callback_data='settings#regex')
+       ],[
        InlineKeyboardButton('⫷ back',
                     callback_data="settings#main")
        ]]
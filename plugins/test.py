@@ -1,16 +1,20 @@
 import os
 import re
 import sys
+import time
 import typing
 import asyncio
+import hashlib
 import logging
+import psutil
+from collections import OrderedDict
 from database import db
 from config import Config, temp
-from pyrogram import Client, filters
+from pyrogram import Client, filters, raw, utils
 from pyrogram.raw.all import layer
 from pyrogram.types import InlineKeyboardButton, InlineKeyboardMarkup, CallbackQuery, Message
 from pyrogram.errors.exceptions.bad_request_400 import AccessTokenExpired, AccessTokenInvalid
-from pyrogram.errors import FloodWait
+from pyrogram.errors import FloodWait, Unauthorized
 from config import Config
 from translation import Translation
 
@@ -72,11 +76,14 @@ async def get_configs(user_id):
                 'caption': None,
                 'forward_tag': False,
                 'protect': False,
+                'drop_captions': False,
                 'duplicate': True,
                 'file_size': 0,
                 'size_limit': False,
                 'extension': [],
                 'keywords': [],
+                'exclude_keywords': [],
+                'regex': None,
                 'button': None,
                 'db_uri': None,
                 'ftm_mode': False
@@ -87,6 +94,10 @@ async def get_configs(user_id):
             user_data['ftm_mode'] = False
         if 'keywords' not in user_data:
             user_data['keywords'] = []
+        if 'exclude_keywords' not in user_data:
+            user_data['exclude_keywords'] = []
+        if 'regex' not in user_data:
+            user_data['regex'] = None
         if 'extension' not in user_data:
             user_data['extension'] = []
         if 'file_size' not in user_data:
@@ -97,6 +108,8 @@ async def get_configs(user_id):
             user_data['duplicate'] = True
         if 'protect' not in user_data:
             user_data['protect'] = False
+        if 'drop_captions' not in user_data:
+            user_data['drop_captions'] = False
         if 'forward_tag' not in user_data:
             user_data['forward_tag'] = False
         if 'caption' not in user_data:
@@ -158,11 +171,14 @@ async def get_configs(user_id):
             'caption': None,
             'forward_tag': False,
             'protect': False,
+            'drop_captions': False,
             'duplicate': True,
             'file_size': 0,
             'size_limit': False,
             'extension': [],
             'keywords': [],
+            'exclude_keywords': [],
+            'regex': None,
             'button': None,
             'db_uri': None,
             'ftm_mode': False
@@ -172,7 +188,7 @@ async def update_configs(user_id, key, value):
     """Update user configuration in database"""
     try:
         current = await get_configs(user_id)
-        if key in ['caption', 'duplicate', 'db_uri', 'forward_tag', 'protect', 'file_size', 'size_limit', 'extension', 'keywords', 'button', 'ftm_mode']:
+        if key in ['caption', 'duplicate', 'db_uri', 'forward_tag', 'protect', 'drop_captions', 'file_size', 'size_limit', 'extension', 'keywords', 'exclude_keywords', 'regex', 'button', 'ftm_mode']:
             current[key] = value
         else:
             current['filters'][key] = value
@@ -195,21 +211,203 @@ async def start_clone_bot(FwdBot, data=None):
         filter: "types.TypeMessagesFilter" = None,
     ) -> Optional[AsyncGenerator["types.Message", None]]:
         """Iterate through a chat sequentially."""
-        current = offset
-        while True:
-            new_diff = min(200, limit - current)
-            if new_diff <= 0:
-                return
-            messages = await self.get_messages(chat_id, list(range(current, current+new_diff+1)))
+        async for messages in self.iter_batches(chat_id, limit, offset):
             for message in messages:
                 yield message
-                current += 1
+
+    async def iter_batches(
+        self,
+        chat_id: Union[int, str],
+        limit: int,
+        offset: int = 0,
+    ) -> Optional[AsyncGenerator[list, None]]:
+        """Iterate through ids offset..limit of a chat in order, one batch at a time.
+
+        Batches are contiguous get_messages ranges, which include deleted ids as
+        empty messages. When most of a range comes back empty and this is a user
+        account, it pages the history between min/max id bounds instead, which
+        returns only messages that exist; bots cannot read history.
+        """
+        current = max(1, offset)
+        sparse = False
+        can_page = not getattr(self.me, 'is_bot', True)
+        while current <= limit:
+            if sparse:
+                messages = await history_page(self, chat_id, current, limit)
+                if not messages:
+                    return
+                yield messages
+                span = messages[-1].id - current + 1
+                current = messages[-1].id + 1
+                sparse = len(messages) / span < SPARSE_RATIO
+            else:
+                ids = list(range(current, min(current + RANGE_SIZE, limit + 1)))
+                messages = await self.get_messages(chat_id, ids)
+                yield messages
+                current = ids[-1] + 1
+                empty = sum(1 for message in messages if message.empty)
+                sparse = can_page and empty / len(ids) >= SPARSE_RATIO
 
     # Bind the method to the instance properly
     import types
     FwdBot.iter_messages = types.MethodType(iter_messages, FwdBot)
+    FwdBot.iter_batches = types.MethodType(iter_batches, FwdBot)
     return FwdBot
 
+# Most ids get_messages accepts per call, and messages one history page returns
+RANGE_SIZE = 200
+HISTORY_PAGE = 100
+# Share of empty ids in a range above which history paging is cheaper
+SPARSE_RATIO = 0.5
+
+async def history_page(client, chat_id, start, end):
+    """Up to HISTORY_PAGE existing messages with start <= id <= end, oldest first"""
+    result = await client.invoke(
+        raw.functions.messages.GetHistory(
+            peer=await client.resolve_peer(chat_id),
+            offset_id=start,
+            offset_date=0,
+            add_offset=-HISTORY_PAGE,
+            limit=HISTORY_PAGE,
+            max_id=end + 1,
+            min_id=start - 1,
+            hash=0
+        )
+    )
+    messages = await utils.parse_messages(client, result)
+    return sorted((m for m in messages if start <= m.id <= end), key=lambda m: m.id)
+
+async def latest_message_id(client, chat_id, after=0):
+    """Id of the newest message in a chat, or `after` if there is nothing newer"""
+    if not getattr(client.me, 'is_bot', True):
+        async for message in client.get_chat_history(chat_id, limit=1):
+            return max(after, message.id)
+        return after
+    # Bots cannot read history: probe forward range by range. An empty range may only be a run of
+    # deleted posts, so ids spread far beyond it are checked (one call) before it counts as the head
+    latest = current = after
+    while True:
+        ids = list(range(current + 1, current + RANGE_SIZE + 1))
+        found = [message.id for message in await client.get_messages(chat_id, ids) if not message.empty]
+        if found:
+            latest = max(found)
+            current = ids[-1]
+            continue
+        found = [message.id for message in await client.get_messages(chat_id, probe_ids(current)) if not message.empty]
+        if not found:
+            return latest
+        latest = current = max(found)
+
+# Octaves of distance probe_ids() reaches past a gap (2 ** 24 ids), and ids sampled in each
+PROBE_OCTAVES = 24
+PROBE_PER_OCTAVE = 8
+
+def probe_ids(base):
+    """Ids above `base` at exponentially growing distances, several per octave so a few deleted ones do not hide the rest"""
+    ids = {base + (1 << k) + ((1 << k) * n) // PROBE_PER_OCTAVE for k in range(PROBE_OCTAVES) for n in range(PROBE_PER_OCTAVE)}
+    return sorted(ids)[:RANGE_SIZE]
+
+class MessageCache:
+    """Bounded LRU of the source messages a job has already fetched, by id.
+
+    The Prefetcher fills it as batches arrive, so send paths that need the
+    full Message (FTM captions, media groups) read it from here instead of
+    calling get_messages again.
+    """
+
+    def __init__(self, maxsize=2000):
+        self.maxsize = maxsize
+        self.messages = OrderedDict()
+
+    def put(self, messages):
+        for message in messages:
+            if message is None or getattr(message, 'empty', False):
+                continue
+            self.messages[message.id] = message
+            self.messages.move_to_end(message.id)
+        while len(self.messages) > self.maxsize:
+            self.messages.popitem(last=False)
+
+    def get(self, message_id):
+        return self.messages.get(message_id)
+
+    async def fetch(self, client, chat_id, message_ids):
+        """Messages for `message_ids` in order, reading only the ones not cached"""
+        missing = [i for i in message_ids if i not in self.messages]
+        if missing:
+            fetched = await client.get_messages(chat_id, missing)
+            self.put(fetched if isinstance(fetched, list) else [fetched])
+        return [self.messages.get(i) for i in message_ids]
+
+class Prefetcher:
+    """Keep up to `depth` batches of a chat fetched ahead of the consumer.
+
+    A background task drives `client.iter_batches` into a bounded queue so the
+    fetch round-trips overlap with the time spent sending the previous batch.
+    Fetched messages are also put into `cache` when one is given, and waiting
+    for the next batch ends early when the job's cancel `token` fires.
+    """
+
+    def __init__(self, client, chat_id, limit, offset=0, depth=2, cache=None, token=None):
+        self.client = client
+        self.chat_id = chat_id
+        self.limit = limit
+        self.offset = offset
+        self.cache = cache
+        self.token = token
+        self.queue = asyncio.Queue(maxsize=depth)
+        self.task = None
+
+    def _batches(self):
+        return self.client.iter_batches(self.chat_id, self.limit, self.offset)
+
+    async def _fetch(self):
+        try:
+            async for messages in self._batches():
+                if self.cache is not None:
+                    self.cache.put(messages)
+                await self.queue.put(messages)
+        except Exception as e:
+            await self.queue.put(e)
+            return
+        await self.queue.put(None)
+
+    async def __aenter__(self):
+        self.task = asyncio.create_task(self._fetch())
+        return self
+
+    async def __aexit__(self, *exc):
+        if self.task and not self.task.done():
+            self.task.cancel()
+            try:
+                await self.task
+            except asyncio.CancelledError:
+                pass
+
+    async def __aiter__(self):
+        while True:
+            if self.token:
+                messages = await self.token.wait(self.queue.get())
+            else:
+                messages = await self.queue.get()
+            if messages is None:
+                return
+            if isinstance(messages, Exception):
+                raise messages
+            for message in messages:
+                yield message
+
+class IdFetcher(Prefetcher):
+    """Prefetcher over a list of message ids instead of a range; ids below `offset` are skipped"""
+
+    def __init__(self, client, chat_id, ids, offset=0, depth=2, cache=None, token=None):
+        self.ids = sorted(i for i in set(ids) if i >= offset)
+        super().__init__(client, chat_id, self.ids[-1] if self.ids else 0, offset, depth, cache, token)
+
+    async def _batches(self):
+        for start in range(0, len(self.ids), RANGE_SIZE):
+            yield await self.client.get_messages(self.chat_id, self.ids[start:start + RANGE_SIZE])
+
 class CLIENT:
     def __init__(self):
         self.api_id = Config.API_ID
@@ -217,9 +415,9 @@ class CLIENT:
 
     def client(self, data, user=None):
         if user == None and data.get('is_bot') == False:
-            return Client("USERBOT", self.api_id, self.api_hash, session_string=data.get('session'))
+            return Client("USERBOT", self.api_id, self.api_hash, session_string=data.get('session'), in_memory=True)
         elif user == True:
-            return Client("USERBOT", self.api_id, self.api_hash, session_string=data)
+            return Client("USERBOT", self.api_id, self.api_hash, session_string=data, in_memory=True)
         elif user != False:
             data = data.get('token')
         return Client("BOT", self.api_id, self.api_hash, bot_token=data, in_memory=True)
@@ -550,6 +748,131 @@ class CLIENT:
                 pass
             return None
 
+class ClientPool:
+    """Started clone clients shared between jobs instead of one login per job.
+
+    Clients are keyed by account id and a hash of the token/session, so a
+    replaced credential never reuses the old connection. `acquire()` hands
+    out a started client and `release()` gives it back; clients nobody holds
+    are stopped after `idle_ttl` seconds, beyond `max_size` idle clients, or
+    as soon as system memory use passes `memory_percent`. A client the
+    caller found broken is `discard()`ed: later acquires get a new one, and
+    it is stopped once the jobs still holding it have let go.
+    """
+
+    def __init__(self, idle_ttl=600, max_size=100, memory_percent=85):
+        self.idle_ttl = idle_ttl
+        self.max_size = max_size
+        self.memory_percent = memory_percent
+        self.entries = {}  # key -> {'client', 'leases', 'used'}
+        self.keys = {}  # id(client) -> key
+        self.retired = {}  # id(client) -> {'client', 'leases'} of discarded clients still held
+        self.locks = {}
+        self.reaper = None
+
+    @staticmethod
+    def key(data):
+        secret = data.get('token') or data.get('session') or ''
+        return (data.get('id'), hashlib.sha256(secret.encode()).hexdigest()[:16])
+
+    async def acquire(self, data):
+        key = self.key(data)
+        lock = self.locks.setdefault(key, asyncio.Lock())
+        async with lock:
+            entry = self.entries.get(key)
+            if entry and not entry['client'].is_connected:
+                self._forget(key)
+                entry = None
+            if entry is None:
+                client = await start_clone_bot(CLIENT().client(data))
+                entry = self.entries[key] = {'client': client, 'leases': 0, 'used': time.monotonic()}
+                self.keys[id(client)] = key
+            entry['leases'] += 1
+            entry['used'] = time.monotonic()
+        if self.reaper is None or self.reaper.done():
+            self.reaper = asyncio.create_task(self._reap())
+        return entry['client']
+
+    @staticmethod
+    def broken(error):
+        """Whether `error` means the client is unusable (session revoked, connection lost), not just the request"""
+        return isinstance(error, (Unauthorized, OSError, asyncio.TimeoutError))
+
+    async def release(self, client, error=None):
+        """Give a client back; `error`, the failure that made the caller stop using it, may discard it instead"""
+        if error is not None and self.broken(error):
+            return await self.discard(client)
+        key = self.keys.get(id(client))
+        if key is None:
+            if id(client) in self.retired:
+                return await self._let_go(client)
+            # Not pooled (or already evicted); behave like the old stop()
+            return await self._stop(client)
+        entry = self.entries[key]
+        entry['leases'] = max(0, entry['leases'] - 1)
+        entry['used'] = time.monotonic()
+        await self.evict()
+
+    async def discard(self, client):
+        """End the caller's lease on a broken client and take it out of the pool.
+
+        Other jobs may hold the same client; it is stopped only when the last
+        of them releases it, so their calls are not cut off here.
+        """
+        key = self.keys.get(id(client))
+        if key is not None:
+            leases = self.entries[key]['leases']
+            self._forget(key)
+            self.retired[id(client)] = {'client': client, 'leases': leases}
+        elif id(client) not in self.retired:
+            return await self._stop(client)
+        await self._let_go(client)
+
+    async def _let_go(self, client):
+        retired = self.retired[id(client)]
+        retired['leases'] -= 1
+        if retired['leases'] <= 0:
+            del self.retired[id(client)]
+            await self._stop(client)
+
+    async def evict(self, force=False):
+        """Stop idle clients that are past their TTL or over the size/memory budget"""
+        now = time.monotonic()
+        idle = sorted((e['used'], k) for k, e in self.entries.items() if not e['leases'])
+        pressure = force or self._under_pressure()
+        for n, (used, key) in enumerate(idle):
+            if pressure or now - used > self.idle_ttl or len(idle) - n > self.max_size:
+                client = self.entries[key]['client']
+                self._forget(key)
+                await self._stop(client)
+
+    def _under_pressure(self):
+        try:
+            return psutil.virtual_memory().percent >= self.memory_percent
+        except Exception:
+            return False
+
+    def _forget(self, key):
+        entry = self.entries.pop(key, None)
+        if entry:
+            self.keys.pop(id(entry['client']), None)
+        lock = self.locks.get(key)
+        if lock and not lock.locked():
+            del self.locks[key]
+
+    async def _stop(self, client):
+        try:
+            await client.stop()
+        except Exception:
+            pass
+
+    async def _reap(self):
+        while self.entries:
+            await asyncio.sleep(60)
+            await self.evict()
+
+client_pool = ClientPool(Config.CLIENT_IDLE_TTL, Config.MAX_POOLED_CLIENTS, Config.CLIENT_POOL_MEMORY_PERCENT)
+
 def parse_buttons(text, markup=True):
     """Parse button text into inline keyboard buttons"""
     if not text or not text.strip():
@@ -2,7 +2,7 @@ import re, asyncio
 import logging
 from database import db
 from config import temp, Config
-from .test import CLIENT , start_clone_bot
+from .test import client_pool
 from .fsub import send_force_subscribe_message
 from translation import Translation
 from utils.notifications import NotificationManager
@@ -12,7 +12,6 @@ from pyrogram.types import InlineKeyboardButton, InlineKeyboardMarkup
 
 logger = logging.getLogger(__name__)
 
-CLIENT = CLIENT()
 
 COMPLETED_BTN = InlineKeyboardMarkup(
    [
@@ -104,7 +103,7 @@ async def unequify_disabled(client, message):
       )
    sts = await confirm.reply("`processing..`")
    try:
-      bot = await start_clone_bot(CLIENT.client(_bot))
+      bot = await client_pool.acquire(_bot)
    except Exception as e:
       error_msg = f"**Error starting bot:** `{str(e)}`"
       return await sts.edit(error_msg)
@@ -121,7 +120,7 @@ async def unequify_disabled(client, message):
            f"• Send messages\n\n"
            f"<b>🔧 Please make your [userbot](t.me/{_bot['username']}) admin with full permissions and try again.</b>"
        )
-       return await bot.stop()
+       return await client_pool.release(bot)
    MESSAGES = []
    DUPLICATE = []
    total=deleted=0
@@ -131,7 +130,7 @@ async def unequify_disabled(client, message):
      async for message in bot.search_messages(chat_id=chat_id, filter="document"):
         if temp.CANCEL.get(user_id) == True:
            await sts.edit(Translation.DUPLICATE_TEXT.format(total, deleted, "ᴄᴀɴᴄᴇʟʟᴇᴅ"), reply_markup=COMPLETED_BTN)
-           return await bot.stop()
+           return await client_pool.release(bot)
         file = message.document
         if file is None:
            continue
@@ -171,7 +170,7 @@ async def unequify_disabled(client, message):
            logger.error(f"Failed to send error notification: {notify_err}")
        
        await sts.edit(error_msg)
-       return await bot.stop()
+       return await client_pool.release(bot)
    temp.lock[user_id] = False
    await sts.edit(Translation.DUPLICATE_TEXT.format(total, deleted, "ᴄᴏᴍᴘʟᴇᴛᴇᴅ"), reply_markup=COMPLETED_BTN)
    
@@ -183,5 +182,5 @@ async def unequify_disabled(client, message):
        logger.error(f"Failed to send unequify completion notification: {notify_err}")
    
    logger.info(f"Unequify completed for user {user_id}: Total={total}, Deleted={deleted}")
-   await bot.stop()
+   await client_pool.release(bot)
    
@@ -1,8 +1,49 @@
+import json
+import hashlib
 import time as tm
+from typing import NamedTuple, Optional
 from database import db 
-from .test import parse_buttons
+from config import temp
+from .test import parse_buttons, get_configs, MessageCache
+from .ftm_filters import compile_filter
+from .ftm_caption import compile_caption
 
 STATUS = {}
+CACHES = {}
+
+# Settings that change which messages a job forwards, or how; a sync mark is only exact for the same ones
+PLAN_HASH_KEYS = ('filters', 'keywords', 'exclude_keywords', 'regex', 'extension', 'file_size', 'size_limit',
+                  'duplicate', 'caption', 'button', 'forward_tag', 'protect', 'drop_captions', 'ftm_mode')
+
+def plan_hash(configs):
+    data = {key: configs.get(key) for key in PLAN_HASH_KEYS}
+    return hashlib.sha1(json.dumps(data, sort_keys=True, default=str).encode()).hexdigest()[:16]
+
+class ForwardPlan(NamedTuple):
+    """Immutable snapshot of everything a forwarding job reads per message.
+
+    Built once at job start so the hot loop never touches Mongo; rebuild it
+    when `is_stale()` reports that the user's settings have changed.
+    """
+    user_id: int
+    bot: dict
+    is_bot: bool
+    caption: Optional[str]
+    template: object
+    button: object
+    forward_tag: bool
+    protect: bool
+    drop_captions: bool
+    ftm_mode: bool
+    plan_type: str
+    features: dict
+    configs: dict
+    filter: object
+    config_hash: str
+    version: int
+
+    def is_stale(self):
+        return temp.CONFIG_VERSION.get(self.user_id, 0) != self.version
 
 class STS:
     def __init__(self, id):
@@ -12,11 +53,28 @@ class STS:
     def verify(self):
         return self.data.get(self.id)
     
-    def store(self, From, to,  skip, limit):
+    def store(self, From, to,  skip, limit, mode='full', fanout=None, ids=None):
+        # mode 'incremental': `limit` is only the last synced id and is raised to the newest message at start
+        # mode 'retry': only the message `ids` are sent (a finished job's failures), `limit` is the highest of them
+        # fanout: further target chats fed from the same fetch, each with its own counters
+        # DEAD: ids that failed to send (dead letters); `failed` counts them, `deleted` is only what is gone at the source
         self.data[self.id] = {"FROM": From, 'TO': to, 'total_files': 0, 'skip': skip, 'limit': limit,
-                      'fetched': skip, 'filtered': 0, 'deleted': 0, 'duplicate': 0, 'total': limit, 'start': 0}
+                      'fetched': sum(1 for i in ids if i < skip) if ids else skip, 'filtered': 0, 'deleted': 0, 'duplicate': 0, 'total': len(ids) if ids else limit,
+                      'start': 0, 'mode': mode, 'retries': 0, 'wasted': 0, 'failed': 0, 'DEAD': [],
+                      'IDS': list(ids) if ids else None, 'FANOUT': list(fanout or [])}
         self.get(full=True)
         return STS(self.id)
+
+    def fanout(self):
+        """An STS per extra target of the job, sharing its source, range and message cache"""
+        children = []
+        for n, target in enumerate(self.get('FANOUT') or []):
+            child = STS(f"{self.id}~{n}")
+            if not child.verify():
+                child.store(self.get('FROM'), target, self.get('skip'), self.get('limit'), self.get('mode'))
+                child.data[child.id]['PARENT'] = self.id
+            children.append(child)
+        return children
         
     def get(self, value=None, full=False):
         values = self.data.get(self.id)
@@ -31,10 +89,47 @@ class STS:
           return self.data[self.id].update({'start': tm.time()})
         self.data[self.id].update({key: self.get(key) + value}) 
     
+    def cache(self):
+        """The job's bounded cache of already fetched source messages"""
+        key = self.get('PARENT') or self.id
+        cache = CACHES.get(key)
+        if cache is None:
+           cache = CACHES[key] = MessageCache()
+        return cache
+
+    def drop_cache(self):
+        CACHES.pop(self.id, None)
+    
     def divide(self, no, by):
        by = 1 if int(by) == 0 else by 
        return int(no) / by 
     
+    async def get_plan(self, user_id, bot=None):
+        # Read the version first so a write racing with this build marks it stale
+        version = temp.CONFIG_VERSION.get(int(user_id), 0)
+        bot = bot or await db.get_bot(user_id)
+        configs = await get_configs(user_id)
+        features = await db.get_user_plan_features(user_id)
+        plan_type = await db.get_user_plan(user_id)
+        return ForwardPlan(
+            user_id=int(user_id),
+            bot=bot,
+            is_bot=bot.get('is_bot', True) if bot else True,
+            caption=configs['caption'],
+            template=compile_caption(configs['caption']),
+            button=parse_buttons(configs['button'] if configs['button'] else ''),
+            forward_tag=configs['forward_tag'],
+            protect=configs['protect'],
+            drop_captions=bool(configs.get('drop_captions', False)),
+            ftm_mode=bool(configs.get('ftm_mode', False) and features.get('ftm_mode', False)),
+            plan_type=plan_type,
+            features=features,
+            configs=configs,
+            filter=compile_filter(configs),
+            config_hash=plan_hash(configs),
+            version=version
+        )
+
     async def get_data(self, user_id):
         bot = await db.get_bot(user_id)
         k, filters = self, await db.get_filters(user_id)
@@ -17,7 +17,7 @@ from telegram.constants import ParseMode
 
 from database import db
 from config import Config, temp
-from plugins.test import CLIENT, start_clone_bot
+from plugins.test import client_pool
 from translation import Translation
 from utils.notifications import NotificationManager
 
@@ -206,8 +206,7 @@ async def receive_confirmation(update: Update, context: CallbackContext) -> int:
         last_msg_id = context.user_data.get('last_msg_id')
 
         # Start the clone bot (using Pyrogram)
-        CLIENT_instance = CLIENT()
-        bot = await start_clone_bot(CLIENT_instance.client(_bot))
+        bot = await client_pool.acquire(_bot)
 
         # Test admin access
         try:
@@ -224,7 +223,7 @@ async def receive_confirmation(update: Update, context: CallbackContext) -> int:
                 f"<b>🔧 Please make your [userbot](t.me/{_bot['username']}) admin with full permissions and try again.</b>",
                 parse_mode=ParseMode.HTML
             )
-            await bot.stop()
+            await client_pool.release(bot)
             return ConversationHandler.END
 
         MESSAGES = []
@@ -244,7 +243,7 @@ async def receive_confirmation(update: Update, context: CallbackContext) -> int:
                     Translation.DUPLICATE_TEXT.format(total, deleted, "ᴄᴀɴᴄᴇʟʟᴇᴅ"),
                     reply_markup=COMPLETED_BTN
                 )
-                await bot.stop()
+                await client_pool.release(bot)
                 temp.lock[user_id] = False
                 return ConversationHandler.END
 
@@ -307,7 +306,7 @@ async def receive_confirmation(update: Update, context: CallbackContext) -> int:
             logger.error(f"Failed to send unequify completion notification: {notify_err}")
 
         logger.info(f"Unequify completed for user {user_id}: Total={total}, Deleted={deleted}")
-        await bot.stop()
+        await client_pool.release(bot)
 
     except Exception as e:
         temp.lock[user_id] = False
@@ -323,7 +322,7 @@ async def receive_confirmation(update: Update, context: CallbackContext) -> int:
         await sts.edit_text(error_msg, parse_mode=ParseMode.HTML)
 
         if 'bot' in locals():
-            await bot.stop()
+            await client_pool.release(bot)
 
     return ConversationHandler.END
 
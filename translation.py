@@ -16,6 +16,7 @@ class Translation(object):
 <b>⏣ /start - Start bot and show main menu 
 ⏣ /trial - Get 3-day premium trial (once per year)
 ⏣ /forward - Start message forwarding process
+⏣ /sync - Forward only what is new since the last run
 ⏣ /settings - Configure your bot settings
 ⏣ /myplan - Check your subscription status
 ⏣ /commands - See all available commands
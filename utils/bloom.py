@@ -0,0 +1,35 @@
+import math
+import hashlib
+
+class BloomFilter:
+    """Fixed-size Bloom filter over string keys.
+
+    `key in bloom` is False only for keys that were never added, so a miss
+    can skip the authoritative lookup entirely. Hits may be false positives
+    (about `error_rate` while no more than `capacity` keys are added).
+    """
+
+    def __init__(self, capacity, error_rate=0.01):
+        capacity = max(1, int(capacity))
+        self.capacity = capacity
+        self.size = max(64, int(-capacity * math.log(error_rate) / (math.log(2) ** 2)))
+        self.hashes = max(1, round(self.size / capacity * math.log(2)))
+        self.bits = bytearray((self.size + 7) // 8)
+        self.count = 0
+
+    def _positions(self, key):
+        digest = hashlib.blake2b(key.encode(), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], 'little')
+        h2 = int.from_bytes(digest[8:], 'little') | 1
+        return [(h1 + i * h2) % self.size for i in range(self.hashes)]
+
+    def add(self, key):
+        for pos in self._positions(key):
+            self.bits[pos >> 3] |= 1 << (pos & 7)
+        self.count += 1
+
+    def __contains__(self, key):
+        return all(self.bits[pos >> 3] & (1 << (pos & 7)) for pos in self._positions(key))
+
+    def saturated(self):
+        return self.count > self.capacity
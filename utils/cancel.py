@@ -0,0 +1,80 @@
+import asyncio
+from config import temp
+
+class JobCancelled(Exception):
+    """Raised out of a job's wait when the job is cancelled meanwhile"""
+
+class CancelToken:
+    """Cancellation signal of one forwarding job.
+
+    Waits that go through `sleep()` or `wait()` end the moment the job is
+    cancelled instead of running their course, so a cancel takes effect
+    within one event loop turn even while the job sits in a FloodWait or
+    behind a rate limiter.
+    """
+
+    def __init__(self, user_id=None):
+        self.user_id = user_id
+        self.event = asyncio.Event()
+
+    @property
+    def cancelled(self):
+        return self.event.is_set()
+
+    def cancel(self):
+        self.event.set()
+
+    def check(self):
+        if self.event.is_set():
+            raise JobCancelled()
+
+    async def sleep(self, seconds):
+        """Sleep for `seconds`, raising JobCancelled as soon as the job is cancelled"""
+        self.check()
+        try:
+            await asyncio.wait_for(self.event.wait(), seconds)
+        except asyncio.TimeoutError:
+            return
+        raise JobCancelled()
+
+    async def wait(self, aw):
+        """Await `aw`, abandoning it and raising JobCancelled if the job is cancelled first"""
+        self.check()
+        task = asyncio.ensure_future(aw)
+        stop = asyncio.ensure_future(self.event.wait())
+        try:
+            await asyncio.wait((task, stop), return_when=asyncio.FIRST_COMPLETED)
+        finally:
+            stop.cancel()
+            if not task.done():
+                task.cancel()
+                try:
+                    await task
+                except (asyncio.CancelledError, Exception):
+                    pass
+        if task.cancelled():
+            # Only we cancel it, and only when the job was cancelled
+            raise JobCancelled()
+        return task.result()
+
+_tokens = {}  # job id -> CancelToken of the running job
+
+def open_token(job_id, user_id):
+    """Register a fresh token for a job that is starting"""
+    token = _tokens[job_id] = CancelToken(user_id)
+    return token
+
+def close_token(job_id):
+    _tokens.pop(job_id, None)
+
+def job_token(job_id):
+    """The running job's token; one that never fires when the job is not registered"""
+    return _tokens.get(job_id) or CancelToken()
+
+def cancel_jobs(user_id):
+    """Cancel every running job of the user; returns how many were signalled"""
+    temp.CANCEL[user_id] = True
+    tokens = [token for token in _tokens.values() if token.user_id == user_id]
+    for token in tokens:
+        token.cancel()
+    return len(tokens)
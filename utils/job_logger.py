@@ -0,0 +1,59 @@
+import logging
+from collections import Counter
+from config import temp
+
+logger = logging.getLogger("forwarding.job")
+
+def _format(fields):
+    parts = []
+    for key, value in fields.items():
+        if value is None:
+            continue
+        value = str(value)
+        if not value or ' ' in value or '=' in value:
+            value = '"' + value.replace('"', "'") + '"'
+        parts.append(f"{key}={value}")
+    return ' '.join(parts)
+
+class JobLogger:
+    """Leveled, structured event log for one forwarding job.
+
+    Per-message decisions go through `count()`, which only bumps a counter
+    unless debugging is switched on for the job's user (`temp.DEBUG_JOBS`).
+    `flush()` writes the counters as a single line per batch and re-reads the
+    debug switch, so it can be toggled while the job is running.
+    """
+
+    def __init__(self, job_id, user_id):
+        self.job_id = job_id
+        self.user_id = user_id
+        self.counters = Counter()
+        self.verbose = False
+        self.refresh()
+
+    def refresh(self):
+        self.verbose = self.user_id in temp.DEBUG_JOBS
+
+    def count(self, event, message_id=None, detail=None):
+        self.counters[event] += 1
+        if self.verbose:
+            self.log(logging.INFO, event, id=message_id, detail=detail)
+
+    def log(self, level, event, **fields):
+        if logger.isEnabledFor(level):
+            logger.log(level, _format({'job': self.job_id, 'user': self.user_id, 'event': event, **fields}))
+
+    def info(self, event, **fields):
+        self.log(logging.INFO, event, **fields)
+
+    def warning(self, event, **fields):
+        self.log(logging.WARNING, event, **fields)
+
+    def error(self, event, **fields):
+        self.log(logging.ERROR, event, **fields)
+
+    def flush(self, event='batch', **fields):
+        if self.counters:
+            self.info(event, **fields, **self.counters)
+            self.counters.clear()
+        self.refresh()
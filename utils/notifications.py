@@ -150,6 +150,7 @@ class NotificationManager:
             filtered = int(stats.get('filtered') or 0)
             duplicate = int(stats.get('duplicate') or 0)
             deleted = int(stats.get('deleted') or 0)
+            failed = int(stats.get('failed') or 0)
             success_rate = round((forwarded / total_processed * 100), 2) if total_processed > 0 else 0
 
             notification = f"""{header}
@@ -170,7 +171,8 @@ class NotificationManager:
 ├ <b>Successfully Forwarded:</b> {forwarded} messages
 ├ <b>Filtered Out:</b> {filtered} messages
 ├ <b>Duplicates Skipped:</b> {duplicate} messages
-├ <b>Deleted/Errors:</b> {deleted} messages
+├ <b>Deleted at Source:</b> {deleted} messages
+├ <b>Failed to Send:</b> {failed} messages
 └ <b>Success Rate:</b> {success_rate}%"""
 
             if duration:
@@ -0,0 +1,104 @@
+import time
+import asyncio
+from config import Config
+
+# Sustained sends per second Telegram tolerates into one chat, by (is_bot, chat type)
+KNOWN_LIMITS = {
+    (True, 'channel'): 1.0,      # bots: about one message per second per chat
+    (True, 'group'): 20 / 60,    # bots: 20 messages per minute in groups
+    (False, 'channel'): 0.5,
+    (False, 'group'): 20 / 60,
+}
+
+# Buckets untouched for this long are dropped from the registry
+IDLE_TTL = 3600
+
+class TokenBucket:
+    """Token bucket whose refill rate adapts to how Telegram responds.
+
+    The rate grows additively with every successful send and is cut
+    multiplicatively on FloodWait (AIMD), so each (client, chat) pair settles
+    just under the limit Telegram actually enforces for it.
+    """
+
+    def __init__(self, rate, burst=3, increase=0.02, decrease=0.5, min_rate=0.05, max_rate=None):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.increase = increase
+        self.decrease = decrease
+        self.min_rate = min_rate
+        self.max_rate = max_rate or rate * 4
+        self.blocked_until = 0
+        self.updated = self.used = time.monotonic()
+        self.lock = asyncio.Lock()
+
+    def _refill(self, now):
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    async def acquire(self, cost=1):
+        """Wait until `cost` sends are allowed; waiters are served in order"""
+        async with self.lock:
+            while True:
+                now = time.monotonic()
+                if now < self.blocked_until:
+                    await asyncio.sleep(self.blocked_until - now)
+                    continue
+                self._refill(now)
+                if self.tokens >= cost:
+                    self.tokens -= cost
+                    self.used = now
+                    return
+                await asyncio.sleep((cost - self.tokens) / self.rate)
+
+    def try_acquire(self, cost=1):
+        """Take `cost` tokens if they are available right now, without waiting"""
+        now = time.monotonic()
+        if self.lock.locked() or now < self.blocked_until:
+            return False
+        self._refill(now)
+        if self.tokens < cost:
+            return False
+        self.tokens -= cost
+        self.used = now
+        return True
+
+    def success(self):
+        self.rate = min(self.max_rate, self.rate + self.increase)
+
+    def flood(self, seconds):
+        """Back off after a FloodWait of `seconds`"""
+        self.rate = max(self.min_rate, self.rate * self.decrease)
+        self.tokens = 0
+        self.blocked_until = max(self.blocked_until, time.monotonic() + seconds)
+
+    def eta(self, sends):
+        """Seconds needed for `sends` more sends at the current rate"""
+        wait = max(0, self.blocked_until - time.monotonic())
+        return wait + max(0, sends - self.tokens) / self.rate
+
+_buckets = {}
+
+def get_limiter(client_id, chat_id, is_bot=True, chat_type=None):
+    """Return the shared bucket for sends from `client_id` into `chat_id`.
+
+    `is_bot` and `chat_type` ('channel' or 'group') only pick the starting
+    rate when the bucket is first created; later calls reuse what it learned.
+    """
+    key = (client_id, str(chat_id))
+    bucket = _buckets.get(key)
+    if bucket is None:
+        _prune()
+        rate = KNOWN_LIMITS.get((bool(is_bot), chat_type), 1 / Config.MESSAGE_DELAY)
+        bucket = _buckets[key] = TokenBucket(rate)
+    return bucket
+
+def current_rates():
+    """Current sends/second per (client, chat) pair"""
+    return {key: bucket.rate for key, bucket in _buckets.items()}
+
+def _prune():
+    now = time.monotonic()
+    for key in [key for key, bucket in _buckets.items() if now - bucket.used > IDLE_TTL and not bucket.lock.locked()]:
+        del _buckets[key]
@@ -0,0 +1,86 @@
+import random
+import asyncio
+import logging
+from pyrogram.errors import RPCError, FloodWait, InternalServerError, ServiceUnavailable, RandomIdDuplicate
+from config import Config
+
+logger = logging.getLogger(__name__)
+
+# What went wrong with a call, as far as retrying it is concerned
+FLOOD = 'flood'          # rate limited: wait as long as Telegram says, then retry
+TRANSIENT = 'transient'  # network or server hiccup: back off and retry
+PERMANENT = 'permanent'  # rejected (permissions, bad or deleted message...): retrying cannot help
+
+def classify(error):
+    if isinstance(error, FloodWait) or (isinstance(error, RPCError) and error.CODE == 420 and isinstance(error.value, int)):
+        return FLOOD
+    if isinstance(error, (InternalServerError, ServiceUnavailable, asyncio.TimeoutError, OSError)):
+        return TRANSIENT
+    return PERMANENT
+
+class RetryPolicy:
+    """Bounded retries of one Telegram call.
+
+    A call is tried at most `attempts` times. Flood errors wait the time
+    Telegram asks for (up to `max_flood` seconds, beyond that the call gives
+    up), transient errors back off exponentially with full jitter from
+    `base` up to `cap` seconds, and permanent errors are raised at once.
+    The last error is raised when the attempts run out. A call that reuses
+    its random ids on every attempt and gets RANDOM_ID_DUPLICATE on a retry
+    already went through on an earlier attempt; that counts as success and
+    returns None.
+
+    `stats`, when given, is bumped with `stats.add('retries')` for every
+    retry and `stats.add('wasted')` for every call that failed, so a job
+    can pass its STS and keep the counts with its other counters.
+    """
+
+    def __init__(self, attempts=3, base=1.0, cap=30.0, max_flood=3600):
+        self.attempts = attempts
+        self.base = base
+        self.cap = cap
+        self.max_flood = max_flood
+
+    def backoff(self, attempt):
+        """Seconds to wait before retry number `attempt` (1-based) after a transient error"""
+        return random.uniform(0, min(self.cap, self.base * 2 ** (attempt - 1)))
+
+    async def call(self, func, *args, token=None, stats=None, on_flood=None, **kwargs):
+        """Await `func(*args, **kwargs)` under the policy.
+
+        `token` is the job's CancelToken, so waits end when the job is
+        cancelled; `on_flood(seconds)` is awaited before a flood wait.
+        """
+        attempt = 0
+        while True:
+            attempt += 1
+            try:
+                return await func(*args, **kwargs)
+            except RandomIdDuplicate:
+                if attempt == 1:
+                    raise
+                return None
+            except Exception as e:
+                kind = classify(e)
+                if stats is not None:
+                    stats.add('wasted')
+                if kind == PERMANENT or attempt >= self.attempts:
+                    raise
+                if kind == FLOOD:
+                    if e.value > self.max_flood:
+                        raise
+                    delay = e.value + random.uniform(0, 1)
+                    if on_flood:
+                        await on_flood(e.value)
+                else:
+                    delay = self.backoff(attempt)
+                    logger.debug(f"Retrying {getattr(func, '__name__', func)} in {delay:.1f} s after {type(e).__name__}: {e}")
+                if stats is not None:
+                    stats.add('retries')
+            if token:
+                await token.sleep(delay)
+            else:
+                await asyncio.sleep(delay)
+
+# Sends of forwarding jobs
+SEND_RETRY = RetryPolicy(Config.RETRY_ATTEMPTS, Config.RETRY_BASE_DELAY, Config.RETRY_MAX_DELAY, Config.MAX_FLOOD_WAIT)
@@ -0,0 +1,222 @@
+import asyncio
+import logging
+from collections import OrderedDict, deque
+from config import Config
+
+logger = logging.getLogger(__name__)
+
+class SchedulerFull(Exception):
+    """Raised when a job cannot even be queued"""
+
+def job_tier(user_id, plan_type):
+    """Scheduling tier of a user's jobs: 'sudo', 'pro', 'plus' or 'free'"""
+    if Config.is_sudo_user(user_id):
+        return 'sudo'
+    if plan_type in Config.TIER_WEIGHTS:
+        return plan_type
+    # Any other paid plan type is at least a plus plan
+    return 'plus' if plan_type else 'free'
+
+class Ticket:
+    """A job's place in the scheduler, from submit until release"""
+
+    __slots__ = ('job_id', 'user_id', 'targets', 'tier', 'seq', 'future', 'granted')
+
+    def __init__(self, job_id, user_id, target, seq, tier='free'):
+        self.job_id = job_id
+        self.user_id = user_id
+        # A fan-out job writes to several chats and holds all of them
+        targets = target if isinstance(target, (list, tuple, set)) else [target]
+        self.targets = [str(t) for t in targets]
+        self.tier = tier
+        self.seq = seq
+        self.future = asyncio.get_event_loop().create_future()
+        self.granted = False
+
+class JobScheduler:
+    """Admit forwarding jobs under a global cap, weighted by plan tier.
+
+    At most `max_jobs` jobs run at once, each user runs at most `per_user`
+    of them and a target chat is written by one job at a time (a fan-out job
+    holds all of its targets). Waiting jobs sit in per-user queues served by
+    weighted fair queuing: every grant advances the user's virtual time by
+    1/weight of their tier and the user furthest behind goes next, so heavy
+    users cannot starve others and paid tiers get proportionally more
+    starts. Each tier holds at most its `shares` fraction of the slots.
+
+    Running free jobs are pre-emptible: they poll `should_yield()` and hand
+    their slot back with `suspend()` while a paid job is waiting for one.
+
+    Every submitted ticket must be passed to `release()` when the job ends
+    (or is abandoned while queued), so its user and targets are always freed.
+    """
+
+    def __init__(self, max_jobs, max_queued, per_user=1, per_user_queued=3, weights=None, shares=None):
+        self.max_jobs = max_jobs
+        self.max_queued = max_queued
+        self.per_user = per_user
+        self.per_user_queued = per_user_queued
+        self.weights = weights or {'free': 1}
+        self.shares = shares or {}
+        self.queues = OrderedDict()  # user_id -> deque of waiting tickets
+        self.running = {}  # job_id -> ticket
+        self.user_running = {}
+        self.tier_running = {}
+        self.targets = {}  # target -> job_id holding it
+        self.vtime = {}  # user_id -> virtual time after their last grant
+        self.clock = 0.0
+        self.queued = 0
+        self.seq = 0
+
+    def submit(self, job_id, user_id, target, tier='free'):
+        """Queue a job and start it right away if there is room"""
+        waiting = self.queues.get(user_id, ())
+        if job_id in self.running or any(t.job_id == job_id for t in waiting):
+            raise SchedulerFull("This task is already running or waiting in the queue.")
+        if self.queued >= self.max_queued:
+            raise SchedulerFull("The forwarding queue is full right now. Please try again in a few minutes.")
+        if len(waiting) >= self.per_user_queued:
+            raise SchedulerFull(f"You already have {len(waiting)} tasks waiting in the queue.")
+        self.seq += 1
+        ticket = Ticket(job_id, user_id, target, self.seq, tier)
+        self.queues.setdefault(user_id, deque()).append(ticket)
+        self.queued += 1
+        self._dispatch()
+        return ticket
+
+    async def wait(self, ticket, timeout=None):
+        """Wait until the ticket is granted; False if it was cancelled instead"""
+        return await asyncio.wait_for(asyncio.shield(ticket.future), timeout)
+
+    def release(self, ticket):
+        if ticket.granted:
+            if self.running.get(ticket.job_id) is ticket:
+                self._stop_running(ticket)
+        else:
+            self._unqueue(ticket)
+        self._free_targets(ticket)
+        self._dispatch()
+
+    def should_yield(self, ticket):
+        """True when this running free job's slot is wanted by a paid job that cannot start otherwise"""
+        if ticket.tier != 'free' or not ticket.granted or len(self.running) < self.max_jobs:
+            return False
+        return any(t.tier != 'free' and self._eligible(t) for queue in self.queues.values() for t in queue)
+
+    def suspend(self, ticket):
+        """Put a running job back at the head of its user's queue, keeping its targets.
+
+        Wait on the ticket again to resume; the slot goes to whoever is next.
+        """
+        if not ticket.granted or self.running.get(ticket.job_id) is not ticket:
+            return
+        self._stop_running(ticket)
+        ticket.granted = False
+        ticket.future = asyncio.get_event_loop().create_future()
+        self.queues.setdefault(ticket.user_id, deque()).appendleft(ticket)
+        self.queued += 1
+        logger.info(f"Job {ticket.job_id} of user {ticket.user_id} ({ticket.tier}) yields its slot")
+        self._dispatch()
+
+    def cancel_queued(self, user_id):
+        """Drop every job the user still has waiting; returns how many"""
+        tickets = list(self.queues.get(user_id, ()))
+        for ticket in tickets:
+            self._unqueue(ticket)
+        self._dispatch()
+        return len(tickets)
+
+    def position(self, ticket):
+        """1-based place among all waiting jobs, in submission order"""
+        if ticket.granted or ticket.future.done():
+            return 0
+        return 1 + sum(1 for q in self.queues.values() for t in q if t.seq < ticket.seq)
+
+    def has_jobs(self, user_id):
+        return user_id in self.user_running or user_id in self.queues
+
+    def is_busy(self, target):
+        return str(target) in self.targets
+
+    def stats(self):
+        return {'running': len(self.running), 'queued': self.queued, 'capacity': self.max_jobs,
+                'tiers': dict(self.tier_running)}
+
+    def _stop_running(self, ticket):
+        del self.running[ticket.job_id]
+        for counts, key in ((self.user_running, ticket.user_id), (self.tier_running, ticket.tier)):
+            counts[key] -= 1
+            if not counts[key]:
+                del counts[key]
+
+    def _free_targets(self, ticket):
+        for target in ticket.targets:
+            if self.targets.get(target) == ticket.job_id:
+                del self.targets[target]
+
+    def _unqueue(self, ticket):
+        queue = self.queues.get(ticket.user_id)
+        if queue and ticket in queue:
+            queue.remove(ticket)
+            self.queued -= 1
+            if not queue:
+                del self.queues[ticket.user_id]
+        if not ticket.future.done():
+            ticket.future.set_result(False)
+
+    def _eligible(self, ticket):
+        """Whether the ticket could start if a slot were free"""
+        if self.user_running.get(ticket.user_id, 0) >= self.per_user:
+            return False
+        # Targets a suspended job still holds remain its own
+        if any(self.targets.get(target, ticket.job_id) != ticket.job_id for target in ticket.targets):
+            return False
+        share = self.shares.get(ticket.tier, 1.0)
+        return self.tier_running.get(ticket.tier, 0) < max(1, int(self.max_jobs * share))
+
+    def _dispatch(self):
+        while len(self.running) < self.max_jobs and self.queues:
+            best = None
+            for user_id, queue in self.queues.items():
+                ticket = next((t for t in queue if self._eligible(t)), None)
+                if ticket is None:
+                    continue
+                start = max(self.vtime.get(user_id, 0.0), self.clock)
+                rank = (start, -self.weights.get(ticket.tier, 1), ticket.seq)
+                if best is None or rank < best[0]:
+                    best = (rank, ticket)
+            if best is None:
+                break
+            start, ticket = best[0][0], best[1]
+            queue = self.queues[ticket.user_id]
+            queue.remove(ticket)
+            self.queued -= 1
+            if not queue:
+                del self.queues[ticket.user_id]
+            self.clock = start
+            self.vtime[ticket.user_id] = start + 1.0 / self.weights.get(ticket.tier, 1)
+            self._grant(ticket)
+        # Idle users at or behind the clock would restart from it anyway
+        if len(self.vtime) > 2 * (len(self.queues) + len(self.user_running)) + 64:
+            for user_id in [u for u, v in self.vtime.items() if v <= self.clock and u not in self.queues and u not in self.user_running]:
+                del self.vtime[user_id]
+
+    def _grant(self, ticket):
+        ticket.granted = True
+        self.running[ticket.job_id] = ticket
+        self.user_running[ticket.user_id] = self.user_running.get(ticket.user_id, 0) + 1
+        self.tier_running[ticket.tier] = self.tier_running.get(ticket.tier, 0) + 1
+        for target in ticket.targets:
+            self.targets[target] = ticket.job_id
+        if not ticket.future.done():
+            ticket.future.set_result(True)
+        logger.info(f"Job {ticket.job_id} of user {ticket.user_id} ({ticket.tier}) started ({len(self.running)}/{self.max_jobs} running, {self.queued} queued)")
+
+scheduler = JobScheduler(
+    max_jobs=Config.MAX_CONCURRENT_JOBS,
+    max_queued=Config.MAX_QUEUED_JOBS,
+    per_user=Config.MAX_JOBS_PER_USER,
+    per_user_queued=Config.MAX_QUEUED_PER_USER,
+    weights=Config.TIER_WEIGHTS,
+    shares=Config.TIER_SHARE
+)
@@ -0,0 +1,32 @@
+import time
+from collections import OrderedDict
+
+class Throttle:
+    """Minimum interval between actions on the same key, with bounded state.
+
+    Keys are kept in the order they were last marked, so entries older than
+    `interval` (which can no longer block anything) are dropped from the
+    front as new ones arrive, and at most `maxsize` keys are ever held.
+    """
+
+    def __init__(self, interval, maxsize=1024):
+        self.interval = interval
+        self.maxsize = maxsize
+        self.last = OrderedDict()
+
+    def ready(self, key):
+        last = self.last.get(key)
+        return last is None or time.monotonic() - last >= self.interval
+
+    def mark(self, key):
+        now = time.monotonic()
+        self.last[key] = now
+        self.last.move_to_end(key)
+        while self.last:
+            oldest_key, oldest = next(iter(self.last.items()))
+            if len(self.last) <= self.maxsize and now - oldest < self.interval:
+                break
+            del self.last[oldest_key]
+
+    def forget(self, key):
+        self.last.pop(key, None)
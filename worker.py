@@ -0,0 +1,150 @@
+import os
+import signal
+import socket
+import asyncio
+import logging
+import logging.config
+from config import Config, temp
+from database import db
+from utils.cancel import cancel_jobs
+from pyrogram import Client
+from pyrogram.enums import ParseMode
+from pyrogram import utils as pyroutils
+
+logging.config.fileConfig('logging.conf')
+logging.getLogger().setLevel(logging.INFO)
+logging.getLogger("pyrogram").setLevel(logging.ERROR)
+logger = logging.getLogger(__name__)
+
+# Same peer id ranges as the bot process
+pyroutils.MIN_CHAT_ID = -999999999999
+pyroutils.MIN_CHANNEL_ID = -100999999999999
+
+# Seconds between claim attempts while the queue is empty
+POLL_INTERVAL = 2
+# A job that could not be started here (e.g. the user's local queue is full) is retried after this long
+RETRY_DELAY = 30
+
+class Worker:
+    """Claim forwarding jobs from the queue collection and run them in this process.
+
+    Each claim takes a lease that the heartbeat keeps extending; a worker
+    that dies stops renewing, and once its leases run out other workers
+    claim the items and resume them from their checkpoints. The heartbeat
+    also carries cancel requests made in the bot process over to the jobs
+    (which poll for them again at every checkpoint), and copies the users'
+    stored config versions into `temp.CONFIG_VERSION`, since settings are
+    changed in the bot process and running jobs here would never see them
+    as stale otherwise.
+    """
+
+    def __init__(self, bot, worker_id, concurrency, lease):
+        self.bot = bot
+        self.id = worker_id
+        self.concurrency = concurrency
+        self.lease = lease
+        self.jobs = {}  # queue item id -> task
+        self.users = {}  # queue item id -> user id
+        self.stopping = False
+
+    async def run(self):
+        heartbeat = asyncio.create_task(self._heartbeat())
+        logger.info(f"Worker {self.id} started ({self.concurrency} jobs at a time)")
+        try:
+            while not self.stopping:
+                if len(self.jobs) >= self.concurrency:
+                    await asyncio.sleep(1)
+                    continue
+                try:
+                    item = await db.claim_queue_item(self.id, self.lease)
+                except Exception as e:
+                    logger.error(f"Worker {self.id} failed to claim a job: {e}")
+                    item = None
+                if item is None:
+                    await asyncio.sleep(POLL_INTERVAL)
+                    continue
+                if item.get('attempts', 1) > Config.WORKER_MAX_ATTEMPTS:
+                    await self._give_up(item)
+                    continue
+                task = asyncio.create_task(self._run(item))
+                self.jobs[item['_id']] = task
+                self.users[item['_id']] = item['user_id']
+                task.add_done_callback(lambda t, key=item['_id']: (self.jobs.pop(key, None), self.users.pop(key, None)))
+        finally:
+            heartbeat.cancel()
+
+    async def _run(self, item):
+        from plugins.regix import run_claimed
+        logger.info(f"Worker {self.id} runs job {item['_id']} of user {item['user_id']} (attempt {item.get('attempts', 1)})")
+        try:
+            await run_claimed(self.bot, item)
+        except Exception as e:
+            logger.error(f"Job {item['_id']} crashed in worker {self.id}: {e}", exc_info=True)
+        finally:
+            try:
+                current = await db.get_queue_item(item['_id'])
+                if current and current.get('status') == 'active' and current.get('worker') == self.id:
+                    # Not finished here: stopped by shutdown, or never got started
+                    await db.release_queue_item(item['_id'], requeue=True, delay=0 if self.stopping else RETRY_DELAY)
+                else:
+                    await db.release_queue_item(item['_id'])
+            except Exception as e:
+                logger.error(f"Failed to release job {item['_id']}: {e}")
+
+    async def _give_up(self, item):
+        user = item['user_id']
+        logger.warning(f"Job {item['_id']} of user {user} failed {Config.WORKER_MAX_ATTEMPTS} times, giving up")
+        await db.update_queue_status(user, 'failed', item['_id'])
+        await db.release_queue_item(item['_id'])
+        try:
+            await self.bot.send_message(user, "<b>❌ Your forwarding task kept failing and was stopped. Please start it again.</b>")
+        except Exception:
+            pass
+
+    async def _heartbeat(self):
+        while True:
+            await asyncio.sleep(self.lease / 3)
+            try:
+                for user_id in await db.renew_leases(self.id, self.lease):
+                    cancel_jobs(user_id)
+            except Exception as e:
+                logger.warning(f"Worker {self.id} failed to renew its leases: {e}")
+            try:
+                if self.users:
+                    temp.CONFIG_VERSION.update(await db.get_config_versions(set(self.users.values())))
+            except Exception as e:
+                logger.warning(f"Worker {self.id} failed to read config versions: {e}")
+
+    async def shutdown(self):
+        """Stop claiming and hand unfinished jobs back to the queue"""
+        self.stopping = True
+        tasks = list(self.jobs.values())
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+async def main():
+    bot = Client(
+        f"worker-{os.getpid()}",
+        api_id=Config.API_ID,
+        api_hash=Config.API_HASH,
+        bot_token=Config.BOT_TOKEN,
+        in_memory=True,
+        # Updates stay with the bot process; workers only send and edit
+        no_updates=True
+    )
+    await bot.start()
+    bot.set_parse_mode(ParseMode.DEFAULT)
+    await db.ensure_queue_indexes()
+    worker = Worker(bot, f"{socket.gethostname()}-{os.getpid()}", Config.WORKER_CONCURRENCY, Config.WORKER_LEASE)
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, lambda: asyncio.create_task(worker.shutdown()))
+    try:
+        await worker.run()
+        await worker.shutdown()
+    finally:
+        await bot.stop()
+
+if __name__ == "__main__":
+    asyncio.run(main())